@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Benchmark of the AMRFinderPlus HTML report: the former bash generator
+# (bench/legacy/generate_html.sh) against scripts/amr_report.py on synthetic
+# AMRFinderPlus reports.
+#
+# Usage: python bench/bench_amr_report.py [--samples 300] [--hits 20] [--no_legacy]
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+
+HEADER = ["Protein identifier", "Contig id", "Start", "Stop", "Strand", "Gene symbol", "Sequence name",
+          "Scope", "Element type", "Element subtype", "Class", "Subclass", "Method", "Target length",
+          "Reference sequence length", "% Coverage of reference sequence", "% Identity to reference sequence",
+          "Alignment length", "Accession of closest sequence", "Name of closest sequence", "HMM id",
+          "HMM description"]
+GENES = ["blaTEM-1", "blaCTX-M-15", "aac(6')-Ib-cr", "sul1", "sul2", "tet(A)", "dfrA17", "qnrS1",
+         "mph(A)", "aph(3'')-Ib", "fosA", "oqxB", "acrF", "emrD", "mdtM"]
+METHODS = ["EXACTX", "BLASTX", "ALLELEX", "PARTIALX", "POINTX", "HMM"]
+
+
+def write_reports(folder, samples, hits, seed=1):
+    rng = random.Random(seed)
+    for s in range(samples):
+        with open(os.path.join(folder, f"barcode{s:04d}_ONT.txt"), "w") as out:
+            out.write("\t".join(HEADER) + "\n")
+            for h in range(hits):
+                start = rng.randint(1, 5_000_000)
+                gene = rng.choice(GENES)
+                row = ["NA", f"contig_{rng.randint(1, 9)}", str(start), str(start + 861), rng.choice("+-"),
+                       gene, f"{gene} family protein", rng.choice(["core", "plus"]), "AMR", "AMR",
+                       "BETA-LACTAM", "CEPHALOSPORIN", rng.choice(METHODS), "287", "287",
+                       f"{rng.uniform(60, 100):.2f}", f"{rng.uniform(80, 100):.2f}", "287",
+                       f"WP_{rng.randint(100000000, 999999999)}.1", f"class A beta-lactamase {gene}",
+                       "NA", "NA"]
+                out.write("\t".join(row) + "\n")
+
+
+def timed(cmd):
+    start = time.perf_counter()
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def html_size(folder):
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder) if f.endswith(".html"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=300)
+    parser.add_argument("--hits", type=int, default=20, help="AMR hits per sample")
+    parser.add_argument("--no_legacy", action="store_true", help="only time amr_report.py")
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix="bench_amr_")
+    try:
+        new_dir = os.path.join(work, "new")
+        os.makedirs(new_dir)
+        write_reports(new_dir, args.samples, args.hits)
+        print(f"{args.samples} samples x {args.hits} hits")
+
+        results = []
+        if not args.no_legacy:
+            legacy_dir = os.path.join(work, "legacy")
+            shutil.copytree(new_dir, legacy_dir)
+            seconds = timed(["bash", os.path.join(bench_dir, "legacy", "generate_html.sh"), legacy_dir])
+            results.append(("legacy generate_html.sh", seconds, html_size(legacy_dir)))
+        seconds = timed([sys.executable, os.path.join(repo_dir, "scripts", "amr_report.py"), new_dir])
+        results.append(("amr_report.py", seconds, html_size(new_dir)))
+
+        for name, seconds, size in results:
+            print(f"{name:<26} {seconds:8.2f}s {size / 1024:10.0f} KB")
+        if len(results) == 2:
+            print(f"speedup: {results[0][1] / results[1][1]:.0f}x")
+    finally:
+        shutil.rmtree(work)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+# Benchmark of the orchestration around the tools: parallel.py scheduling
+# fastplong, the fastplong summary page (generate_summary_html), the
+# AMRFinderPlus report (generate_html.sh), the rmlst.py client against a
+# local mock endpoint (bench/mock_rmlst.py) and the per-sample workflow with
+# every tool replaced by bench/stubs/tool.py. Inputs are synthetic, from 10 to
+# 1000 barcodes; the stubs sleep and burn CPU as configured, so what is left
+# is the cost of the scripts themselves. For every component and size it
+# reports the makespan, the throughput in barcodes per second, the CPU time
+# and the peak RSS of the largest process. With --save the results are kept
+# as JSON, and --baseline compares a run with such a file and fails on
+# regressions.
+#
+# Usage: python bench/bench_orchestration.py [--barcodes 10,100,1000]
+#            [--components parallel,summary,amr_report,rmlst,workflow]
+#            [--save results.json] [--baseline results.json]
+
+import argparse
+import gzip
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+scripts_dir = os.path.join(repo_dir, "scripts")
+sys.path.insert(0, os.path.join(bench_dir, "stubs"))
+
+from bench_amr_report import write_reports  # noqa: E402
+from mock_rmlst import MockRmlst  # noqa: E402
+from tool import fastplong_report, rng_for  # noqa: E402
+
+COMPONENTS = ["parallel", "summary", "amr_report", "rmlst", "workflow"]
+STUB_TOOLS = ["fastplong", "flye", "mini_align", "medaka", "medaka_consensus", "bakta", "quast", "mlst",
+              "plasmidfinder.py", "amrfinder"]
+
+
+def stub_env(work, args):
+    # the stubs under every tool name first in PATH, and no micromamba, so
+    # env_run calls them directly
+    bin_dir = os.path.join(work, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    for name in STUB_TOOLS:
+        os.symlink(os.path.join(bench_dir, "stubs", "tool.py"), os.path.join(bin_dir, name))
+    for name in ("python", "python3"):
+        os.symlink(sys.executable, os.path.join(bin_dir, name))
+    path = [d for d in os.environ.get("PATH", "").split(os.pathsep)
+            if d and not os.path.exists(os.path.join(d, "micromamba"))]
+
+    env = dict(os.environ)
+    env.update({
+        "PATH": os.pathsep.join([bin_dir] + path),
+        "STUB_SLEEP": str(args.sleep),
+        "STUB_CPU": str(args.cpu),
+        "NANONYMPH_ENV_CACHE": os.path.join(work, "envcache"),
+        "NANONYMPH_RMLST_CACHE": os.path.join(work, "rmlst_cache"),
+    })
+    return env
+
+
+def write_reads(folder, barcodes, reads, read_length, seed=1):
+    # every read is a slice of one random pool, which keeps 1000 barcodes
+    # quick to generate; the sequences do not matter to the orchestration
+    rng = random.Random(seed)
+    pool = "".join(rng.choices("ACGT", k=1_000_000))
+    quality = "".join(rng.choices("+5?DIN", k=len(pool)))
+    os.makedirs(folder, exist_ok=True)
+    for b in range(barcodes):
+        with gzip.open(os.path.join(folder, f"barcode{b:04d}.fastq.gz"), "wt", compresslevel=1) as out:
+            for r in range(reads):
+                length = rng.randint(read_length // 2, read_length * 3 // 2)
+                at = rng.randrange(len(pool) - length)
+                out.write(f"@barcode{b:04d}_read{r}\n{pool[at:at + length]}\n+\n{quality[at:at + length]}\n")
+
+
+def write_fastplong_reports(folder, barcodes, curve_length):
+    os.makedirs(folder, exist_ok=True)
+    for b in range(barcodes):
+        name = f"barcode{b:04d}.fastq.gz"
+        with open(os.path.join(folder, name + ".json"), "w") as out:
+            json.dump(fastplong_report(rng_for("fastplong", name), curve_length), out)
+        with open(os.path.join(folder, name + ".html"), "w") as out:
+            out.write("<html></html>\n")
+
+
+def write_assemblies(folder, barcodes, kb):
+    os.makedirs(folder, exist_ok=True)
+    manifest = os.path.join(folder, "manifest.tsv")
+    with open(manifest, "w") as manifest_write:
+        for b in range(barcodes):
+            rng = rng_for("assembly", str(b))
+            fasta = os.path.join(folder, f"barcode{b:04d}.fasta")
+            with open(fasta, "w") as out:
+                seq = "".join(rng.choices("ACGT", k=kb * 1000))
+                out.write(f">contig_1\n" + "\n".join(seq[i:i + 80] for i in range(0, len(seq), 80)) + "\n")
+            manifest_write.write(f"{fasta}\t{os.path.join(folder, 'out', f'barcode{b:04d}_rmlst.tsv')}\n")
+    return manifest
+
+
+def measure(cmd, env, log):
+    # wall time of the command, CPU time of it and everything it waited
+    # for, and the peak RSS of the largest of those processes
+    start = time.perf_counter()
+    with open(log, "w") as out:
+        proc = subprocess.Popen(cmd, env=env, stdout=out, stderr=subprocess.STDOUT, cwd=repo_dir)
+        _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f"{' '.join(cmd[:2])} failed, see {log}")
+    return {"wall_s": wall, "cpu_s": usage.ru_utime + usage.ru_stime, "peak_rss_mb": usage.ru_maxrss / 1024}
+
+
+def utilisation(telemetry, cores, wall):
+    # busy thread-seconds of the stages that ran over the cores x makespan
+    busy = 0.0
+    with open(telemetry) as log:
+        for line in log:
+            record = json.loads(line)
+            if record.get("wall_s") is not None and record.get("cache") != "hit":
+                busy += record["wall_s"] * min(record.get("threads") or 1, cores)
+    return busy / (cores * wall) if wall else 0.0
+
+
+def bench_parallel(work, env, barcodes, args):
+    reads_dir = os.path.join(work, "raw")
+    write_reads(reads_dir, barcodes, args.reads, args.read_length)
+    log = os.path.join(work, "parallel.log")
+    result = measure([sys.executable, os.path.join(scripts_dir, "parallel.py"), "-i", reads_dir,
+                      "-o", os.path.join(work, "fastplong"), "-n", str(args.cores),
+                      "--telemetry", os.path.join(work, "parallel.jsonl")], env, log)
+    result["extra"] = f"{utilisation(os.path.join(work, 'parallel.jsonl'), args.cores, result['wall_s']):.0%} cores busy"
+    return result
+
+
+def bench_summary(work, env, barcodes, args):
+    report_dir = os.path.join(work, "reports")
+    write_fastplong_reports(report_dir, barcodes, args.curve_length)
+    cmd = [sys.executable, "-c", f"import sys; sys.path.insert(0, {scripts_dir!r}); import parallel; "
+                                 f"parallel.generate_summary_html({report_dir!r})"]
+    cold = measure(cmd, env, os.path.join(work, "summary.log"))
+    # second run on an unchanged folder, served by the summary index
+    warm = measure(cmd, env, os.path.join(work, "summary.log"))
+    cold["extra"] = f"rerun {warm['wall_s']:.2f}s, {os.path.getsize(os.path.join(report_dir, 'overall.html')) / 1024:.0f} KB page"
+    return cold
+
+
+def bench_amr_report(work, env, barcodes, args):
+    amr_dir = os.path.join(work, "amr")
+    os.makedirs(amr_dir)
+    write_reports(amr_dir, barcodes, args.amr_hits)
+    result = measure(["bash", os.path.join(scripts_dir, "generate_html.sh"), amr_dir], env,
+                     os.path.join(work, "amr_report.log"))
+    html = sum(os.path.getsize(os.path.join(amr_dir, f)) for f in os.listdir(amr_dir) if f.endswith(".html"))
+    result["extra"] = f"{html / 1024:.0f} KB page"
+    return result
+
+
+def bench_rmlst(work, env, barcodes, args):
+    manifest = write_assemblies(os.path.join(work, "assemblies"), barcodes, args.assembly_kb)
+    server = MockRmlst(latency=args.rmlst_latency).start()
+    try:
+        result = measure([sys.executable, os.path.join(scripts_dir, "rmlst.py"), "--manifest", manifest,
+                          "--jobs", str(args.rmlst_jobs), "--no_cache", "--uri", server.uri], env,
+                         os.path.join(work, "rmlst.log"))
+    finally:
+        server.shutdown()
+        server.server_close()
+    result["extra"] = f"{server.requests} requests, {server.bytes / 1e6:.0f} MB sent"
+    return result
+
+
+def bench_workflow(work, env, barcodes, args):
+    reads_dir = os.path.join(work, "filtered")
+    write_reads(reads_dir, barcodes, args.reads, args.read_length)
+    db_root = os.path.join(work, "db")
+    for db in ("plasmidfinder", "bakta"):
+        os.makedirs(os.path.join(db_root, db))
+        with open(os.path.join(db_root, db, "version.txt"), "w") as out:
+            out.write("stub\n")
+    # no barcode is skipped or deferred on its yield
+    triage = os.path.join(work, "triage.yaml")
+    with open(triage, "w") as out:
+        out.write("{}\n")
+
+    telemetry = os.path.join(work, "workflow.jsonl")
+    server = MockRmlst(latency=args.rmlst_latency).start()
+    try:
+        result = measure([sys.executable, os.path.join(scripts_dir, "workflow.py"), "-i", reads_dir,
+                          "-o", os.path.join(work, "out"), "-d", db_root, "-t", str(args.cores),
+                          "--triage", triage, "--telemetry", telemetry,
+                          "--results_db", os.path.join(work, "results.sqlite")],
+                         dict(env, NANONYMPH_RMLST_URI=server.uri), os.path.join(work, "workflow.log"))
+    finally:
+        server.shutdown()
+        server.server_close()
+    result["extra"] = f"{utilisation(telemetry, args.cores, result['wall_s']):.0%} cores busy"
+    return result
+
+
+BENCHMARKS = {
+    "parallel": bench_parallel,
+    "summary": bench_summary,
+    "amr_report": bench_amr_report,
+    "rmlst": bench_rmlst,
+    "workflow": bench_workflow,
+}
+
+
+def compare(results, baseline, tolerance):
+    # wall time and peak RSS beyond the tolerance are regressions
+    previous = {(r["component"], r["barcodes"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = previous.get((r["component"], r["barcodes"]))
+        if old is None:
+            continue
+        for key in ("wall_s", "peak_rss_mb"):
+            if old[key] and r[key] > old[key] * (1 + tolerance):
+                regressions.append(f"{r['component']} x{r['barcodes']}: {key} {old[key]:.2f} -> {r[key]:.2f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--barcodes", default="10,100,1000", help="comma separated numbers of barcodes")
+    parser.add_argument("--components", default=",".join(COMPONENTS),
+                        help=f"comma separated subset of {','.join(COMPONENTS)}")
+    parser.add_argument("--cores", type=int, default=os.cpu_count(), help="cores given to parallel.py and the workflow")
+    parser.add_argument("--sleep", type=float, default=0.05, help="seconds every stub tool sleeps")
+    parser.add_argument("--cpu", type=float, default=0.0, help="seconds of CPU every stub tool burns")
+    parser.add_argument("--reads", type=int, default=20, help="reads per barcode")
+    parser.add_argument("--read_length", type=int, default=2000)
+    parser.add_argument("--curve_length", type=int, default=1000, help="positions of the fake fastplong curves")
+    parser.add_argument("--amr_hits", type=int, default=20, help="AMR hits per barcode")
+    parser.add_argument("--assembly_kb", type=int, default=100, help="size of the assemblies sent to rMLST")
+    parser.add_argument("--rmlst_latency", type=float, default=0.2, help="seconds the mock rMLST takes per answer")
+    parser.add_argument("--rmlst_jobs", type=int, default=8, help="concurrent rMLST queries")
+    parser.add_argument("--save", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown or growth against the baseline")
+    parser.add_argument("--keep", action="store_true", help="keep the work folders")
+    args = parser.parse_args()
+
+    sizes = [int(n) for n in args.barcodes.split(",") if n]
+    components = [c for c in args.components.split(",") if c]
+    unknown = set(components) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown components: " + ", ".join(sorted(unknown)))
+
+    root = tempfile.mkdtemp(prefix="bench_orchestration_")
+    print(f"{args.cores} cores, stubs sleep {args.sleep}s and burn {args.cpu}s CPU, work folder {root}")
+    print(f"{'component':<12} {'barcodes':>8} {'wall_s':>9} {'per_s':>9} {'cpu_s':>9} {'peak_rss_mb':>12}  notes")
+    results = []
+    try:
+        for component in components:
+            for barcodes in sizes:
+                work = os.path.join(root, f"{component}_{barcodes}")
+                os.makedirs(work)
+                result = BENCHMARKS[component](work, stub_env(work, args), barcodes, args)
+                result.update(component=component, barcodes=barcodes, per_s=barcodes / result["wall_s"])
+                results.append(result)
+                print(f"{component:<12} {barcodes:>8} {result['wall_s']:>9.2f} {result['per_s']:>9.1f} "
+                      f"{result['cpu_s']:>9.2f} {result['peak_rss_mb']:>12.0f}  {result['extra']}", flush=True)
+                if not args.keep:
+                    shutil.rmtree(work)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, "w") as out:
+            json.dump({"settings": vars(args), "results": results}, out, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_read:
+            regressions = compare(results, json.load(baseline_read)["results"], args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression)
+        if regressions:
+            return 1
+        print(f"No regression beyond {args.tolerance:.0%} of {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
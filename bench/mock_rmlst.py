@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Local stand-in for the PubMLST rMLST sequence endpoint: answers every POST
+# with a species prediction after a configurable latency, so rmlst.py can be
+# benchmarked (and the workflow run) offline. Sequences containing NOMATCH get
+# an empty answer, the same as an unknown organism.
+#
+# Usage: python bench/mock_rmlst.py [--port 8765] [--latency 0.2]
+
+import argparse
+import base64
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PATH = "/db/pubmlst_rmlst_seqdef_kiosk/schemes/1/sequence"
+TAXA = ["Escherichia coli", "Klebsiella pneumoniae", "Staphylococcus aureus", "Enterococcus faecium",
+        "Pseudomonas aeruginosa", "Acinetobacter baumannii"]
+
+
+class MockRmlst(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.latency = latency
+        self.requests = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def uri(self):
+        return f"http://127.0.0.1:{self.server_address[1]}{PATH}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes += len(body)
+        try:
+            sequence = base64.b64decode(json.loads(body)["sequence"])
+        except (ValueError, KeyError):
+            self.answer(400, {"message": "no sequence"})
+            return
+        time.sleep(self.server.latency)
+        if b"NOMATCH" in sequence:
+            self.answer(200, {})
+            return
+        # the same assembly always gets the same species
+        taxon = TAXA[sum(sequence[:4096]) % len(TAXA)]
+        self.answer(200, {"taxon_prediction": [{"rank": "SPECIES", "taxon": taxon, "support": 100,
+                                                "taxonomy": "Bacteria > " + taxon}]})
+
+    def answer(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before every answer")
+    args = parser.parse_args()
+    server = MockRmlst(args.port, args.latency)
+    print(f"Mock rMLST endpoint: {server.uri}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+# Stand-in for the external tools of the workflow (fastplong, Flye, Medaka,
+# Bakta, QUAST, mlst, PlasmidFinder, AMRFinderPlus), picked by the name it is
+# called under (the benchmark links it into a bin folder under every name).
+# It writes small outputs in the formats the workflow reads, then burns
+# STUB_CPU seconds of CPU and sleeps STUB_SLEEP seconds, so the orchestration
+# around the tools can be measured without them. A call fails when its
+# command line contains STUB_FAIL, e.g. to check that a stage resumes.
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import time
+
+AMR_HEADER = ["Protein identifier", "Contig id", "Start", "Stop", "Strand", "Gene symbol", "Sequence name",
+              "Scope", "Element type", "Element subtype", "Class", "Subclass", "Method", "Target length",
+              "Reference sequence length", "% Coverage of reference sequence", "% Identity to reference sequence",
+              "Alignment length", "Accession of closest sequence", "Name of closest sequence", "HMM id",
+              "HMM description"]
+
+
+def option(args, *names, default=None):
+    for i, arg in enumerate(args):
+        for name in names:
+            if arg == name and i + 1 < len(args):
+                return args[i + 1]
+            if name.startswith("--") and arg.startswith(name + "="):
+                return arg[len(name) + 1:]
+    return default
+
+
+def rng_for(*keys):
+    # outputs differ between samples but not between runs
+    return random.Random(hashlib.sha256("\0".join(keys).encode()).hexdigest())
+
+
+def fastplong_report(rng, curve_length):
+    def curve(low, high):
+        return [round(rng.uniform(low, high), 2) for _ in range(curve_length)]
+
+    reads = rng.randint(5_000, 200_000)
+    bases = reads * rng.randint(3_000, 12_000)
+    return {
+        "summary": {
+            "fastplong_version": "0.2.2",
+            "before_filtering": {"total_reads": reads, "total_bases": bases, "q20_rate": 0.91,
+                                 "q30_rate": 0.82, "gc_content": 0.51},
+            "after_filtering": {"total_reads": int(reads * 0.9), "total_bases": int(bases * 0.93),
+                                "q20_rate": 0.95, "q30_rate": 0.86, "gc_content": 0.51},
+        },
+        "read_before_filtering": {"quality_curves": {"mean": curve(10, 25)}, "content_curves": {"GC": curve(40, 60)}},
+        "read_after_filtering": {"quality_curves": {"mean": curve(15, 28)}, "content_curves": {"GC": curve(40, 60)}},
+    }
+
+
+def assembly(rng, kb):
+    contigs = []
+    for c in range(rng.randint(1, 4)):
+        seq = "".join(rng.choices("ACGT", k=max(1, kb * 1000 // 4)))
+        contigs.append(f">contig_{c + 1}\n" + "\n".join(seq[i:i + 80] for i in range(0, len(seq), 80)) + "\n")
+    return "".join(contigs)
+
+
+def run(name, args):
+    if name == "fastplong":
+        source = option(args, "-i")
+        out = option(args, "-o")
+        if out:
+            if source:
+                shutil.copyfile(source, out)
+            else:
+                with open(out, "wb") as out_write:
+                    shutil.copyfileobj(sys.stdin.buffer, out_write)
+        report = option(args, "--json")
+        rng = rng_for(name, report)
+        with open(report, "w") as json_write:
+            json.dump(fastplong_report(rng, int(os.environ.get("STUB_CURVE_LENGTH", 1000))), json_write)
+        with open(option(args, "--html"), "w") as html_write:
+            html_write.write("<html></html>\n")
+
+    elif name == "flye":
+        out = option(args, "--out-dir")
+        os.makedirs(out, exist_ok=True)
+        with open(os.path.join(out, "assembly.fasta"), "w") as fasta:
+            fasta.write(assembly(rng_for(name, option(args, "--nano-hq")), int(os.environ.get("STUB_ASSEMBLY_KB", 20))))
+
+    elif name == "medaka_consensus":
+        out = option(args, "-o")
+        os.makedirs(out, exist_ok=True)
+        shutil.copyfile(option(args, "-d"), os.path.join(out, "consensus.fasta"))
+
+    elif name == "mini_align":
+        prefix = option(args, "-p")
+        for ext in (".bam", ".bam.bai"):
+            with open(prefix + ext, "w") as out:
+                out.write("stub\n")
+
+    elif name == "medaka":
+        command = args[0] if args else "--help"
+        if "--help" in args:
+            print("medaka inference / sequence (stub)")
+        elif args[:2] == ["tools", "resolve_model"]:
+            print("r1041_e82_400bps_sup_v5.0.0")
+        elif command == "inference":
+            regions = args[args.index("--regions") + 1:]
+            with open(args[2], "w") as out:
+                json.dump(regions, out)
+        elif command == "sequence":
+            positional = [a for a in args[1:args.index("--threads")] if not a.startswith("--")]
+            shutil.copyfile(positional[-2], positional[-1])
+
+    elif name == "bakta":
+        out = option(args, "--output")
+        prefix = option(args, "--prefix")
+        os.makedirs(out, exist_ok=True)
+        rng = rng_for(name, args[0])
+        with open(os.path.join(out, f"{prefix}.tsv"), "w") as tsv:
+            tsv.write("# Annotated with Bakta (stub)\n#Sequence Id\tType\tStart\tStop\tStrand\tLocus Tag\tGene\tProduct\tDbXrefs\n")
+            for i in range(200):
+                start = rng.randint(1, 5_000_000)
+                tsv.write(f"contig_1\tcds\t{start}\t{start + 900}\t+\t{prefix}_{i:05d}\t\thypothetical protein\t\n")
+
+    elif name == "quast":
+        out = option(args, "-o")
+        os.makedirs(out, exist_ok=True)
+        with open(os.path.join(out, "report.txt"), "w") as report:
+            report.write("Assembly\tconsensus\n# contigs\t2\n")
+
+    elif name == "mlst":
+        rng = rng_for(name, args[0])
+        print(f"{option(args, '--label')}\tecoli_achtman_4\t{rng.randint(1, 2000)}\tadk(6)\tfumC(11)\tgyrB(4)")
+
+    elif name == "plasmidfinder.py":
+        out = option(args, "-o")
+        os.makedirs(out, exist_ok=True)
+        with open(os.path.join(out, "results_tab.tsv"), "w") as tsv:
+            tsv.write("Database\tPlasmid\tIdentity\tQuery / Template length\tContig\tPosition in contig\tNote\tAccession number\n")
+            tsv.write("enterobacteriales\tIncFIB(K)_1_Kpn3\t99.5\t560 / 560\tcontig_2\t100..660\t\tJN233704\n")
+
+    elif name == "amrfinder":
+        rng = rng_for(name, option(args, "-n"))
+        with open(option(args, "-o"), "w") as tsv:
+            tsv.write("\t".join(AMR_HEADER) + "\n")
+            for _ in range(rng.randint(5, 30)):
+                start = rng.randint(1, 5_000_000)
+                gene = rng.choice(["blaTEM-1", "blaCTX-M-15", "sul1", "tet(A)", "dfrA17", "qnrS1"])
+                tsv.write("\t".join(["NA", "contig_1", str(start), str(start + 861), "+", gene, f"{gene} protein",
+                                     "core", "AMR", "AMR", "BETA-LACTAM", "BETA-LACTAM", "EXACTX", "287", "287",
+                                     "100.00", "100.00", "287", "WP_000000001.1", gene, "NA", "NA"]) + "\n")
+
+    else:
+        print(f"stub: unknown tool {name}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def burn(seconds):
+    end = time.process_time() + seconds
+    x = 0
+    while time.process_time() < end:
+        x += 1
+
+
+def main():
+    name = os.path.basename(sys.argv[0])
+    fail = os.environ.get("STUB_FAIL")
+    if fail and fail in " ".join([name] + sys.argv[1:]):
+        print(f"stub: {name} failing as asked", file=sys.stderr)
+        return 1
+    status = run(name, sys.argv[1:])
+    burn(float(os.environ.get("STUB_CPU", 0)))
+    time.sleep(float(os.environ.get("STUB_SLEEP", 0)))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -30,3 +30,8 @@ echo "=============================="
 # Run setup scripts
 sh scripts/plasmidfinder_setup.sh $db_root
 sh scripts/bakta_setup.sh $db_root $bakta_db_type
+sh scripts/amrfinder_setup.sh $db_root
+sh scripts/sketch_setup.sh $db_root
+
+# Checksum manifests, used to verify and stage the databases before each run
+sh scripts/mamba_env.sh workflow python scripts/db_stage.py manifest $db_root
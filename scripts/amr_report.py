@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+# HTML report of the AMRFinderPlus results of all samples.
+# Every *.txt report in the folder is read once, line by line, and the
+# excluded columns are dropped by index. Rows go into the page as a compact
+# JSON blob (sample index plus the kept cells) rather than as table markup;
+# the page filters the rows in memory and only renders the rows scrolled
+# into view, so it stays responsive with hundreds of samples.
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+EXCLUDED_COLUMNS = ["Protein identifier", "Strand", "Sequence name", "Target length",
+                    "Reference sequence length", "HMM id", "HMM description", "HMM accession", "Protein id"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("folder", help="folder with the AMRFinderPlus *.txt reports")
+    parser.add_argument("--output", "-o", default=None,
+                        help="HTML file to write (default: <folder>/results_<timestamp>.html)")
+    return parser.parse_args()
+
+
+def read_header(path):
+    with open(path) as report:
+        return report.readline().rstrip("\r\n").split("\t")
+
+
+def json_script(value):
+    # JSON inside a <script> element must not close the element early
+    return json.dumps(value, separators=(",", ":")).replace("</", "<\\/")
+
+
+def write_rows(out, reports, columns):
+    # streams the rows of every report into the data blob, returns the row count
+    count = 0
+    for sample_index, path in enumerate(reports):
+        with open(path) as report:
+            header = report.readline().rstrip("\r\n").split("\t")
+            # reports of another AMRFinderPlus version may order the columns differently
+            keep = [header.index(column) if column in header else None for column in columns]
+            for line in report:
+                cells = line.rstrip("\r\n").split("\t")
+                if cells == [""]:
+                    continue
+                row = [sample_index] + [cells[i] if i is not None and i < len(cells) else "" for i in keep]
+                out.write(("," if count else "") + json_script(row))
+                count += 1
+    return count
+
+
+def generate_report(folder, output):
+    reports = sorted(glob.glob(os.path.join(folder, "*.txt")))
+    samples = [os.path.basename(path)[:-len(".txt")] for path in reports]
+    header = read_header(reports[0]) if reports else []
+    columns = [column for column in header if column not in EXCLUDED_COLUMNS]
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    tmp = output + ".tmp"
+    with open(tmp, "w", buffering=1 << 20) as out:
+        out.write(PAGE_HEAD)
+        out.write('  <script type="application/json" id="amr_data">{"columns":' + json_script(columns)
+                  + ',"samples":' + json_script(samples) + ',"rows":[')
+        count = write_rows(out, reports, columns)
+        out.write("]}</script>\n")
+        out.write(PAGE_TAIL)
+    os.replace(tmp, output)
+    return len(samples), count
+
+
+def main():
+    args = parse_args()
+    output = args.output or os.path.join(args.folder, "results_" + time.strftime("%Y-%m-%d_%H-%M") + ".html")
+    samples, rows = generate_report(args.folder, output)
+    print(f"HTML file '{output}' has been generated successfully ({samples} samples, {rows} hits).")
+    return 0
+
+
+PAGE_HEAD = r"""<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="UTF-8">
+  <meta name="viewport" content="width=device-width, initial-scale=1.0">
+  <title>AMR Finder + | Results</title>
+  <script src="https://cdnjs.cloudflare.com/ajax/libs/xlsx/0.18.5/xlsx.full.min.js"></script>
+  <style>
+    body { background-color:#1b1f24; color:#e0e0e0; font-family:'Courier New',monospace; margin:20px;}
+    h1 { text-align:center; font-size:2em; color:#8ab4f8; border-bottom:2px solid #8ab4f8; padding-bottom:10px; margin-bottom:30px;}
+    #controls { display:flex; justify-content:space-between; align-items:center; margin-bottom:20px;}
+    #left-controls { display:flex; align-items:center;}
+    #left-controls select,#left-controls button { padding:10px; margin-right:10px; background-color:#3a3f44; color:#e0e0e0; border:1px solid #8ab4f8; border-radius:5px;}
+    #left-controls button { background-color:#8ab4f8; color:#1b1f24; border:none;}
+    #left-controls button:hover { background-color:#709ace;}
+    #right-controls { display:flex; align-items:center;}
+    #right-controls select { padding:10px; margin-left:10px; background-color:#3a3f44; color:#e0e0e0; border:1px solid #8ab4f8; border-radius:5px;}
+    #row_count { margin-left:10px; }
+    .table-container { overflow:auto; width:100%; height:75vh; }
+    #table_results { table-layout:fixed; width:100%; border-collapse:collapse; }
+    #table_results th,#table_results td {
+      height:36px;
+      box-sizing:border-box;
+      white-space:nowrap;
+      overflow:hidden;
+      text-overflow:ellipsis;
+      border:1px solid #3a3f44;
+      padding:8px 10px;
+      text-align:left;
+    }
+    th { position:sticky; top:0; background-color:#30363d; color:#8ab4f8; font-size:1em;}
+    tr.even { background-color:#24292f;}
+    tr.odd { background-color:#1f2328;}
+    tr.even:hover,tr.odd:hover { background-color:#3a3f44;}
+    tr.spacer td { border:none; padding:0; }
+  </style>
+</head>
+<body>
+  <h1>AMR Finder + | Results</h1>
+  <div id="controls">
+    <div id="left-controls">
+      <select id="select_format">
+        <option value="CSV">CSV</option>
+        <option value="Excel">Excel</option>
+        <option value="TSV">TSV</option>
+      </select>
+      <button onclick="downloadTable()">Download</button>
+      <span id="row_count"></span>
+    </div>
+    <div id="right-controls">
+      <select id="select_sample" onchange="filterTable()">
+        <option value="All samples">All samples</option>
+      </select>
+      <select id="select_method" onchange="filterTable()">
+        <option value="select method">select method</option>
+        <option value="Allele">Allele</option>
+        <option value="Blast">Blast</option>
+        <option value="Exact">Exact</option>
+        <option value="Partial">Partial</option>
+        <option value="Point">Point</option>
+      </select>
+      <select id="select_scope" onchange="filterTable()">
+        <option value="select scope">select scope</option>
+        <option value="core">core</option>
+        <option value="plus">plus</option>
+      </select>
+    </div>
+  </div>
+  <div class="table-container" id="table_container">
+  <table id="table_results">
+    <thead><tr id="table_head"></tr></thead>
+    <tbody id="table_body"></tbody>
+  </table>
+  </div>
+"""
+
+PAGE_TAIL = r"""  <script>
+    // rows are [sample index, cell, cell, ...]; the columns exclude the sample
+    const data=JSON.parse(document.getElementById("amr_data").textContent);
+    const ROW_HEIGHT=36, OVERSCAN=20;
+    const container=document.getElementById("table_container");
+    const body=document.getElementById("table_body");
+    const methodColumnIndex=data.columns.indexOf("Method");
+    const scopeColumnIndex=data.columns.indexOf("Scope");
+    let visibleRows=data.rows.map((_,i)=>i);
+    let pendingRender=false;
+
+    function escapeHtml(text){
+      return String(text).replace(/[&<>"]/g,c=>({"&":"&amp;","<":"&lt;",">":"&gt;",'"':"&quot;"}[c]));
+    }
+    function setup(){
+      const head=["Sample"].concat(data.columns).map(c=>"<th title=\""+escapeHtml(c)+"\">"+escapeHtml(c)+"</th>");
+      document.getElementById("table_head").innerHTML=head.join("");
+      const sampleSel=document.getElementById("select_sample");
+      data.samples.forEach(s=>sampleSel.add(new Option(s,s)));
+      document.getElementById("select_scope").disabled=(scopeColumnIndex===-1);
+      container.addEventListener("scroll",scheduleRender);
+      window.addEventListener("resize",scheduleRender);
+      filterTable();
+    }
+    function scheduleRender(){
+      if(pendingRender)return;
+      pendingRender=true;
+      requestAnimationFrame(()=>{pendingRender=false;render();});
+    }
+    function render(){
+      // only the rows in view (plus some overscan) exist in the DOM, spacer
+      // rows stand in for the others so the scrollbar stays right
+      const total=visibleRows.length;
+      const first=Math.max(0,Math.floor(container.scrollTop/ROW_HEIGHT)-OVERSCAN);
+      const last=Math.min(total,Math.ceil((container.scrollTop+container.clientHeight)/ROW_HEIGHT)+OVERSCAN);
+      const span=data.columns.length+1;
+      const html=["<tr class=\"spacer\"><td colspan=\""+span+"\" style=\"height:"+(first*ROW_HEIGHT)+"px\"></td></tr>"];
+      for(let i=first;i<last;i++){
+        const row=data.rows[visibleRows[i]];
+        const cells=[data.samples[row[0]]].concat(row.slice(1));
+        html.push("<tr class=\""+(i%2?"odd":"even")+"\">"+cells.map(c=>{const t=escapeHtml(c);return "<td title=\""+t+"\">"+t+"</td>";}).join("")+"</tr>");
+      }
+      html.push("<tr class=\"spacer\"><td colspan=\""+span+"\" style=\"height:"+((total-last)*ROW_HEIGHT)+"px\"></td></tr>");
+      body.innerHTML=html.join("");
+    }
+    function filterTable(){
+      const sampleSel=document.getElementById("select_sample").value;
+      const sampleIndex=data.samples.indexOf(sampleSel);
+      const methodSel=document.getElementById("select_method").value.toLowerCase();
+      const scopeSel=document.getElementById("select_scope").value.toLowerCase();
+      visibleRows=[];
+      for(let i=0;i<data.rows.length;i++){
+        const row=data.rows[i];
+        if(sampleSel!=="All samples"&&row[0]!==sampleIndex)continue;
+        if(methodSel!=="select method"&&(methodColumnIndex===-1||!row[methodColumnIndex+1].toLowerCase().includes(methodSel)))continue;
+        if(scopeSel!=="select scope"&&scopeColumnIndex!==-1&&!row[scopeColumnIndex+1].toLowerCase().includes(scopeSel))continue;
+        visibleRows.push(i);
+      }
+      document.getElementById("row_count").textContent=visibleRows.length+" of "+data.rows.length+" hits";
+      container.scrollTop=0;
+      render();
+    }
+    function getFilteredFileName(){
+      const s=document.getElementById("select_sample").value.toLowerCase().replace(/\s+/g,"_");
+      const m=document.getElementById("select_method").value.toLowerCase().replace(/\s+/g,"_");
+      const sc=document.getElementById("select_scope").value.toLowerCase().replace(/\s+/g,"_");
+      return "filtered_table-"+s+"-"+m+"-"+sc;
+    }
+    function downloadTable(){
+      const format=document.getElementById("select_format").value;
+      const content=[["Sample"].concat(data.columns)];
+      visibleRows.forEach(i=>{const row=data.rows[i];content.push([data.samples[row[0]]].concat(row.slice(1)));});
+      const filename=getFilteredFileName();
+      if(format==="CSV"){
+        const csv=content.map(r=>r.map(c=>/[",\n]/.test(c)?'"'+String(c).replace(/"/g,'""')+'"':c).join(",")).join("\n");
+        const blob=new Blob([csv],{type:"text/csv;charset=utf-8;"}); const a=document.createElement("a");
+        a.href=URL.createObjectURL(blob); a.download=filename+".csv"; a.click();
+      }else if(format==="Excel"){
+        const wb=XLSX.utils.book_new(); const ws=XLSX.utils.aoa_to_sheet(content);
+        XLSX.utils.book_append_sheet(wb,ws,"Results"); XLSX.writeFile(wb,filename+".xlsx");
+      }else if(format==="TSV"){
+        const tsv=content.map(r=>r.join("\t")).join("\n");
+        const blob=new Blob([tsv],{type:"text/tab-separated-values;charset=utf-8;"}); const a=document.createElement("a");
+        a.href=URL.createObjectURL(blob); a.download=filename+".tsv"; a.click();
+      }
+    }
+    window.onload=setup;
+  </script>
+</body>
+</html>
+"""
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,9 +2,20 @@ consensus=$1
 output=$2
 species_file=$3
 threads=$4
+# database folder of amrfinder_update -d (optional, default: the one installed with AMRFinderPlus)
+db=$5
+
+. "$(dirname "$0")/mamba_env.sh"
+
+db_args=""
+if [ -d "$db/latest" ]; then
+  db_args="-d $db/latest"
+elif [ -n "$db" ] && [ -d "$db" ]; then
+  db_args="-d $db"
+fi
 
 if [ -f $species_file ]; then
-  micromamba run -n amrfinderplus amrfinder -n $consensus -o $output -O $(cat $species_file) --threads $threads --plus
+  env_run amrfinderplus amrfinder -n $consensus -o $output -O $(cat $species_file) --threads $threads --plus $db_args
 else
-  micromamba run -n amrfinderplus amrfinder -n $consensus -o $output --threads $threads --plus
+  env_run amrfinderplus amrfinder -n $consensus -o $output --threads $threads --plus $db_args
 fi
@@ -4,5 +4,7 @@ sample_name=$3
 threads=$4
 database=$5
 
-micromamba run -n bakta bakta $consensus --output $output --prefix $sample_name --threads $threads --db $database
+. "$(dirname "$0")/mamba_env.sh"
+
+env_run bakta bakta $consensus --output $output --prefix $sample_name --threads $threads --db $database
   
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+
+# Staging of the databases (Bakta, AMRFinderPlus, PlasmidFinder, the species
+# sketch) before a run.
+# Every database folder in db_root gets a checksum manifest listing the size,
+# mtime and SHA-256 of its files; the digest of the manifest identifies the
+# database content wherever it lives. Refreshing a manifest only hashes the
+# files whose size or mtime changed, so it is cheap on a network filesystem.
+# Staging is opt-in: with a local directory (node-local disk, e.g. /tmp or
+# $TMPDIR on a cluster) each database is copied to <local>/<name>/<digest>/,
+# hashing while copying, and renamed into place once complete. The copies
+# keep the mtimes of the manifest, so later runs on the node check a copy by
+# the sizes and mtimes of its files (by content with --verify) and reuse it.
+# The largest files of the hot databases can then be read ahead into the page
+# cache of the node. Without a local directory the databases are read in
+# place and neither walked nor read ahead. The version (and with staging the
+# digest) of every database used is written to a per-run record.
+#
+# Usage: db_stage.py manifest <db_root>
+#        db_stage.py stage --db_root <db_root> --local_dir /local/nanonymph-db --record databases.json
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST = ".nanonymph_manifest.json"
+COMPLETE = ".complete"
+DATABASES = ["bakta", "amrfinder", "plasmidfinder", "sketch"]
+# read by every sample, worth reading ahead
+HOT_DATABASES = ["bakta", "amrfinder"]
+CHUNK_SIZE = 1 << 20
+# local copies of older database versions kept for runs still using them
+KEEP_VERSIONS = 2
+
+
+def write_json(path, data):
+    tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp, "w") as out:
+        json.dump(data, out, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def load_manifest(db_dir):
+    try:
+        with open(os.path.join(db_dir, MANIFEST)) as manifest_read:
+            return json.load(manifest_read)
+    except (OSError, ValueError):
+        return None
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def manifest_digest(files, links):
+    # content only: the mtimes differ between the source and its copies
+    h = hashlib.sha256()
+    for rel in sorted(files):
+        h.update(f"{rel}\t{files[rel][0]}\t{files[rel][2]}\n".encode())
+    for rel in sorted(links):
+        h.update(f"{rel}\t->\t{links[rel]}\n".encode())
+    return h.hexdigest()
+
+
+def scan(db_dir, previous=None, threads=4):
+    # the manifest of db_dir; hashes of files whose size and mtime match the
+    # previous manifest are reused
+    old = (previous or {}).get("files", {})
+    files, links, todo = {}, {}, []
+    for root, dirs, names in os.walk(db_dir):
+        dirs.sort()
+        for name in sorted(set(dirs + names) - {".git"}):
+            full = os.path.join(root, name)
+            rel = os.path.relpath(full, db_dir)
+            if os.path.islink(full):
+                links[rel] = os.readlink(full)
+                continue
+            if name in dirs or name == MANIFEST or (root == db_dir and name == COMPLETE):
+                continue
+            st = os.stat(full)
+            entry = old.get(rel)
+            if entry and entry[:2] == [st.st_size, st.st_mtime_ns]:
+                files[rel] = entry
+            else:
+                files[rel] = [st.st_size, st.st_mtime_ns, None]
+                todo.append(rel)
+        # links to folders are recorded above, not followed
+        dirs[:] = [d for d in dirs if d != ".git" and not os.path.islink(os.path.join(root, d))]
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for rel, digest in zip(todo, executor.map(lambda rel: hash_file(os.path.join(db_dir, rel)), todo)):
+                files[rel][2] = digest
+    return {"files": files, "links": links, "digest": manifest_digest(files, links),
+            "bytes": sum(entry[0] for entry in files.values()), "hashed": len(todo)}
+
+
+def refresh_manifest(db_dir, threads=4):
+    # brings the manifest of db_dir up to date; a read-only database folder
+    # keeps its old manifest file but the returned one is current
+    previous = load_manifest(db_dir)
+    manifest = scan(db_dir, previous, threads)
+    hashed = manifest.pop("hashed")
+    if previous is None or previous.get("files") != manifest["files"] or previous.get("links") != manifest["links"]:
+        manifest["created"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        try:
+            write_json(os.path.join(db_dir, MANIFEST), manifest)
+        except OSError as e:
+            print(f"{db_dir}: cannot save the manifest ({e}), it is rebuilt on every run", flush=True)
+    else:
+        manifest = previous
+    return manifest, hashed
+
+
+def database_version(db_dir):
+    # the version the database declares about itself
+    try:
+        with open(os.path.join(db_dir, "version.json")) as version_read:
+            # Bakta
+            info = json.load(version_read)
+            return ".".join(str(info[k]) for k in ("major", "minor") if k in info) + \
+                (f" ({info['date']})" if "date" in info else "")
+    except (OSError, ValueError, KeyError):
+        pass
+    latest = os.path.join(db_dir, "latest")
+    if os.path.islink(latest):
+        # AMRFinderPlus (amrfinder_update -d): latest -> <version folder>
+        return os.path.basename(os.readlink(latest).rstrip("/"))
+    head = os.path.join(db_dir, ".git", "HEAD")
+    if os.path.isfile(head):
+        # PlasmidFinder (a git clone)
+        with open(head) as head_read:
+            ref = head_read.read().strip()
+        if ref.startswith("ref: "):
+            ref_file = os.path.join(db_dir, ".git", ref[5:])
+            if os.path.isfile(ref_file):
+                with open(ref_file) as ref_read:
+                    ref = ref_read.read().strip()
+        return f"git {ref[:12]}"
+    return None
+
+
+def copy_file(src, dst, entry):
+    # copies src to dst while hashing it, so the copy is verified without
+    # reading it back; the copy gets the mtime of the manifest entry
+    size, mtime, expected = entry
+    h = hashlib.sha256()
+    with open(src, "rb") as src_read, open(dst, "wb") as dst_write:
+        for chunk in iter(lambda: src_read.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+            dst_write.write(chunk)
+    if h.hexdigest() != expected:
+        raise OSError(f"{src} changed while it was copied")
+    shutil.copystat(src, dst)
+    os.utime(dst, ns=(mtime, mtime))
+
+
+def local_link(source, rel, dest):
+    # the target of link rel in the copy: a link into the database tree
+    # (amrfinder_update's latest -> <version>, possibly absolute) becomes a
+    # relative one, so the copy reads its own files and not the source's;
+    # None for a link leading out of the tree
+    resolved = os.path.normpath(os.path.join(os.path.dirname(os.path.join(os.path.abspath(source), rel)), dest))
+    for root in {os.path.abspath(source), os.path.realpath(source)}:
+        if resolved == root or resolved.startswith(root + os.sep):
+            return os.path.relpath(os.path.relpath(resolved, root), os.path.dirname(rel) or ".")
+    return None
+
+
+def verify_copy(source, local, manifest, full):
+    # the local copy matches the manifest: by size and mtime (and content
+    # with full), and every link points where the copy made it point
+    for rel, (size, mtime, digest) in manifest["files"].items():
+        path = os.path.join(local, rel)
+        try:
+            st = os.stat(path)
+            if st.st_size != size or st.st_mtime_ns != mtime or (full and hash_file(path) != digest):
+                return False
+        except OSError:
+            return False
+    for rel, dest in manifest["links"].items():
+        try:
+            if os.readlink(os.path.join(local, rel)) != (local_link(source, rel, dest) or dest):
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def copy_database(source, target, manifest, threads):
+    tmp = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    for rel in manifest["files"]:
+        os.makedirs(os.path.dirname(os.path.join(tmp, rel)), exist_ok=True)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda item: copy_file(os.path.join(source, item[0]), os.path.join(tmp, item[0]), item[1]),
+                          manifest["files"].items()))
+    for rel, dest in manifest["links"].items():
+        os.makedirs(os.path.dirname(os.path.join(tmp, rel)), exist_ok=True)
+        os.symlink(local_link(source, rel, dest) or dest, os.path.join(tmp, rel))
+    write_json(os.path.join(tmp, MANIFEST), manifest)
+    open(os.path.join(tmp, COMPLETE), "w").close()
+    os.rename(tmp, target)
+
+
+def prune(db_local, keep):
+    # drops the least recently used local copies beyond the newest `keep`
+    versions = []
+    for name in os.listdir(db_local):
+        marker = os.path.join(db_local, name, COMPLETE)
+        if os.path.isfile(marker):
+            versions.append((os.path.getmtime(marker), name))
+        elif ".tmp-" in name:
+            # left by an interrupted copy
+            shutil.rmtree(os.path.join(db_local, name), ignore_errors=True)
+    for _, name in sorted(versions, reverse=True)[keep:]:
+        shutil.rmtree(os.path.join(db_local, name), ignore_errors=True)
+
+
+def stage_database(name, source, local_dir, verify, threads):
+    record = {"source": os.path.abspath(source), "path": os.path.abspath(source),
+              "version": database_version(source), "staged": False}
+    if not local_dir:
+        # read in place, nothing to walk or hash
+        return record
+
+    # only the files whose size or mtime changed since the manifest are hashed
+    manifest, hashed = refresh_manifest(source, threads)
+    record.update(digest=manifest["digest"], files=len(manifest["files"]), bytes=manifest["bytes"])
+    if hashed:
+        print(f"{name}: hashed {hashed} new or changed files", flush=True)
+
+    db_local = os.path.join(local_dir, name)
+    target = os.path.join(db_local, manifest["digest"][:16])
+    os.makedirs(db_local, exist_ok=True)
+    # one run per node copies, the others wait for it and reuse the copy
+    with open(os.path.join(db_local, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.isfile(os.path.join(target, COMPLETE)) and verify_copy(source, target, manifest, verify):
+            print(f"{name}: local copy {target} verified", flush=True)
+        else:
+            shutil.rmtree(target, ignore_errors=True)
+            free = shutil.disk_usage(db_local).free
+            if free < manifest["bytes"] * 1.05:
+                print(f"{name}: {free / 1e9:.1f} GB free in {db_local}, {manifest['bytes'] / 1e9:.1f} GB needed, "
+                      f"using {source}", flush=True)
+                return record
+            start = time.time()
+            try:
+                copy_database(source, target, manifest, threads)
+            except OSError as e:
+                print(f"{name}: copy to {db_local} failed ({e}), using {source}", flush=True)
+                shutil.rmtree(f"{target}.tmp-{os.getpid()}", ignore_errors=True)
+                return record
+            print(f"{name}: copied {manifest['bytes'] / 1e9:.2f} GB to {target} in {time.time() - start:.0f}s",
+                  flush=True)
+        os.utime(os.path.join(target, COMPLETE))
+        prune(db_local, KEEP_VERSIONS)
+    record.update(path=target, staged=True)
+    # these still lead to the shared filesystem
+    external = sorted(rel for rel, dest in manifest["links"].items() if local_link(source, rel, dest) is None)
+    if external:
+        print(f"{name}: links leading out of the database are still read from there: {', '.join(external)}",
+              flush=True)
+        record["external_links"] = external
+    return record
+
+
+def available_memory():
+    with open("/proc/meminfo") as meminfo:
+        for line in meminfo:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def prefetch(paths, budget):
+    # asks the kernel to read the largest files ahead into the page cache,
+    # up to budget bytes; returns the number of bytes requested
+    files = []
+    for path in paths:
+        for root, dirs, names in os.walk(path):
+            for name in names:
+                full = os.path.join(root, name)
+                if not os.path.islink(full):
+                    files.append((os.path.getsize(full), full))
+    requested = 0
+    for size, full in sorted(files, reverse=True):
+        if requested + size > budget:
+            continue
+        fd = os.open(full, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+        requested += size
+    return requested
+
+
+def staged_paths(databases, names):
+    # local copies of the named databases; the shared filesystem is never
+    # read ahead, the node may not need the data
+    return [databases[name]["path"] for name in names if name in databases and databases[name]["staged"]]
+
+
+def stage(db_root, local_dir=None, names=DATABASES, verify=False, prefetch_names=HOT_DATABASES, record=None,
+          threads=4):
+    # stages every database of db_root that exists; returns {name: record}
+    # and starts reading the hot local copies ahead in a background thread
+    databases = {}
+    for name in names:
+        source = os.path.join(db_root, name)
+        if os.path.isdir(source):
+            databases[name] = stage_database(name, source, local_dir, verify, threads)
+
+    hot = staged_paths(databases, prefetch_names)
+    if hot:
+        # half of the free memory at most, the stages need the rest
+        budget = available_memory() // 2
+        threading.Thread(target=prefetch, args=(hot, budget), daemon=True).start()
+
+    if record:
+        os.makedirs(os.path.dirname(os.path.abspath(record)), exist_ok=True)
+        write_json(record, {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "db_root": os.path.abspath(db_root),
+                            "local_dir": local_dir, "databases": databases})
+    return databases
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    manifest_parser = commands.add_parser("manifest", help="write or refresh the manifests of the databases")
+    manifest_parser.add_argument("db_root")
+    manifest_parser.add_argument("--threads", "-t", type=int, default=4, help="files hashed at a time")
+    stage_parser = commands.add_parser("stage", help="copy or verify the databases on local storage")
+    stage_parser.add_argument("--db_root", "-d", required=True, help="database root directory")
+    stage_parser.add_argument("--local_dir", "-l", default=None, help="node-local folder receiving the copies")
+    stage_parser.add_argument("--verify", action="store_true",
+                              help="check the content of existing local copies, not only the file sizes")
+    stage_parser.add_argument("--prefetch", default=",".join(HOT_DATABASES),
+                              help="comma separated databases whose local copies are read ahead into the page "
+                                   "cache ('' for none)")
+    stage_parser.add_argument("--record", default=None, help="JSON file receiving the version and digest of every database")
+    stage_parser.add_argument("--threads", "-t", type=int, default=4, help="files copied or hashed at a time")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == "manifest":
+        for name in DATABASES:
+            db_dir = os.path.join(args.db_root, name)
+            if os.path.isdir(db_dir):
+                manifest, hashed = refresh_manifest(db_dir, args.threads)
+                print(f"{name}: {len(manifest['files'])} files, {manifest['bytes'] / 1e9:.2f} GB, "
+                      f"{hashed} hashed, digest {manifest['digest'][:16]}")
+        return 0
+
+    prefetch_names = [name for name in args.prefetch.split(",") if name]
+    databases = stage(args.db_root, args.local_dir, verify=args.verify, prefetch_names=[],
+                      record=args.record, threads=args.threads)
+    for name, db in databases.items():
+        print(f"{name}\t{db['path']}\t{db['version'] or '-'}\t{db.get('digest', '-')[:16]}")
+    hot = staged_paths(databases, prefetch_names)
+    if hot:
+        # the command line waits for the read-ahead requests to be issued
+        requested = prefetch(hot, available_memory() // 2)
+        print(f"Read ahead {requested / 1e9:.2f} GB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
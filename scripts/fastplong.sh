@@ -1,16 +1,16 @@
 #!/usr/bin/env bash
 set -euo pipefail
-[ $# -lt 3 ] && { echo "usage: $0 <input_dir> <output_dir> <threads>"; exit 2; }
+[ $# -lt 3 ] && { echo "usage: $0 <input_dir> <output_dir> <threads> [parallel.py options]"; exit 2; }
 
 input_dir=$1; output_dir=$2; threads=$3
+shift 3
 mkdir -p "$output_dir"
 script_dir="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
-RUNNER="micromamba run -n fastplong"
-command -v micromamba >/dev/null 2>&1 && RUNNER="micromamba run -n fastplong"
+. "$script_dir/mamba_env.sh"
 
-$RUNNER bash -lc 'command -v fastplong' >/dev/null || {
+env_run fastplong sh -c 'command -v fastplong' >/dev/null || {
   echo "fastplong not found in env 'fastplong'"; exit 1; }
 
-$RUNNER python $script_dir/parallel.py \
-  --input_dir $input_dir --out_dir $output_dir --thread $threads
+env_run fastplong python $script_dir/parallel.py \
+  --input_dir $input_dir --out_dir $output_dir --cores $threads "$@"
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# Streaming FASTQ reading and writing shared by the read processing scripts,
+# and the listing of the samples of a folder of filtered reads.
+# Gzipped files are (de)compressed by pigz in a separate process when it is
+# installed, which keeps the Python side free for parsing; otherwise the
+# gzip module is used.
+
+import gzip
+import math
+import os
+import shutil
+import subprocess
+from collections import Counter
+
+# probability that a base is wrong, by its phred+33 quality character
+ERROR_PROB = [10 ** (-(q - 33) / 10) if q >= 33 else 1.0 for q in range(256)]
+
+
+class _Pipe:
+    # file-like end of a pigz process that is waited for on close
+    def __init__(self, proc, stream):
+        self.proc = proc
+        self.stream = stream
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.stream.close()
+        if self.proc.wait() != 0:
+            raise OSError(f"pigz exited with status {self.proc.returncode}")
+
+
+def open_fastq(path, threads=1):
+    # binary stream of a plain or gzipped FASTQ file
+    with open(path, "rb") as probe:
+        gzipped = probe.read(2) == b"\x1f\x8b"
+    if not gzipped:
+        return open(path, "rb")
+    if shutil.which("pigz"):
+        proc = subprocess.Popen(["pigz", "-dc", "-p", str(max(1, threads)), path],
+                                stdout=subprocess.PIPE, bufsize=1 << 20)
+        return _Pipe(proc, proc.stdout)
+    return gzip.open(path, "rb")
+
+
+def create_fastq(path, threads=1):
+    # binary stream writing a gzipped FASTQ file
+    if shutil.which("pigz"):
+        out = open(path, "wb")
+        proc = subprocess.Popen(["pigz", "-c", "-p", str(max(1, threads))],
+                                stdin=subprocess.PIPE, stdout=out, bufsize=1 << 20)
+        out.close()
+        return _Pipe(proc, proc.stdin)
+    return gzip.open(path, "wb", compresslevel=6)
+
+
+def read_fastq(stream):
+    # yields (header, sequence, qualities) of every record, as bytes without
+    # line endings; the '+' line is dropped
+    while True:
+        header = stream.readline()
+        if not header:
+            return
+        seq = stream.readline().rstrip(b"\r\n")
+        stream.readline()
+        qual = stream.readline().rstrip(b"\r\n")
+        if not header.startswith(b"@") or len(seq) != len(qual):
+            raise ValueError(f"malformed FASTQ record {header[:80]!r}")
+        yield header.rstrip(b"\r\n"), seq, qual
+
+
+def format_record(header, seq, qual):
+    return header + b"\n" + seq + b"\n+\n" + qual + b"\n"
+
+
+def mean_quality(qual):
+    # phred score of the mean per-base error of a read (not the mean of the
+    # scores); counting the quality characters is done in C, only the
+    # distinct values are summed in Python
+    if not qual:
+        return 0.0
+    errors = sum(ERROR_PROB[q] * n for q, n in Counter(qual).items())
+    return -10 * math.log10(max(errors / len(qual), 1e-10))
+
+
+def find_samples(reads_dir):
+    # (sample, path) of the gzipped FASTQ files, sorted by file name
+    samples = []
+    for f in sorted(os.listdir(reads_dir)):
+        if f.lower().endswith(".fastq.gz"):
+            # fastplong outputs use .hq.fastq.gz
+            sample = f[:-len(".hq.fastq.gz")] if f.endswith(".hq.fastq.gz") else f[:-len(".fastq.gz")]
+            samples.append((sample, os.path.join(reads_dir, f)))
+    return samples
@@ -2,5 +2,7 @@ np_raw_file=$1
 flye_dir=$2
 threads=$3
 
+. "$(dirname "$0")/mamba_env.sh"
+
 # Run Flye assembler
-micromamba run -n flye flye --nano-hq $np_raw_file --out-dir $flye_dir --deterministic --threads $threads # Specify output and threads
+env_run flye flye --nano-hq $np_raw_file --out-dir $flye_dir --deterministic --threads $threads # Specify output and threads
@@ -0,0 +1,113 @@
+#!/bin/sh
+
+# Run a command inside a micromamba environment without paying for a full
+# `micromamba run` on every call.
+#
+# The variables an environment sets when it is activated (PATH, CONDA_PREFIX,
+# variables from activate.d scripts, ...) are resolved once with
+# `micromamba run` from a clean environment, whatever env the caller has
+# active, and cached in $NANONYMPH_ENV_CACHE (default:
+# ~/.cache/nanonymph/envs/<env>.sh). Later calls load the cached variables,
+# with the PATH entries of the env in front of the caller's PATH, and exec
+# the tool directly. A cache entry is resolved again when the env's
+# conda-meta/history changes (packages installed, updated or removed), and
+# `micromamba run` is used whenever the cached environment does not provide
+# the command. Without micromamba the command is run from PATH as is.
+#
+# Usage: . scripts/mamba_env.sh; env_run <env> <command> [args...]
+#        sh scripts/mamba_env.sh <env> <command> [args...]
+#        sh scripts/mamba_env.sh --resolve <env> [<env>...]
+
+env_cache_dir=${NANONYMPH_ENV_CACHE:-${XDG_CACHE_HOME:-$HOME/.cache}/nanonymph/envs}
+
+env_history() {
+  # checksum of the env's transaction log, changes with every install/update
+  [ -f "$1/conda-meta/history" ] && cksum < "$1/conda-meta/history"
+}
+
+env_valid() {
+  [ -f "$env_cache_dir/$1.sh" ] || return 1
+  (
+    . "$env_cache_dir/$1.sh"
+    [ -n "$env_prefix" ] && [ -d "$env_prefix" ] && [ "$(env_history "$env_prefix")" = "$env_stamp" ]
+  )
+}
+
+env_clean() {
+  # runs a command in a clean environment: an env the caller has activated
+  # must not hide the variables it shares with the one being resolved
+  env -i HOME="$HOME" PATH=/usr/bin:/bin ${MAMBA_ROOT_PREFIX:+MAMBA_ROOT_PREFIX="$MAMBA_ROOT_PREFIX"} "$@"
+}
+
+env_resolve() {
+  env=$1
+  cache="$env_cache_dir/$env.sh"
+  tmp="$cache.tmp.$$"
+  mkdir -p "$env_cache_dir" || return 1
+
+  # the variables that differ between a clean shell and the activated env
+  env_clean sh -c 'export -p' | sort > "$tmp.base"
+  if ! env_clean "${MAMBA_EXE:-$(command -v micromamba)}" run -n "$env" sh -c 'export -p' > "$tmp.raw"; then
+    rm -f "$tmp.base" "$tmp.raw"
+    return 1
+  fi
+  sort "$tmp.raw" > "$tmp.env"
+  comm -13 "$tmp.base" "$tmp.env" \
+    | grep -v -e "^export PWD=" -e "^export OLDPWD=" -e "^export SHLVL=" -e "^export _=" -e "^export PATH=" \
+    > "$tmp.diff"
+  prefix=$( . "$tmp.diff" 2>/dev/null; echo "$CONDA_PREFIX" )
+  # the PATH entries the activation added go in front of the caller's PATH
+  path_added=$( eval "$(grep "^export PATH=" "$tmp.env")"; IFS=:
+    for dir in $PATH; do
+      case ":/usr/bin:/bin:" in *":$dir:"*) ;; *) printf '%s:' "$dir" ;; esac
+    done )
+
+  {
+    echo "# micromamba env '$env', resolved $(date '+%Y-%m-%d %H:%M:%S')"
+    echo "env_prefix='$prefix'"
+    echo "env_stamp='$(env_history "$prefix")'"
+    cat "$tmp.diff"
+    echo "export PATH='$path_added'\"\$PATH\""
+  } > "$tmp"
+  rm -f "$tmp.base" "$tmp.raw" "$tmp.env" "$tmp.diff"
+
+  # multi-line values do not survive the line-based diff, never cache a broken file
+  if [ -z "$prefix" ] || ! sh -n "$tmp" 2>/dev/null; then
+    rm -f "$tmp"
+    return 1
+  fi
+  mv "$tmp" "$cache"
+}
+
+env_run() {
+  env=$1
+  shift
+  if ! command -v micromamba >/dev/null 2>&1; then
+    "$@"
+    return
+  fi
+  if ! env_valid "$env" && ! env_resolve "$env"; then
+    micromamba run -n "$env" "$@"
+    return
+  fi
+  if ( . "$env_cache_dir/$env.sh" && command -v "$1" >/dev/null 2>&1 ); then
+    ( . "$env_cache_dir/$env.sh"; exec "$@" )
+  else
+    micromamba run -n "$env" "$@"
+  fi
+}
+
+# executed rather than sourced
+if [ "$(basename "$0")" = "mamba_env.sh" ]; then
+  if [ "$1" = "--resolve" ]; then
+    shift
+    command -v micromamba >/dev/null 2>&1 || exit 0
+    status=0
+    for env in "$@"; do
+      env_valid "$env" || env_resolve "$env" || { echo "Could not resolve micromamba env '$env'" >&2; status=1; }
+    done
+    exit $status
+  fi
+  [ $# -lt 2 ] && { echo "usage: $0 <env> <command> [args...] | --resolve <env>..." >&2; exit 2; }
+  env_run "$@"
+fi
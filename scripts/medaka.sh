@@ -3,10 +3,16 @@ output_dir=$2
 assembly=$3
 threads=$4
 model=$5
+# checkpoints of an interrupted run are picked up from here (see medaka_sharded.py)
+work_dir=${6:-$(dirname "$output_dir")/shards}
 
-if [ -d $output_dir ]; then
-        echo "Deleting existing folder: $output_dir"
-        rm -rf $output_dir
-fi
+. "$(dirname "$0")/mamba_env.sh"
 
-micromamba run -n medaka medaka_consensus -i $np_raw_file -d $assembly -o $output_dir -t $threads --bacteria -m $model
+# Polish in contig/region shards running in parallel; the bacterial
+# methylation model is used when compatible with the basecaller model (given,
+# or read from the FASTQ headers), as with medaka_consensus --bacteria
+if [ -n "$model" ]; then
+        env_run medaka python "$(dirname "$0")/medaka_sharded.py" -i $np_raw_file -d $assembly -o $output_dir -w "$work_dir" -t $threads -m $model
+else
+        env_run medaka python "$(dirname "$0")/medaka_sharded.py" -i $np_raw_file -d $assembly -o $output_dir -w "$work_dir" -t $threads
+fi
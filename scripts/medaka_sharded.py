@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+# Sharded, resumable Medaka polishing; does what medaka_consensus does, in
+# steps that each leave a checkpoint in the work directory:
+#   1. the reads are aligned to the draft once (mini_align),
+#   2. the draft is cut into shards of whole contigs or overlapping regions
+#      of long ones, and `medaka inference` runs on every shard in parallel
+#      worker processes, each shard writing its own .hdf,
+#   3. `medaka sequence` stitches the shards into consensus.fasta.
+# A step's output only gets its final name once the step finished, so a
+# rerun after a crash repeats the alignment only when it never completed and
+# runs inference only for the shards that have no .hdf yet. The shard plan is
+# stored with a stamp of the inputs; different inputs start from scratch.
+#
+# Usage: medaka_sharded.py --reads <fastq> --assembly <draft.fasta> --output_dir <dir> --work_dir <dir> -t 8
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# medaka_consensus --bacteria: used when the basecaller model is one it was
+# trained on, otherwise the model matching the basecaller is used
+BACTERIAL_MODEL = "r1041_e82_400bps_bacterial_methylation"
+BACTERIAL_BASECALLERS = re.compile(r"r10\.?4\.?1_e8\.?2_400bps_(hac|sup)[@_]v(4\.[23]|5)\.")
+# regions of a split contig overlap by more than medaka's chunk overlap, so
+# the stitching step can join them like the chunks inside one shard
+REGION_OVERLAP = 2000
+MIN_SHARD = 100_000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reads", "-i", required=True, help="reads (FASTQ, optionally gzipped)")
+    parser.add_argument("--assembly", "-d", required=True, help="draft assembly to polish")
+    parser.add_argument("--output_dir", "-o", required=True, help="folder receiving consensus.fasta")
+    parser.add_argument("--work_dir", "-w", required=True, help="folder for the alignment and the shard checkpoints")
+    parser.add_argument("--threads", "-t", type=int, default=4, help="threads used by all workers together")
+    parser.add_argument("--threads_per_shard", type=int, default=2,
+                        help="threads of one medaka inference process (it scales poorly past 2 on CPU)")
+    parser.add_argument("--model", "-m", default="",
+                        help="basecaller or medaka model (default: read from the FASTQ headers)")
+    return parser.parse_args()
+
+
+def log(message):
+    print(message, flush=True)
+
+
+def run(cmd, log_file):
+    with open(log_file, "w") as out:
+        try:
+            status = subprocess.run(cmd, stdout=out, stderr=subprocess.STDOUT).returncode
+        except OSError as e:
+            raise RuntimeError(f"{cmd[0]} could not be started: {e}")
+    if status != 0:
+        raise RuntimeError(f"{cmd[0]} {cmd[1]} failed with exit status {status}, see {log_file}")
+
+
+def check_medaka():
+    # inference/sequence are medaka 2 commands (envs/medaka.yaml pins it)
+    try:
+        status = subprocess.run(["medaka", "inference", "--help"], stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL).returncode
+    except OSError as e:
+        raise RuntimeError(f"medaka could not be started: {e}")
+    if status != 0:
+        raise RuntimeError(f"'medaka inference --help' failed with exit status {status}, "
+                           "the medaka env does not provide medaka 2")
+
+
+def select_model(requested, reads):
+    # like medaka_consensus --bacteria: the basecaller model is the given one
+    # or the one in the read headers; the bacterial model replaces it when
+    # compatible. An empty result leaves the choice to medaka.
+    basecaller = requested
+    if not basecaller:
+        found = subprocess.run(["medaka", "tools", "resolve_model", "--auto_model", "consensus", reads],
+                               capture_output=True, text=True)
+        basecaller = found.stdout.strip() if found.returncode == 0 else ""
+        if not basecaller:
+            log("Basecaller model not found in the read headers, using medaka's default model")
+            return ""
+    if basecaller == BACTERIAL_MODEL or BACTERIAL_BASECALLERS.search(basecaller):
+        return BACTERIAL_MODEL
+    log(f"{basecaller} is not compatible with the bacterial model, using it as is")
+    return basecaller
+
+
+def contig_lengths(path):
+    lengths, name = {}, None
+    with open(path) as fasta:
+        for line in fasta:
+            if line.startswith(">"):
+                name = line[1:].split()[0]
+                lengths[name] = 0
+            elif name is not None:
+                lengths[name] += len(line.strip())
+    return lengths
+
+
+def plan_shards(lengths, workers):
+    # pieces of about `target` bases: whole contigs, or overlapping regions
+    # of the ones much longer than that; packed longest first into the
+    # lightest shard so the shards end at about the same time
+    total = sum(lengths.values())
+    target = max(MIN_SHARD, math.ceil(total / max(1, workers * 2)))
+    pieces = []
+    for name, length in lengths.items():
+        if length <= target * 1.5:
+            pieces.append((length, name))
+            continue
+        n = math.ceil(length / target)
+        step = math.ceil(length / n)
+        for start in range(0, length, step):
+            end = min(length, start + step + REGION_OVERLAP)
+            pieces.append((end - start, f"{name}:{start}-{end}"))
+
+    shards = [[0, []] for _ in range(max(1, min(len(pieces), math.ceil(total / target))))]
+    for size, region in sorted(pieces, reverse=True):
+        lightest = min(shards, key=lambda shard: shard[0])
+        lightest[0] += size
+        lightest[1].append(region)
+    return [regions for _, regions in shards if regions]
+
+
+def input_stamp(args, model):
+    # the draft by content, the reads by size and mtime (they can be large)
+    h = hashlib.sha256()
+    with open(args.assembly, "rb") as draft:
+        for block in iter(lambda: draft.read(1 << 20), b""):
+            h.update(block)
+    st = os.stat(args.reads)
+    return {"draft": h.hexdigest(), "reads": [os.path.abspath(args.reads), st.st_size, st.st_mtime_ns],
+            "model": model}
+
+
+def main():
+    args = parse_args()
+    check_medaka()
+    model = select_model(args.model, args.reads)
+    work = os.path.abspath(args.work_dir)
+    shard_dir = os.path.join(work, "shards")
+    plan_file = os.path.join(work, "plan.json")
+    workers = max(1, args.threads // max(1, args.threads_per_shard))
+    per_shard = max(1, min(args.threads, args.threads_per_shard))
+
+    stamp = input_stamp(args, model)
+    try:
+        with open(plan_file) as plan_read:
+            plan = json.load(plan_read)
+    except (OSError, ValueError):
+        plan = None
+    if plan is None or plan.get("stamp") != stamp:
+        if os.path.isdir(work):
+            log("Inputs changed, discarding the previous checkpoints")
+            shutil.rmtree(work)
+        os.makedirs(shard_dir)
+        plan = {"stamp": stamp, "shards": plan_shards(contig_lengths(args.assembly), workers)}
+        with open(plan_file + ".tmp", "w") as plan_write:
+            json.dump(plan, plan_write, indent=1)
+        os.replace(plan_file + ".tmp", plan_file)
+
+    # mini_align indexes the draft next to it, so it gets a link in the work dir
+    draft = os.path.join(work, "draft.fasta")
+    if not os.path.lexists(draft):
+        os.symlink(os.path.abspath(args.assembly), draft)
+
+    bam = os.path.join(work, "calls_to_draft.bam")
+    if os.path.exists(bam + ".done"):
+        log("Alignment: checkpoint found")
+    else:
+        log(f"Aligning reads to the draft ({args.threads} threads)")
+        run(["mini_align", "-i", args.reads, "-r", draft, "-P", "-m", "-p", os.path.join(work, "calls_to_draft"),
+             "-t", str(args.threads)], os.path.join(work, "align.log"))
+        open(bam + ".done", "w").close()
+
+    shards = plan["shards"]
+    hdfs = [os.path.join(shard_dir, f"shard_{i:03d}.hdf") for i in range(len(shards))]
+    todo = [i for i, hdf in enumerate(hdfs) if not os.path.exists(hdf)]
+    log(f"Inference: {len(shards)} shards, {len(shards) - len(todo)} already done, "
+        f"{min(workers, len(todo))} workers x {per_shard} threads")
+
+    def infer(i):
+        partial = os.path.join(shard_dir, f"shard_{i:03d}.partial.hdf")
+        if os.path.exists(partial):
+            os.remove(partial)
+        run(["medaka", "inference", bam, partial] + (["--model", model] if model else [])
+            + ["--threads", str(per_shard), "--regions"] + shards[i], os.path.join(shard_dir, f"shard_{i:03d}.log"))
+        os.replace(partial, hdfs[i])
+        log(f"Shard {i + 1}/{len(shards)} done ({len(shards[i])} regions)")
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=min(workers, len(todo))) as executor:
+            # list() re-raises the first failure once the running shards ended,
+            # the finished ones keep their checkpoints
+            list(executor.map(infer, todo))
+
+    log("Stitching the shards into the consensus")
+    os.makedirs(args.output_dir, exist_ok=True)
+    consensus = os.path.join(args.output_dir, "consensus.fasta")
+    partial = consensus + ".partial.fasta"
+    run(["medaka", "sequence"] + hdfs + [draft, partial, "--threads", str(min(args.threads, 4))],
+        os.path.join(work, "stitch.log"))
+    os.replace(partial, consensus)
+    log(f"Consensus written to {consensus}")
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except (RuntimeError, OSError) as e:
+        log(str(e))
+        sys.exit(1)
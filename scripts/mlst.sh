@@ -2,5 +2,7 @@ consensus=$1
 output_dir=$2
 label=$3
 
-micromamba run -n mlst mlst $consensus --label $label --quiet > $output_dir
+. "$(dirname "$0")/mamba_env.sh"
+
+env_run mlst mlst $consensus --label $label --quiet > $output_dir
 
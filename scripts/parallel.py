@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 
 # This script is used to process FASTQ files in a folder in parallel.
-# It uses the fastplong command to preprocess the FASTQ files.
+# It uses the fastplong command to preprocess the FASTQ files; a barcode
+# folder of FASTQ chunks (as written by MinKNOW) is processed as one sample.
 # It can also generate a summary HTML report of the QC metrics.
 
 import os,sys
@@ -9,17 +10,47 @@ from optparse import OptionParser
 import time
 from multiprocessing import Process, Queue
 import copy
-import subprocess
-from concurrent.futures import ThreadPoolExecutor
 import json
+import shlex
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from scheduler import Job, Scheduler
+from telemetry import Telemetry, run_stamp
 
 FASTPLONG_PY_VERSION = "0.0.1"
 
+# nominal fastplong throughput per thread, only used to predict the makespan
+# of a dry run
+FASTPLONG_MB_PER_THREAD_SEC = 20
+
+# per-job resource usage written next to the QC reports
+JOB_REPORT = "jobs.json"
+# parsed summaries of the JSON reports, see updateSummaryIndex
+SUMMARY_INDEX = ".summary_index.json"
+SUMMARY_INDEX_VERSION = 2
+
+# overall.html plots every curve binned to at most CURVE_BINS points; the
+# binned curves and the full resolution ones (loaded when zooming in) live in
+# sidecar scripts next to it instead of being inlined in the page
+CURVE_BINS = 500
+CURVES_SIDECAR = "overall_curves.js"
+FULL_CURVES_DIR = "curves"
+CURVE_KEYS = ('qual_before', 'qual_after', 'gc_before', 'gc_after')
+
+# watch mode: the end of the sequencing run (in the input dir or its parent,
+# besides MinKNOW's final_summary_*.txt), also written to the publish dir
+# once all reads are processed
+RUN_FINISHED = "RUN_FINISHED"
+# inputs processed in watch mode, with their size and mtime
+PROCESSED_STATE = ".processed.json"
+
 def parseCommand():
     usage = "A python script to use fastplong to preprocess all FASTQ files within a folder"
     parser = OptionParser(usage = usage, version = FASTPLONG_PY_VERSION)
     parser.add_option("-i", "--input_dir", dest = "input_dir", default = ".",
-        help = "the folder contains the FASTQ files to be preprocessed, by default is current dir (.)")
+        help = "the folder contains the FASTQ files (or barcode folders of FASTQ chunks) to be preprocessed, by default is current dir (.)")
     parser.add_option("-o", "--out_dir", dest = "out_dir", default = None,
         help = "the folder to store the clean FASTQ. If not specified, then there will be no output files.")
     parser.add_option("-r", "--report_dir", dest = "report_dir", default = None,
@@ -29,10 +60,25 @@ def parseCommand():
     parser.add_option("-a", "--args", dest = "args", default = None,
         help = "the arguments that will be passed to fastplong. Enclose in quotation marks. Like --args='-f 3 -t 3' ")
     parser.add_option("-p", "--parallel", dest = "parallel", default = None, type = "int",
-        help = "the number of fastplong processes can be run in parallel, if not specified, then it will be CPU_Core/4")
+        help = "the maximum number of fastplong processes run in parallel, by default only limited by --cores")
     # NEW: accept threads to forward to fastplong as -w <N>
     parser.add_option("-w", "--thread", dest = "thread", default = None, type = "int",
-        help = "threads to pass to fastplong as -w <N>")
+        help = "threads to pass to every fastplong job as -w <N>, by default set per job from its share of the input size")
+    parser.add_option("-n", "--cores", dest = "cores", default = None, type = "int",
+        help = "the total number of cores all fastplong jobs may use together, by default all CPU cores")
+    parser.add_option("-d", "--dry_run", dest = "dry_run", action = "store_true", default = False,
+        help = "print the planned schedule and its predicted makespan without running fastplong")
+    parser.add_option("--telemetry", dest = "telemetry", default = None,
+        help = "per-job telemetry log, by default <report_dir>/telemetry/<date>.fastplong.jsonl; a timeline and a summary are written next to it")
+    parser.add_option("-W", "--watch", dest = "watch", action = "store_true", default = False,
+        help = "keep watching the input folder and process FASTQ files as they are completed, until the run has finished")
+    parser.add_option("--poll", dest = "poll", default = 30, type = "float",
+        help = "seconds between two scans of the input folder in watch mode, 30 by default")
+    parser.add_option("--settle", dest = "settle", default = 120, type = "float",
+        help = "seconds a file must stay unchanged to count as complete in watch mode, 120 by default; "
+               "barcode folders of chunks are processed once the run has finished")
+    parser.add_option("--publish_dir", dest = "publish_dir", default = None,
+        help = "in watch mode, move every clean FASTQ into this folder as soon as it is ready")
     return parser.parse_args()
 
 def matchFlag(filename, flag):
@@ -47,43 +93,88 @@ def getBaseName(filename):
         if filename.endswith(ext):
             return filename[:-len(ext)]
 
-def processDir(folder, options):
+def isExcluded(name):
+    # here we skip those files with name starting with Undetermined or unclassified
+    # because these files are usually with unknown barcode and have no need to be processed
+    return name.startswith("Undetermined") or name.lower().startswith("unclassified")
+
+def listChunks(folder):
+    # the FASTQ files directly in a folder, sorted by name
     fqext = (".fq", ".fastq", ".fq.gz", ".fastq.gz")
-    
-    #is not a dir
-    if not os.path.isdir(folder):
-        return
-        
-    options_list = []
-    processed =  set()  # to avoid processing the same file multiple times
-    
+    chunks = []
+    for f in sorted(os.listdir(folder)):
+        path = os.path.join(folder, f)
+        if f.endswith(fqext) and not isExcluded(f) and os.path.isfile(path):
+            chunks.append(path)
+    return chunks
+
+class DirStat:
+    # os.stat-like summary of the chunks of a barcode directory
+    def __init__(self, chunks):
+        stats = [os.stat(c) for c in chunks]
+        self.st_size = sum(st.st_size for st in stats)
+        self.st_mtime_ns = max(st.st_mtime_ns for st in stats)
+
+def listInputs(folder):
+    # the FASTQ files of the folder with their os.stat; a subfolder with
+    # FASTQ chunks (MinKNOW's fastq_pass/barcodeNN) is one input of its own
+    inputs = {}
+
     files = os.listdir(folder)
     for f in files:
         path = os.path.join(folder, f)
-        if os.path.isdir(path):
-            continue
-        
-        isfq = False
-        for ext in fqext:
-            if f.endswith(ext):
-                isfq = True
-        if isfq == False:
+        if isExcluded(f):
             continue
 
-        if processed.__contains__(path):
+        try:
+            if os.path.isdir(path):
+                chunks = listChunks(path)
+                if chunks:
+                    inputs[path] = DirStat(chunks)
+            elif f.endswith((".fq", ".fastq", ".fq.gz", ".fastq.gz")):
+                inputs[path] = os.stat(path)
+        except OSError:
+            # removed while listing
             continue
+    return inputs
 
-        processed.add(path)
+def sampleName(path):
+    if os.path.isdir(path):
+        return os.path.basename(os.path.normpath(path))
+    return os.path.basename(getBaseName(path))
 
-        # here we skip those files with name starting with Undetermined
-        # because these files are usually with unknown barcode and have no need to be processed
-        if f.startswith("Undetermined"):
-            continue
-        
+def readCommand(path, fastplong):
+    # fastplong reading a FASTQ file, or all chunks of a barcode directory
+    # streamed through its stdin, so they never get concatenated on disk
+    if not os.path.isdir(path):
+        return "exec " + fastplong + " -i " + path
+    chunks = listChunks(path)
+    if shutil.which("pigz") and all(c.endswith(".gz") for c in chunks):
+        decompress = "pigz -dc"
+    else:
+        # -f passes plain chunks through unchanged
+        decompress = "gzip -dcf"
+    return decompress + " " + " ".join(shlex.quote(c) for c in chunks) + " | exec " + fastplong + " --stdin"
+
+def buildJobs(paths, options, first_rank = 0):
+    options_list = []
+    for path in paths:
         opt = copy.copy(options)
         opt.read_file = path
+        opt.size = DirStat(listChunks(path)).st_size if os.path.isdir(path) else os.path.getsize(path)
         options_list.append(opt)
 
+    # largest inputs first, each job gets threads from its share of the total
+    # bytes, so a huge barcode submitted last cannot stretch the whole step
+    cores = options.cores or os.cpu_count()
+    options_list.sort(key = lambda opt: opt.size, reverse = True)
+    total_size = sum(opt.size for opt in options_list) or 1
+    for opt in options_list:
+        if options.thread is not None:
+            opt.job_threads = options.thread
+        else:
+            opt.job_threads = max(1, min(cores, round(cores * opt.size / total_size)))
+
     commands = []
     for opt in options_list:
         cmd = ""
@@ -95,18 +186,19 @@ def processDir(folder, options):
         else:
             cmd = "fastplong"
         
-        cmd = cmd + " -i " + opt.read_file
+        cmd = readCommand(opt.read_file, cmd)
+        opt.out_file = None
         if opt.out_dir:
             if not os.path.exists(opt.out_dir):
                 os.makedirs(opt.out_dir)
-            out_prefix1 = os.path.join(opt.out_dir, os.path.basename(getBaseName(opt.read_file)))
-            cmd += " -o " + out_prefix1 + ".hq.fastq.gz"
+            out_prefix1 = os.path.join(opt.out_dir, sampleName(opt.read_file))
+            opt.out_file = out_prefix1 + ".hq.fastq.gz"
+            cmd += " -o " + opt.out_file
         
-        # NEW: add -w <threads> if provided, unless user already supplied -t in --args
-        if getattr(opt, "thread", None) is not None:
-            args_str = opt.args or ""
-            if " -w " not in f" {args_str} ":
-                cmd += f" -w {opt.thread}"
+        # NEW: add -w <threads>, unless user already supplied -w in --args
+        args_str = opt.args or ""
+        if " -w " not in f" {args_str} ":
+            cmd += f" -w {opt.job_threads}"
 
         if opt.args:
             cmd += " " + opt.args
@@ -115,103 +207,355 @@ def processDir(folder, options):
             if not os.path.exists(opt.report_dir):
                 os.makedirs(opt.report_dir)
         
-        report_file = os.path.join(opt.report_dir or opt.out_dir or options.input_dir, os.path.basename(opt.read_file))
+        report_file = os.path.join(opt.report_dir or opt.out_dir or options.input_dir, os.path.basename(os.path.normpath(opt.read_file)))
         cmd += " --html=" + report_file + ".html --json=" + report_file + ".json"
+        opt.log_file = report_file + ".log"
+
+        if os.path.isdir(opt.read_file):
+            # without pipefail only fastplong's status counts, and a corrupt
+            # or truncated chunk would pass as a complete barcode
+            cmd = "exec bash -o pipefail -c " + shlex.quote(cmd)
         
         commands.append(cmd)
-    
-    if len(options_list) == 0:
+
+    # exec, so the resource usage of the job is fastplong's (and the
+    # decompressor's for a barcode directory) and not the shell's
+    jobs = []
+    for rank, (opt, cmd) in enumerate(zip(options_list, commands)):
+        job = Job(os.path.basename(os.path.normpath(opt.read_file)), cmd = cmd, log = opt.log_file,
+                  threads = opt.job_threads, priority = first_rank + rank)
+        job.size = opt.size
+        job.read_file = opt.read_file
+        job.out_file = opt.out_file
+        jobs.append(job)
+    return jobs
+
+def processDir(folder, options):
+    #is not a dir
+    if not os.path.isdir(folder):
+        return
+
+    paths = sorted(listInputs(folder))
+    if len(paths) == 0:
         print("No FASTQ file found, do you call the program correctly?")
         print("See -h for help")
         return
 
-    if options.parallel is None:
-        options.parallel = max(1, os.cpu_count() // 4)
+    jobs = buildJobs(paths, options)
+    scheduler = Scheduler(options.cores or os.cpu_count(), max_jobs = options.parallel, telemetry = options.telemetry_log)
+    if options.dry_run:
+        printSchedule(scheduler, jobs)
+        return jobs
+
+    for job in jobs:
+        print("Running command: " + job.cmd.replace("exec ", "", 1))
+    scheduler.run(jobs)
+    return jobs
+
+def runFinished(folder):
+    # MinKNOW writes final_summary_*.txt into the run folder once sequencing
+    # has ended; RUN_FINISHED can also be created by hand
+    for d in (folder, os.path.dirname(os.path.abspath(folder))):
+        try:
+            names = os.listdir(d)
+        except OSError:
+            continue
+        if RUN_FINISHED in names:
+            return True
+        if any(n.startswith("final_summary") and n.endswith(".txt") for n in names):
+            return True
+    return False
+
+def publish(src, dst_dir):
+    # move the clean reads where the downstream workflow picks them up; a
+    # rename is atomic, so it never sees a half-written file
+    dst = os.path.join(dst_dir, os.path.basename(src))
+    os.makedirs(dst_dir, exist_ok = True)
+    try:
+        os.replace(src, dst)
+    except OSError:
+        # another file system: copy under a name the workflow ignores first
+        tmp = dst + ".part"
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+        os.remove(src)
+    return dst
+
+class DirWatcher:
+    # Feeds the scheduler with fastplong jobs for the FASTQ files of a folder
+    # that is still being written to. A file is complete once its size and
+    # mtime did not change for --settle seconds (right away once the run has
+    # finished). A barcode folder of chunks only counts as complete once the
+    # run has finished: MinKNOW can pause longer than --settle and then add
+    # chunks, and every new chunk would filter the whole barcode again.
+    # Processed files are remembered with their size and mtime in the report
+    # dir, so a restarted watch does not process them again. A file whose job
+    # failed or was cancelled is submitted again once it changed.
+
+    def __init__(self, folder, options):
+        self.folder = folder
+        self.options = options
+        self.state_path = os.path.join(options.report_dir, PROCESSED_STATE)
+        try:
+            with open(self.state_path) as f:
+                self.processed = json.load(f)
+        except (OSError, ValueError):
+            self.processed = {}
+        self.seen = {}      # path: (stamp, time it was first seen with that stamp)
+        self.queued = {}    # path: (stamp, job) of the last submitted job
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.last_poll = 0
+        self.summary_stale = False
+
+    def completed(self, job, stamp):
+        def after():
+            if self.options.publish_dir and job.out_file:
+                publish(job.out_file, self.options.publish_dir)
+            with self.lock:
+                self.processed[job.read_file] = stamp
+                self.queued.pop(job.read_file, None)
+                self.summary_stale = True
+                tmp = self.state_path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(self.processed, f)
+                os.replace(tmp, self.state_path)
+        return after
+
+    def __call__(self):
+        now = time.time()
+        if now - self.last_poll < self.options.poll:
+            return []
+        self.last_poll = now
+
+        if self.summary_stale:
+            self.summary_stale = False
+            generate_summary_html(self.options.report_dir, self.options.command)
+
+        # checked before listing, so every file written before the run
+        # ended is listed below
+        finished = runFinished(self.folder)
+        ready, waiting = [], 0
+        for path, st in sorted(listInputs(self.folder).items()):
+            stamp = [st.st_size, st.st_mtime_ns]
+            if self.processed.get(path) == stamp:
+                continue
+            if path in self.queued:
+                queued_stamp, queued_job = self.queued[path]
+                # still to run, or failed on this very content
+                if queued_job.status is None or queued_stamp == stamp:
+                    continue
+            if not finished and os.path.isdir(path):
+                waiting += 1
+                continue
+            first_seen = self.seen.get(path)
+            if first_seen is None or first_seen[0] != stamp:
+                self.seen[path] = (stamp, now)
+                if not finished:
+                    waiting += 1
+                    continue
+            elif not finished and now - first_seen[1] < self.options.settle:
+                waiting += 1
+                continue
+            ready.append((path, stamp))
+
+        if ready:
+            jobs = buildJobs([path for path, _ in ready], self.options, first_rank = len(self.jobs))
+            stamps = dict(ready)
+            for job in jobs:
+                job.after = self.completed(job, stamps[job.read_file])
+                if job.read_file in self.queued:
+                    print(job.name + ": changed after its job " + self.queued[job.read_file][1].status + ", running it again", flush = True)
+                self.queued[job.read_file] = (stamps[job.read_file], job)
+                print("Running command: " + job.cmd.replace("exec ", "", 1), flush = True)
+            self.jobs.extend(jobs)
+            return jobs
+        if finished and not waiting:
+            return None
+        return []
+
+def watchDir(folder, options):
+    if not os.path.isdir(folder):
+        return
+    print(f"Watching {folder} for FASTQ files (poll every {options.poll}s, complete after {options.settle}s unchanged)", flush = True)
+    watcher = DirWatcher(folder, options)
+    scheduler = Scheduler(options.cores or os.cpu_count(), max_jobs = options.parallel, telemetry = options.telemetry_log)
+    scheduler.run([], feed = watcher, interval = min(5, options.poll))
+
+    # tell the downstream workflow that no more reads will be published
+    marker_dir = options.publish_dir or options.out_dir or options.report_dir
+    os.makedirs(marker_dir, exist_ok = True)
+    with open(os.path.join(marker_dir, RUN_FINISHED), "w") as f:
+        f.write(time.strftime("%Y-%m-%d %H:%M:%S") + "\n")
+    print("Run finished, " + str(len(watcher.jobs)) + " files processed in this session", flush = True)
+    return watcher.jobs
+
+def writeJobReport(jobs, report_dir):
+    # one record per fastplong job, to find bottleneck barcodes and tune
+    # --parallel/--thread from data
+    records = []
+    for job in jobs:
+        record = {
+            "file": job.name,
+            "command": job.cmd.replace("exec ", "", 1),
+            "log": job.log,
+            "size_bytes": job.size,
+            "threads": job.threads,
+            "status": job.status,
+            "exit_status": job.returncode,
+            "wall_s": None,
+            "user_s": None,
+            "sys_s": None,
+            "max_rss_mb": None,
+            "read_mb": None,
+            "write_mb": None,
+        }
+        if job.started is not None and job.finished is not None:
+            record["wall_s"] = round(job.finished - job.started, 3)
+        if job.usage:
+            record.update({k: None if v is None else round(v, 3) for k, v in job.usage.items()})
+        records.append(record)
+
+    path = os.path.join(report_dir, JOB_REPORT)
+    with open(path, "w") as f:
+        json.dump(records, f, indent = 2)
+    return path
+
+def printSchedule(scheduler, jobs):
+    def duration(job):
+        return job.size / (FASTPLONG_MB_PER_THREAD_SEC * 1e6 * job.threads)
+
+    plan, makespan = scheduler.simulate(jobs, duration)
+    print(f"Planned schedule on {scheduler.cpus} cores (dry run):")
+    print("start(s)\tend(s)\tthreads\tsize(MB)\tfile")
+    for job, start, end in sorted(plan, key = lambda p: p[1]):
+        print(f"{start:.1f}\t{end:.1f}\t{job.threads}\t{job.size / 1e6:.1f}\t{job.name}")
+    print(f"Predicted makespan: {makespan:.1f}s (at {FASTPLONG_MB_PER_THREAD_SEC} MB/s per thread)")
+
+def binCurve(curve, bins = CURVE_BINS):
+    # mean of every `step` consecutive positions, at most `bins` points;
+    # n is the original length so the page can place the bins exactly
+    n = len(curve)
+    step = max(1, -(-n // bins))
+    y = []
+    for i in range(0, n, step):
+        chunk = [v for v in curve[i:i + step] if v is not None]
+        y.append(round(sum(chunk) / len(chunk), 4) if chunk else None)
+    return {'n': n, 'step': step, 'y': y}
+
+def parseReport(path):
+    # Summary entry of one fastplong JSON report, None for any other JSON file
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or 'fastplong_version' not in data.get('summary', {}):
+        return None
+
+    jf = os.path.basename(path)
+    summary = data.get('summary', {})
+    before = summary.get('before_filtering', {})
+    after = summary.get('after_filtering', {})
+    # Extract quality and GC curves for read1
+    curves = {
+        'qual_before': data.get('read_before_filtering', {}).get('quality_curves', {}).get('mean', []),
+        'qual_after': data.get('read_after_filtering', {}).get('quality_curves', {}).get('mean', []),
+        'gc_before': data.get('read_before_filtering', {}).get('content_curves', {}).get('GC', []),
+        'gc_after': data.get('read_after_filtering', {}).get('content_curves', {}).get('GC', []),
+    }
+    name = jf.replace('.json', '')
+    full_dir = os.path.join(os.path.dirname(path), FULL_CURVES_DIR)
+    os.makedirs(full_dir, exist_ok = True)
+    with open(os.path.join(full_dir, name + ".js"), "w") as f:
+        f.write("window.fullCurves = window.fullCurves || {};\n")
+        f.write("window.fullCurves[" + json.dumps(name) + "] = " + json.dumps(curves, separators = (',', ':')) + ";\n")
+
+    return {
+        'fastplong_version': summary.get('fastplong_version', 'unknown'),
+        'curves': {key: binCurve(curve) for key, curve in curves.items()},
+        'stat': {
+            'file': name,
+            'total_reads_before': before.get('total_reads', 0),
+            'total_reads_after': after.get('total_reads', 0),
+            'total_bases_before': before.get('total_bases', 0),
+            'total_bases_after': after.get('total_bases', 0),
+            'q20_rate_before': before.get('q20_rate', 0) * 100,
+            'q20_rate_after': after.get('q20_rate', 0) * 100,
+            'q30_rate_before': before.get('q30_rate', 0) * 100,
+            'q30_rate_after': after.get('q30_rate', 0) * 100,
+            'gc_content_before': before.get('gc_content', 0) * 100,
+            'gc_content_after': after.get('gc_content', 0) * 100,
+            'html_report': jf.replace('.json', '.html')
+        }
+    }
+
+def updateSummaryIndex(report_dir):
+    # The index remembers the parsed summary of every JSON file in the report
+    # dir by path, mtime and size, so only new or changed reports are parsed.
+    # Unrelated JSON files are remembered as None and never parsed again.
+    index_path = os.path.join(report_dir, SUMMARY_INDEX)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get('version') != SUMMARY_INDEX_VERSION:
+            index = {}
+        index = index.get('files', {})
+    except (OSError, ValueError, AttributeError):
+        index = {}
+
+    current = {}
+    stale = []
+    for jf in sorted(os.listdir(report_dir)):
+        if not jf.endswith('.json') or jf in (JOB_REPORT, SUMMARY_INDEX):
+            continue
+        path = os.path.join(report_dir, jf)
+        st = os.stat(path)
+        stamp = [st.st_mtime_ns, st.st_size]
+        cached = index.get(jf)
+        if cached and cached['stamp'] == stamp:
+            current[jf] = cached
+        else:
+            current[jf] = {'stamp': stamp, 'entry': None}
+            stale.append(jf)
+
+    if len(stale) > 1:
+        # json parsing is CPU bound, use processes rather than threads
+        with ProcessPoolExecutor(max_workers = min(len(stale), os.cpu_count())) as executor:
+            paths = [os.path.join(report_dir, jf) for jf in stale]
+            for jf, entry in zip(stale, executor.map(parseReport, paths, chunksize = 8)):
+                current[jf]['entry'] = entry
+    elif stale:
+        current[stale[0]]['entry'] = parseReport(os.path.join(report_dir, stale[0]))
+
+    if stale or len(current) != len(index):
+        for jf in set(index) - set(current):
+            # the report is gone, so is its full resolution sidecar
+            full = os.path.join(report_dir, FULL_CURVES_DIR, jf.replace('.json', '') + ".js")
+            if os.path.exists(full):
+                os.remove(full)
+        tmp = index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({'version': SUMMARY_INDEX_VERSION, 'files': current}, f)
+        os.replace(tmp, index_path)
+
+    return [current[jf]['entry'] for jf in sorted(current) if current[jf]['entry'] is not None]
 
-    # FIX: use options.parallel here
-    with ThreadPoolExecutor(max_workers=options.parallel) as executor:
-        futures = [executor.submit(run_command, cmd) for cmd in commands]
-        
-        for future in futures:
-            print(future.result())
-
-def run_command(command):
-    # Removed fastplong_debug.log writing
-    print("Running command: " + command)
-    # capture both stdout and stderr
-    result = subprocess.run(command, shell=True, capture_output=True, text=True)
-    return result.stdout
-    
 def generate_summary_html(report_dir, fastplone_cmd=None):
         # Get fastp version from JSON files
     fastplong_version = "fastplong"
     if fastplone_cmd:
         fastplong_version = fastplone_cmd
 
-    json_files = [f for f in os.listdir(report_dir) if f.endswith('.json')]
-    if json_files:
-        try:
-            # Use the first JSON file to get the fastp version
-            first_json = os.path.join(report_dir, json_files[0])
-            with open(first_json) as f:
-                data = json.load(f)
-                fastplong_version = fastplong_version + " "+ data.get('summary', {}).get('fastplong_version', 'unknown')
-        except:
-            pass
-    # Collect all JSON report files
-    json_files = [f for f in os.listdir(report_dir) if f.endswith('.json')]
-    stats = []
-    mean_qual_curves = []
-    max_len_before = 0
-    max_len_after = 0
-    gc_curves = []
-    max_len_gc_before = 0
-    max_len_gc_after = 0
-    for jf in json_files:
-        path = os.path.join(report_dir, jf)
-        with open(path) as f:
-            data = json.load(f)
-            summary = data.get('summary', {})
-            before = summary.get('before_filtering', {})
-            after = summary.get('after_filtering', {})
-            # Extract quality and GC curves for read1
-            qual_curve_before = data.get('read_before_filtering', {}).get('quality_curves', {}).get('mean', [])
-            qual_curve_after = data.get('read_after_filtering', {}).get('quality_curves', {}).get('mean', [])
-            gc_curve_before = data.get('read_before_filtering', {}).get('content_curves', {}).get('GC', [])
-            gc_curve_after = data.get('read_after_filtering', {}).get('content_curves', {}).get('GC', [])
-            mean_qual_curves.append({
-                'file': jf.replace('.json', ''),
-                'curve_before': qual_curve_before,
-                'curve_after': qual_curve_after
-            })
-            gc_curves.append({
-                'file': jf.replace('.json', ''),
-                'curve_before': gc_curve_before,
-                'curve_after': gc_curve_after
-            })
-            if len(qual_curve_before) > max_len_before:
-                max_len_before = len(qual_curve_before)
-            if len(qual_curve_after) > max_len_after:
-                max_len_after = len(qual_curve_after)
-            if len(gc_curve_before) > max_len_gc_before:
-                max_len_gc_before = len(gc_curve_before)
-            if len(gc_curve_after) > max_len_gc_after:
-                max_len_gc_after = len(gc_curve_after)
-            stat = {
-                'file': jf.replace('.json', ''),
-                'total_reads_before': before.get('total_reads', 0),
-                'total_reads_after': after.get('total_reads', 0),
-                'total_bases_before': before.get('total_bases', 0),
-                'total_bases_after': after.get('total_bases', 0),
-                'q20_rate_before': before.get('q20_rate', 0) * 100,
-                'q20_rate_after': after.get('q20_rate', 0) * 100,
-                'q30_rate_before': before.get('q30_rate', 0) * 100,
-                'q30_rate_after': after.get('q30_rate', 0) * 100,
-                'gc_content_before': before.get('gc_content', 0) * 100,
-                'gc_content_after': after.get('gc_content', 0) * 100,
-                'html_report': jf.replace('.json', '.html')
-            }
-            stats.append(stat)
+    entries = updateSummaryIndex(report_dir)
+    if entries:
+        # Use the first report to get the fastplong version
+        fastplong_version = fastplong_version + " " + entries[0]['fastplong_version']
+
+    stats = [entry['stat'] for entry in entries]
+    curves = {key: [entry['curves'][key] for entry in entries] for key in CURVE_KEYS}
+    with open(os.path.join(report_dir, CURVES_SIDECAR), 'w') as f:
+        f.write("window.overallCurves = " + json.dumps(curves, separators = (',', ':')) + ";\n")
     # Generate HTML
     html = '''
 <!DOCTYPE html>
@@ -309,92 +653,101 @@ def generate_summary_html(report_dir, fastplone_cmd=None):
         const q20After = ''' + json.dumps([s['q20_rate_after'] for s in stats]) + ''';
         const q30Before = ''' + json.dumps([s['q30_rate_before'] for s in stats]) + ''';
         const q30After = ''' + json.dumps([s['q30_rate_after'] for s in stats]) + ''';
-        // Plotly mean quality curves (before)
-        const meanQualCurves = ''' + json.dumps(mean_qual_curves) + ''';
-        const maxLenBefore = ''' + str(max_len_before) + ''';
-        const maxLenAfter = ''' + str(max_len_after) + ''';
-        const qualLabelsBefore = Array.from({length: maxLenBefore}, (_, i) => i + 1);
-        const qualLabelsAfter = Array.from({length: maxLenAfter}, (_, i) => i + 1);
-        const plotlyTracesBefore = meanQualCurves.map((item, idx) => {
-            const before = item.curve_before || [];
-            const beforePad = before.concat(Array(maxLenBefore - before.length).fill(null));
-            return {
-                x: qualLabelsBefore,
-                y: beforePad,
-                mode: 'lines',
-                name: item.file,
-                line: { width: 1 }
-            };
-        });
-        Plotly.newPlot('meanQualPlotBefore', plotlyTracesBefore, {
-            title: 'Mean Quality Curve (Read1, Before Filtering)',
-            xaxis: { title: '' },
-            yaxis: { title: 'Mean Quality', rangemode: 'tozero' },
-            legend: { orientation: 'h' },
-            margin: { t: 50, l: 60, r: 30, b: 60 }
-        }, {responsive: true});
-        // Plotly mean quality curves (after)
-        const plotlyTracesAfter = meanQualCurves.map((item, idx) => {
-            const after = item.curve_after || [];
-            const afterPad = after.concat(Array(maxLenAfter - after.length).fill(null));
-            return {
-                x: qualLabelsAfter,
-                y: afterPad,
-                mode: 'lines',
-                name: item.file,
-                line: { width: 1 }
-            };
-        });
-        Plotly.newPlot('meanQualPlotAfter', plotlyTracesAfter, {
-            title: 'Mean Quality Curve (Read1, After Filtering)',
-            xaxis: { title: '' },
-            yaxis: { title: 'Mean Quality', rangemode: 'tozero' },
-            legend: { orientation: 'h' },
-            margin: { t: 50, l: 60, r: 30, b: 60 }
-        }, {responsive: true});
-        // Plotly GC content curves (before)
-        const gcCurves = ''' + json.dumps(gc_curves) + ''';
-        const maxLenGCBefore = ''' + str(max_len_gc_before) + ''';
-        const maxLenGCAfter = ''' + str(max_len_gc_after) + ''';
-        const gcLabelsBefore = Array.from({length: maxLenGCBefore}, (_, i) => i + 1);
-        const gcLabelsAfter = Array.from({length: maxLenGCAfter}, (_, i) => i + 1);
-        const plotlyTracesGCBefore = gcCurves.map((item, idx) => {
-            const before = item.curve_before || [];
-            const beforePad = before.concat(Array(maxLenGCBefore - before.length).fill(null));
+        // Plotly quality and GC curves. The binned curves are loaded from
+        // overall_curves.js once the charts scroll into view, the full
+        // resolution curves of curves/<file>.js only when zooming in.
+        const curveBins = ''' + str(CURVE_BINS) + ''';
+        const curvesSidecar = ''' + json.dumps(CURVES_SIDECAR) + ''';
+        const fullCurvesDir = ''' + json.dumps(FULL_CURVES_DIR) + ''';
+        const curvePlots = [
+            { id: 'meanQualPlotBefore', key: 'qual_before', title: 'Mean Quality Curve (Read1, Before Filtering)', yTitle: 'Mean Quality' },
+            { id: 'meanQualPlotAfter', key: 'qual_after', title: 'Mean Quality Curve (Read1, After Filtering)', yTitle: 'Mean Quality' },
+            { id: 'gcCurvePlotBefore', key: 'gc_before', title: 'GC Content Curve (Read1, Before Filtering)', yTitle: 'GC %' },
+            { id: 'gcCurvePlotAfter', key: 'gc_after', title: 'GC Content Curve (Read1, After Filtering)', yTitle: 'GC %' }
+        ];
+        function loadScript(src) {
+            return new Promise((resolve, reject) => {
+                const script = document.createElement('script');
+                script.src = src;
+                script.onload = resolve;
+                script.onerror = reject;
+                document.head.appendChild(script);
+            });
+        }
+        let fullCurvesLoaded = null;
+        function loadFullCurves() {
+            if (!fullCurvesLoaded) {
+                fullCurvesLoaded = Promise.all(files.map(file =>
+                    loadScript(fullCurvesDir + '/' + encodeURIComponent(file) + '.js').catch(() => null)));
+            }
+            return fullCurvesLoaded;
+        }
+        function binnedXY(curve) {
+            // bin k averages positions k*step+1 .. (k+1)*step, draw it at the centre
             return {
-                x: gcLabelsBefore,
-                y: beforePad,
-                mode: 'lines',
-                name: item.file,
-                line: { width: 1 }
+                x: curve.y.map((_, k) => k * curve.step + (curve.step + 1) / 2),
+                y: curve.y
             };
-        });
-        Plotly.newPlot('gcCurvePlotBefore', plotlyTracesGCBefore, {
-            title: 'GC Content Curve (Read1, Before Filtering)',
-            xaxis: { title: '' },
-            yaxis: { title: 'GC %', rangemode: 'tozero' },
-            legend: { orientation: 'h' },
-            margin: { t: 50, l: 60, r: 30, b: 60 }
-        }, {responsive: true});
-        // Plotly GC content curves (after)
-        const plotlyTracesGCAfter = gcCurves.map((item, idx) => {
-            const after = item.curve_after || [];
-            const afterPad = after.concat(Array(maxLenGCAfter - after.length).fill(null));
+        }
+        function fullXY(file, key, binned, lo, hi) {
+            const full = (window.fullCurves && window.fullCurves[file]) ? window.fullCurves[file][key] : null;
+            if (!full) {
+                return binnedXY(binned);
+            }
+            const first = Math.max(0, Math.floor(lo) - 1);
+            const last = Math.min(full.length, Math.ceil(hi) + 1);
             return {
-                x: gcLabelsAfter,
-                y: afterPad,
-                mode: 'lines',
-                name: item.file,
-                line: { width: 1 }
+                x: Array.from({length: Math.max(0, last - first)}, (_, i) => first + i + 1),
+                y: full.slice(first, last)
             };
-        });
-        Plotly.newPlot('gcCurvePlotAfter', plotlyTracesGCAfter, {
-            title: 'GC Content Curve (Read1, After Filtering)',
-            xaxis: { title: '' },
-            yaxis: { title: 'GC %', rangemode: 'tozero' },
-            legend: { orientation: 'h' },
-            margin: { t: 50, l: 60, r: 30, b: 60 }
-        }, {responsive: true});
+        }
+        function drawCurves() {
+            curvePlots.forEach(plot => {
+                const binned = overallCurves[plot.key];
+                const el = document.getElementById(plot.id);
+                const traces = files.map((file, idx) => Object.assign(binnedXY(binned[idx]), {
+                    mode: 'lines',
+                    name: file,
+                    line: { width: 1 }
+                }));
+                Plotly.newPlot(el, traces, {
+                    title: plot.title,
+                    xaxis: { title: 'zoom in for full resolution' },
+                    yaxis: { title: plot.yTitle, rangemode: 'tozero' },
+                    legend: { orientation: 'h' },
+                    margin: { t: 50, l: 60, r: 30, b: 60 }
+                }, {responsive: true});
+                let fullRes = false;
+                el.on('plotly_relayout', ev => {
+                    const range = ev['xaxis.range'] || [ev['xaxis.range[0]'], ev['xaxis.range[1]']];
+                    const zoomed = range[0] !== undefined && range[1] - range[0] <= curveBins * 4;
+                    if (zoomed) {
+                        loadFullCurves().then(() => {
+                            const xy = files.map((file, idx) => fullXY(file, plot.key, binned[idx], range[0], range[1]));
+                            Plotly.restyle(el, { x: xy.map(d => d.x), y: xy.map(d => d.y) });
+                            fullRes = true;
+                        });
+                    } else if (fullRes && (ev['xaxis.autorange'] || range[0] !== undefined)) {
+                        const xy = binned.map(binnedXY);
+                        Plotly.restyle(el, { x: xy.map(d => d.x), y: xy.map(d => d.y) });
+                        fullRes = false;
+                    }
+                });
+            });
+        }
+        const curvesTable = document.querySelector('.row-charts-table');
+        const showCurves = () => loadScript(curvesSidecar).then(drawCurves);
+        if ('IntersectionObserver' in window) {
+            const observer = new IntersectionObserver(seen => {
+                if (seen.some(e => e.isIntersecting)) {
+                    observer.disconnect();
+                    showCurves();
+                }
+            }, { rootMargin: '200px' });
+            observer.observe(curvesTable);
+        } else {
+            showCurves();
+        }
 
         // Q20/Q30/Q40 chart (grouped bar)
         new Chart(document.getElementById('qRateChart'), {
@@ -438,13 +791,32 @@ def main():
         else:
             # if out_dir is not specified, use input_dir as report_dir
             options.report_dir = options.input_dir
+    options.telemetry_log = Telemetry(options.telemetry or os.path.join(options.report_dir, "telemetry", run_stamp() + ".fastplong.jsonl"), "fastplong")
     
-    processDir(options.input_dir, options)
+    if options.watch and not options.dry_run:
+        jobs = watchDir(options.input_dir, options)
+    else:
+        jobs = processDir(options.input_dir, options)
+    if options.dry_run:
+        return
+    # in watch mode a file may have run again after a failure, its last job counts
+    latest = {job.read_file: job for job in (jobs or [])}
+    failed = [job for job in latest.values() if job.status != "done"]
+    if jobs and options.report_dir:
+        print("Job report: " + writeJobReport(jobs, options.report_dir))
     # After processing, generate summary
     if options.report_dir:
         generate_summary_html(options.report_dir, options.command)
+    options.telemetry_log.finish()
     time2 = time.time()
     print('Time used: ' + str(time2-time1))
+    if failed:
+        for job in failed:
+            print(f"fastplong failed for {job.name} (exit {job.returncode}), see {job.log}")
+            # a truncated output must not be picked up as the sample's reads
+            if getattr(job, "out_file", None) and os.path.exists(job.out_file):
+                os.remove(job.out_file)
+        sys.exit(1)
     
 if __name__  == "__main__":
     main()
@@ -2,6 +2,8 @@ consensus=$1
 output=$2
 db=$3
 
+. "$(dirname "$0")/mamba_env.sh"
+
 mkdir -p $output
-micromamba run -n gep-finders plasmidfinder.py -i $consensus -p $db -x -o $output
+env_run gep-finders plasmidfinder.py -i $consensus -p $db -x -o $output
 
@@ -5,5 +5,7 @@ output_dir=$2
 np_raw_file=$3
 threads=$4
 
+. "$(dirname "$0")/mamba_env.sh"
+
 # Run QUAST
-micromamba run -n quast quast $assembly -o $output_dir --nanopore $np_raw_file  -t $threads
+env_run quast quast $assembly -o $output_dir --nanopore $np_raw_file  -t $threads
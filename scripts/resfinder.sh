@@ -2,6 +2,8 @@ consensus=$1
 output=$2
 db_res=$3
 
-micromamba run -n gep-finders run_resfinder.py -ifa $consensus -db_res $db_res  --acquired --outputPath $output
+. "$(dirname "$0")/mamba_env.sh"
+
+env_run gep-finders run_resfinder.py -ifa $consensus -db_res $db_res  --acquired --outputPath $output
 
 
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+
+# Cross-run results store.
+# The MLST, PlasmidFinder, AMRFinderPlus, Bakta and rMLST outputs of every
+# sample are loaded into one SQLite database, indexed on sample, gene, ST and
+# replicon, so questions spanning many runs are a single query instead of a
+# grep over thousands of TSV files. A sample is ingested as a whole in one
+# transaction that first deletes what an earlier ingestion of the same run
+# and sample left, so reruns never duplicate rows. The database is meant to
+# live on shared storage next to the runs; SQLite's WAL mode needs a local
+# filesystem, elsewhere the database uses the rollback journal.
+#
+# Usage: results_db.py ingest --db results.sqlite --run <run> --sample <sample> --mlst mlst.tsv ...
+#        results_db.py query --db results.sqlite --gene blaKPC --on_plasmid
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+# filesystems WAL is unsafe on: shared memory does not work across hosts
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "lustre", "gpfs", "beegfs", "ceph", "glusterfs",
+                       "fuse.sshfs", "fuse.glusterfs", "fuse.ceph", "9p", "afs")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    run TEXT NOT NULL, sample TEXT NOT NULL, species TEXT, scheme TEXT, st TEXT,
+    sources TEXT, ingested TEXT, PRIMARY KEY (run, sample));
+CREATE TABLE IF NOT EXISTS mlst (
+    run TEXT NOT NULL, sample TEXT NOT NULL, scheme TEXT, st TEXT, alleles TEXT);
+CREATE TABLE IF NOT EXISTS rmlst (
+    run TEXT NOT NULL, sample TEXT NOT NULL, taxon TEXT, rank TEXT, support REAL);
+CREATE TABLE IF NOT EXISTS plasmids (
+    run TEXT NOT NULL, sample TEXT NOT NULL, replicon TEXT, db TEXT, identity REAL,
+    length TEXT, contig TEXT, position TEXT, accession TEXT);
+CREATE TABLE IF NOT EXISTS amr (
+    run TEXT NOT NULL, sample TEXT NOT NULL, gene TEXT, name TEXT, contig TEXT, start INTEGER,
+    stop INTEGER, strand TEXT, scope TEXT, type TEXT, subtype TEXT, class TEXT, subclass TEXT,
+    method TEXT, coverage REAL, identity REAL, accession TEXT);
+CREATE TABLE IF NOT EXISTS bakta (
+    run TEXT NOT NULL, sample TEXT NOT NULL, contig TEXT, type TEXT, start INTEGER, stop INTEGER,
+    strand TEXT, locus_tag TEXT, gene TEXT, product TEXT, dbxrefs TEXT);
+CREATE INDEX IF NOT EXISTS samples_sample ON samples (sample);
+CREATE INDEX IF NOT EXISTS samples_st ON samples (st);
+CREATE INDEX IF NOT EXISTS mlst_sample ON mlst (run, sample);
+CREATE INDEX IF NOT EXISTS mlst_st ON mlst (st);
+CREATE INDEX IF NOT EXISTS rmlst_sample ON rmlst (run, sample);
+CREATE INDEX IF NOT EXISTS plasmids_sample ON plasmids (run, sample);
+CREATE INDEX IF NOT EXISTS plasmids_replicon ON plasmids (replicon);
+CREATE INDEX IF NOT EXISTS amr_sample ON amr (run, sample);
+CREATE INDEX IF NOT EXISTS amr_gene ON amr (gene);
+CREATE INDEX IF NOT EXISTS bakta_sample ON bakta (run, sample);
+CREATE INDEX IF NOT EXISTS bakta_gene ON bakta (gene);
+"""
+
+SAMPLE_TABLES = ("mlst", "rmlst", "plasmids", "amr", "bakta")
+
+
+def filesystem_type(path):
+    # type of the mount holding path, from /proc/mounts; None when unknown
+    path = os.path.realpath(path)
+    mount_point, fstype = "", None
+    try:
+        with open("/proc/mounts") as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount = fields[1].replace("\\040", " ")
+                inside = path == mount or path.startswith(mount.rstrip("/") + "/")
+                if inside and len(mount) >= len(mount_point):
+                    mount_point, fstype = mount, fields[2]
+    except OSError:
+        return None
+    return fstype
+
+
+def connect(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # samples of a run are ingested concurrently, wait for the writer lock
+    # rather than failing; WAL lets queries run while a sample is written,
+    # but only on a local filesystem
+    db = sqlite3.connect(path, timeout=300)
+    fstype = filesystem_type(os.path.dirname(os.path.abspath(path)))
+    local = fstype is not None and fstype not in NETWORK_FILESYSTEMS
+    db.execute(f"PRAGMA journal_mode={'WAL' if local else 'DELETE'}")
+    db.executescript(SCHEMA)
+    return db
+
+
+def number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def first_word(value):
+    # contig names are the first word of the FASTA header
+    return value.split()[0] if value and value.split() else value
+
+
+def read_table(path, comment=None):
+    # rows of a tab separated file with a header line, as dicts
+    with open(path, newline="") as table:
+        lines = (line for line in table if line.strip())
+        if comment is not None:
+            # Bakta starts with comment lines, the last of them is the header
+            lines = list(lines)
+            header_at = max((i for i, line in enumerate(lines) if line.startswith(comment)), default=-1)
+            header = lines[header_at].lstrip(comment).rstrip("\r\n").split("\t") if header_at >= 0 else []
+            lines = lines[header_at + 1:]
+        else:
+            header = next(lines, "").rstrip("\r\n").split("\t")
+        for cells in csv.reader(lines, delimiter="\t", quoting=csv.QUOTE_NONE):
+            yield dict(zip(header, cells))
+
+
+def pick(row, *names):
+    # the column names differ between versions of the tools
+    for name in names:
+        if name in row:
+            return row[name]
+    return None
+
+
+def parse_mlst(path):
+    # mlst has no header: label, scheme, ST, alleles...
+    with open(path) as mlst_read:
+        for line in mlst_read:
+            cells = line.rstrip("\r\n").split("\t")
+            if len(cells) >= 3:
+                yield (cells[1], cells[2], " ".join(cells[3:]))
+
+
+def parse_rmlst(path):
+    for row in read_table(path):
+        yield (row.get("Taxon"), row.get("Rank"), number(row.get("Percentage")))
+
+
+def parse_plasmids(path):
+    for row in read_table(path):
+        yield (row.get("Plasmid"), row.get("Database"), number(row.get("Identity")),
+               row.get("Query / Template length"), first_word(row.get("Contig")),
+               row.get("Position in contig"), row.get("Accession number"))
+
+
+def parse_amr(path):
+    for row in read_table(path):
+        yield (pick(row, "Element symbol", "Gene symbol"), pick(row, "Element name", "Sequence name"),
+               first_word(row.get("Contig id")), integer(row.get("Start")), integer(row.get("Stop")),
+               row.get("Strand"), row.get("Scope"), pick(row, "Type", "Element type"),
+               pick(row, "Subtype", "Element subtype"), row.get("Class"), row.get("Subclass"), row.get("Method"),
+               number(pick(row, "% Coverage of reference", "% Coverage of reference sequence")),
+               number(pick(row, "% Identity to reference", "% Identity to reference sequence")),
+               pick(row, "Closest reference accession", "Accession of closest sequence"))
+
+
+def parse_bakta(path):
+    for row in read_table(path, comment="#"):
+        yield (row.get("Sequence Id"), row.get("Type"), integer(row.get("Start")), integer(row.get("Stop")),
+               row.get("Strand"), row.get("Locus Tag"), row.get("Gene") or None, row.get("Product"),
+               row.get("DbXrefs"))
+
+
+PARSERS = {
+    "mlst": (parse_mlst, "scheme, st, alleles"),
+    "rmlst": (parse_rmlst, "taxon, rank, support"),
+    "plasmids": (parse_plasmids, "replicon, db, identity, length, contig, position, accession"),
+    "amr": (parse_amr, "gene, name, contig, start, stop, strand, scope, type, subtype, class, subclass, "
+                       "method, coverage, identity, accession"),
+    "bakta": (parse_bakta, "contig, type, start, stop, strand, locus_tag, gene, product, dbxrefs"),
+}
+
+
+def source_stamps(files):
+    # size and mtime of every source, an unchanged sample is not ingested again
+    stamps = {}
+    for table, path in sorted(files.items()):
+        if path and os.path.isfile(path):
+            st = os.stat(path)
+            stamps[table] = [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+    return json.dumps(stamps, sort_keys=True)
+
+
+def ingest(db_path, run, sample, files, species_file=None):
+    # files maps a table name to the tool output it is loaded from; missing
+    # files simply leave the table empty for the sample. Returns the number
+    # of rows loaded, None when the sources did not change since last time.
+    files = dict(files)
+    if species_file:
+        files["species"] = species_file
+    sources = source_stamps(files)
+    species = None
+    if species_file and os.path.isfile(species_file):
+        with open(species_file) as species_read:
+            species = species_read.read().strip() or None
+
+    db = connect(db_path)
+    try:
+        known = db.execute("SELECT sources FROM samples WHERE run = ? AND sample = ?", (run, sample)).fetchone()
+        if known and known[0] == sources:
+            return None
+
+        rows = {}
+        for table, (parse, _) in PARSERS.items():
+            path = files.get(table)
+            rows[table] = list(parse(path)) if path and os.path.isfile(path) else []
+        scheme, st = (rows["mlst"][0][0], rows["mlst"][0][1]) if rows["mlst"] else (None, None)
+        if species is None and rows["rmlst"]:
+            species = rows["rmlst"][0][0]
+
+        with db:
+            for table in SAMPLE_TABLES:
+                db.execute(f"DELETE FROM {table} WHERE run = ? AND sample = ?", (run, sample))
+            for table, (_, columns) in PARSERS.items():
+                marks = ", ".join("?" * (columns.count(",") + 3))
+                db.executemany(f"INSERT INTO {table} (run, sample, {columns}) VALUES ({marks})",
+                               [(run, sample) + row for row in rows[table]])
+            db.execute("INSERT OR REPLACE INTO samples (run, sample, species, scheme, st, sources, ingested) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (run, sample, species, scheme, st, sources, time.strftime("%Y-%m-%dT%H:%M:%S")))
+        return sum(len(r) for r in rows.values())
+    finally:
+        db.close()
+
+
+def query_table(args):
+    return args.table or ("amr" if args.gene or args.on_plasmid else
+                          "plasmids" if args.replicon else "samples")
+
+
+def build_query(args):
+    # translate the query options into SQL; gene and replicon are prefix
+    # matches (GLOB, so the indexes are used), e.g. --gene blaKPC
+    where, params = [], []
+
+    def condition(clause, value):
+        if value is not None:
+            where.append(clause)
+            params.append(value)
+
+    if args.sql:
+        return args.sql, []
+
+    table = query_table(args)
+    t = table[0]
+    select = "SELECT s.run, s.sample, s.species, s.scheme, s.st, s.ingested FROM samples s"
+    if table != "samples":
+        select = f"SELECT s.species, s.st, {t}.* FROM {table} {t} JOIN samples s ON s.run = {t}.run AND s.sample = {t}.sample"
+    condition("s.st = ?", args.st)
+    condition(f"{t}.run = ?", args.run)
+    condition(f"{t}.sample = ?", args.sample)
+    if args.gene is not None:
+        condition(f"{t}.gene GLOB ?", args.gene + "*")
+    if args.replicon is not None:
+        if table == "plasmids":
+            condition("p.replicon GLOB ?", args.replicon + "*")
+        else:
+            condition(f"EXISTS (SELECT 1 FROM plasmids p WHERE p.run = {t}.run AND p.sample = {t}.sample "
+                      "AND p.replicon GLOB ?)", args.replicon + "*")
+    if args.on_plasmid:
+        # the hit lies on a contig PlasmidFinder found a replicon on
+        where.append("EXISTS (SELECT 1 FROM plasmids p WHERE p.run = a.run AND p.sample = a.sample "
+                     "AND p.contig = a.contig)")
+
+    sql = select + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {t}.run, {t}.sample"
+    if args.limit:
+        sql += f" LIMIT {int(args.limit)}"
+    return sql, params
+
+
+def query(args):
+    db = connect(args.db)
+    try:
+        sql, params = build_query(args)
+        cursor = db.execute(sql, params)
+        out = csv.writer(sys.stdout, delimiter="\t", lineterminator="\n")
+        out.writerow([column[0] for column in cursor.description])
+        for row in cursor:
+            out.writerow(["" if value is None else value for value in row])
+    finally:
+        db.close()
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", required=True, help="results database, e.g. on the storage the runs are written to")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    load = commands.add_parser("ingest", help="load the outputs of one sample")
+    load.add_argument("--run", required=True, help="run the sample belongs to, e.g. the output directory")
+    load.add_argument("--sample", required=True)
+    for table in PARSERS:
+        load.add_argument(f"--{table}", help=f"{table} output of the sample")
+    load.add_argument("--species", help="species file written by rMLST")
+
+    ask = commands.add_parser("query", help="print matching rows as TSV")
+    ask.add_argument("--table", choices=("samples",) + SAMPLE_TABLES,
+                     help="table to list (default: amr with --gene, plasmids with --replicon, else samples)")
+    ask.add_argument("--run")
+    ask.add_argument("--sample")
+    ask.add_argument("--gene", help="gene symbol prefix, e.g. blaKPC")
+    ask.add_argument("--st", help="MLST sequence type")
+    ask.add_argument("--replicon", help="plasmid replicon prefix, e.g. IncF")
+    ask.add_argument("--on_plasmid", action="store_true", help="only AMR hits on a contig with a plasmid replicon")
+    ask.add_argument("--limit", type=int)
+    ask.add_argument("--sql", help="run this SQL query instead")
+    args = parser.parse_args()
+
+    if args.command == "query":
+        # a filter the query would not use is an error, not an empty condition
+        filters = [f"--{name}" for name in ("table", "run", "sample", "gene", "st", "replicon", "on_plasmid", "limit")
+                   if getattr(args, name) not in (None, False)]
+        table = query_table(args)
+        if args.sql and filters:
+            parser.error(f"--sql cannot be combined with {', '.join(filters)}")
+        if args.gene is not None and table not in ("amr", "bakta"):
+            parser.error(f"--gene only applies to the amr and bakta tables, not {table}")
+        if args.on_plasmid and table != "amr":
+            parser.error(f"--on_plasmid only applies to the amr table, not {table}")
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.command == "ingest":
+        files = {table: getattr(args, table) for table in PARSERS}
+        count = ingest(args.db, args.run, args.sample, files, args.species)
+        if count is None:
+            print(f"{args.sample}: already up to date in {args.db}")
+        else:
+            print(f"{args.sample}: {count} rows ingested into {args.db}")
+        return 0
+    return query(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Retention of the intermediates in a sample folder (flye/<sample>), run by
+# the workflow once the sample's results are collected. The rules of
+# config/retention.yaml compress, delete or keep each file. The files the
+# stage cache checks (the manifests in .cache and the declared file outputs
+# they list), the staging folders and the files given with --protect (inputs
+# of the stages, sources of the collected results) are never touched. A file
+# is compressed next to itself and the original is removed only once the .gz
+# is complete. The process lowers its own CPU and I/O priority, so it stays
+# out of the way of the stages of other samples.
+#
+# Usage: retention.py --sample_dir <flye/sample> [--config retention.yaml] [--protect file ...]
+
+import argparse
+import fnmatch
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import yaml
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# already compressed, nothing to gain
+COMPRESSED = (".gz", ".bgz", ".bz2", ".xz", ".zst", ".zip", ".bam", ".cram")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sample_dir", "-s", required=True, help="sample folder of the workflow (flye/<sample>)")
+    parser.add_argument("--config", default=os.path.join(script_dir, "config", "retention.yaml"),
+                        help="YAML file with the retention rules")
+    parser.add_argument("--protect", nargs="*", default=[], help="files that are left as they are")
+    parser.add_argument("--dry_run", action="store_true", help="only print what would be done")
+    return parser.parse_args()
+
+
+def lower_priority():
+    os.nice(19)
+    if shutil.which("ionice"):
+        subprocess.run(["ionice", "-c", "3", "-p", str(os.getpid())], stderr=subprocess.DEVNULL)
+
+
+def protected_files(sample_dir, protect):
+    # absolute paths of the files the cache or later steps rely on
+    paths = {os.path.abspath(path) for path in protect}
+    cache_dir = os.path.join(sample_dir, ".cache")
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(cache_dir, name)) as manifest_read:
+                    manifest = json.load(manifest_read)
+            except (OSError, ValueError):
+                continue
+            for rel, info in manifest.get("outputs", {}).items():
+                if "size" in info:
+                    paths.add(os.path.abspath(os.path.join(sample_dir, rel)))
+    return paths
+
+
+def action_for(rel, rules):
+    for rule in rules:
+        if fnmatch.fnmatch(rel, rule["pattern"]):
+            return rule["action"]
+    return "keep"
+
+
+def compress(path, level):
+    tmp = path + ".gz.partial"
+    with open(path, "rb") as src, gzip.open(tmp, "wb", compresslevel=level) as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    shutil.copystat(path, tmp)
+    os.replace(tmp, path + ".gz")
+    os.remove(path)
+
+
+def main():
+    args = parse_args()
+    with open(args.config) as config_read:
+        config = yaml.safe_load(config_read) or {}
+    rules = config.get("rules") or []
+    level = int(config.get("level", 6))
+    min_size = float(config.get("min_size_kb", 0)) * 1024
+
+    sample_dir = os.path.abspath(args.sample_dir)
+    protected = protected_files(sample_dir, args.protect)
+    if not args.dry_run:
+        lower_priority()
+
+    counts = {"compress": 0, "delete": 0}
+    before = after = 0
+    for root, dirs, files in os.walk(sample_dir):
+        # the cache, and the staging folders of stages that may resume
+        dirs[:] = sorted(d for d in dirs if not (root == sample_dir and d in (".cache", ".staging")))
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if path in protected or os.path.islink(path) or name.endswith(".partial"):
+                continue
+            action = action_for(os.path.relpath(path, sample_dir), rules)
+            if action == "keep":
+                continue
+            size = os.path.getsize(path)
+            if action == "compress" and (size < min_size or name.endswith(COMPRESSED)):
+                continue
+            if args.dry_run:
+                print(f"{action}\t{path}")
+            elif action == "delete":
+                os.remove(path)
+            else:
+                compress(path, level)
+                after += os.path.getsize(path + ".gz")
+            before += size
+            counts[action] += 1
+
+    if not args.dry_run and (counts["compress"] or counts["delete"]):
+        print(f"{os.path.basename(sample_dir)}: compressed {counts['compress']} and deleted {counts['delete']} "
+              f"files, {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,50 @@
-
 #!/usr/bin/env python3
 # Upload contigs file to PubMLST rMLST species identifier via RESTful API
 # Written by Keith Jolley
 # Copyright (c) 2018, University of Oxford
 # Licence: GPL3
+#
+# Many assemblies can be identified in one run, either by repeating --file
+# (results go to --output_dir) or with a --manifest listing the FASTA, output
+# TSV and species file of every sample. All requests share one pooled HTTP
+# session, at most --jobs of them are in flight at a time, and failed or
+# throttled requests are retried with exponential backoff.
+#
+# Results are cached on disk, keyed on the assembly's sequence content (see
+# RmlstCache), so rerunning a plate does not query PubMLST again.
+#
+# With a --sketch_index (built by sketch.py from reference genomes) the
+# species is first looked up offline; PubMLST is only asked when the sketch
+# has no confident match.
+
 
+import sys, requests, argparse, base64, os.path, yaml, threading, hashlib, json, time, gzip, csv
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from sketch import SketchIndex, MIN_ANI
 
-import sys, requests, argparse, base64, os.path, yaml
-import pandas as pd
+RMLST_URI = 'http://rest.pubmlst.org/db/pubmlst_rmlst_seqdef_kiosk/schemes/1/sequence'
+RMLST_COLUMNS = ["Genus", "Species", "Taxon", "Abbreviated", "Rank", "Percentage"]
+# assembly file names that do not tell the samples apart, and the tool
+# folders such a file may sit in below the sample folder
+GENERIC_NAMES = ("consensus", "assembly", "contigs", "scaffolds")
+TOOL_FOLDERS = ("medaka", "flye", "out")
+# read size of the streamed request body, a multiple of 3 so that the base64
+# encoded chunks can simply be concatenated
+PAYLOAD_CHUNK = 3 * 256 * 1024
+RMLST_CACHE = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "nanonymph", "rmlst")
 
 parser = argparse.ArgumentParser()
 
-parser.add_argument('--file', '-f', type=str, help='assembly contig filename (FASTA format)')
+parser.add_argument(
+        '--file',
+        '-f',
+        type=str,
+        action='append',
+        default=[],
+        help='assembly contig filename (FASTA format, optionally gzip compressed), can be given several times'
+        )
 
 parser.add_argument(
         "--output",
@@ -20,7 +53,7 @@ parser.add_argument(
         default = "rMLST.tsv",
         help = "File path to the output tsv file."
         )
-        
+
 parser.add_argument(
 	"--organism_file",
 	"-O",
@@ -35,80 +68,441 @@ parser.add_argument(
 	type=str,
 	help = "Write the species to a txt file if detected among the supported organisms."
 	)
-	
+
+parser.add_argument(
+	"--manifest",
+	"-m",
+	type=str,
+	default=None,
+	help = "Tab separated file with one sample per line: FASTA, output tsv and (optional) species file."
+	)
+
+parser.add_argument(
+	"--output_dir",
+	"-d",
+	type=str,
+	default=None,
+	help = "Output folder when several --file are given, results are named after the FASTA files."
+	)
+
+parser.add_argument(
+	"--uri",
+	type=str,
+	default=os.environ.get("NANONYMPH_RMLST_URI", RMLST_URI),
+	help = "rMLST sequence query endpoint, NANONYMPH_RMLST_URI overrides the default (e.g. for a local mock)."
+	)
+
+parser.add_argument(
+	"--sketch_index",
+	type=str,
+	default=os.environ.get("NANONYMPH_SKETCH_INDEX"),
+	help = "Species sketch index (sketch.py build) answering confident matches offline, ignored when missing."
+	)
+
+parser.add_argument(
+	"--sketch_min_ani",
+	type=float,
+	default=MIN_ANI,
+	help = "Estimated ANI to a reference above which the sketch match is used instead of rMLST."
+	)
+
+parser.add_argument(
+	"--jobs",
+	"-j",
+	type=int,
+	default=4,
+	help = "Maximum number of concurrent requests."
+	)
+
+parser.add_argument(
+	"--timeout",
+	type=float,
+	default=300,
+	help = "Timeout in seconds of a single request."
+	)
+
+parser.add_argument(
+	"--retries",
+	type=int,
+	default=5,
+	help = "Number of retries of a failed request, with exponential backoff."
+	)
+
+parser.add_argument(
+	"--cache_dir",
+	type=str,
+	default=os.environ.get("NANONYMPH_RMLST_CACHE", RMLST_CACHE),
+	help = "Folder caching the rMLST results by assembly content."
+	)
+
+parser.add_argument(
+	"--cache_ttl",
+	type=float,
+	default=30,
+	help = "Days a cached result stays valid."
+	)
+
+parser.add_argument(
+	"--cache_max_mb",
+	type=float,
+	default=100,
+	help = "Size of the cache in MB above which the least recently used results are evicted."
+	)
+
+parser.add_argument(
+	"--no_cache",
+	action="store_true",
+	help = "Neither read nor write the result cache."
+	)
+
+parser.add_argument(
+	"--offline",
+	action="store_true",
+	help = "Only use sketch matches and cached results, never query the API."
+	)
+
 args = parser.parse_args()
 
+print_lock = threading.Lock()
+
+
+def log(sample, message):
+  with print_lock:
+    print(f"{sample}: {message}", flush = True)
+
 
 def check_supported(supported_organisms, rmlst):
-  Genus = rmlst['Genus'].iloc[0]
-  Taxon = rmlst['Taxon'].iloc[0].replace(' ','_')
-  
+  Genus = rmlst[0]['Genus']
+  Taxon = rmlst[0]['Taxon'].replace(' ','_')
+
   if Genus in supported_organisms :
     return(Genus)
   elif Taxon in supported_organisms :
     return(Taxon)
   else:
     print("Organism not supported by AMRFinderPlus.")
-    
+
   return(None)
 
 
-def main(assembly_file):
-    uri = 'http://rest.pubmlst.org/db/pubmlst_rmlst_seqdef_kiosk/schemes/1/sequence'
-    with open(args.file, 'r') as x: 
-        fasta = x.read()
-        
-    print("Encoding fasta", flush = True)
-    payload = '{"base64":true,"details":true,"sequence":"' + base64.b64encode(fasta.encode()).decode() + '"}'
-    response = requests.post(uri, data=payload)
-    if response.status_code == requests.codes.ok:
-        data = response.json()
-        try: 
-            data['taxon_prediction']
-        except KeyError:
-            print("No match")
-            sys.exit(0)
-
-        print("Collecting results", flush = True)
-        # Corrected way to extract the sample name
-
-        match = pd.DataFrame(columns=["Genus", "Species", "Taxon", "Abbreviated", "Rank", "Percentage"])
-
-        for result in data['taxon_prediction']:
-                Rank = result['rank']
-                Taxon = result['taxon']
-                Genus = Taxon.split()[0]
-                Species = Taxon.split()[1]
-                Support = result['support']
-                Taxonomy = result['taxonomy']
-                Abbreviated = f"{Genus[0]}. {Species}"
-
-                match.loc[len(match.index)] = [Genus, Species, Taxon, Abbreviated, Rank, Support]  
-            
-    else:
-        print(response.text)
+def open_fasta(path):
+    # plain or gzip compressed FASTA, told apart by the gzip magic bytes
+    with open(path, "rb") as probe:
+        magic = probe.read(2)
+    return gzip.open(path, "rb") if magic == b"\x1f\x8b" else open(path, "rb")
+
+
+def sequence_key(path, uri):
+    # The key only depends on the sequences: case, line wrapping, headers and
+    # contig order do not change the rMLST result. Every contig is hashed on
+    # its own while streaming through the file and the sorted contig digests
+    # make up the key. Also returns the uncompressed size of the file.
+    contigs = []
+    size = 0
+    current = None
+    with open_fasta(path) as fasta:
+        for line in fasta:
+            size += len(line)
+            if line.startswith(b">"):
+                if current is not None:
+                    contigs.append(current.hexdigest())
+                current = hashlib.sha256()
+            else:
+                if current is None:
+                    current = hashlib.sha256()
+                current.update(line.strip().upper())
+    if current is not None:
+        contigs.append(current.hexdigest())
+
+    h = hashlib.sha256(uri.encode() + b"\n")
+    for contig in sorted(contigs):
+        h.update(contig.encode() + b"\n")
+    return h.hexdigest(), size
+
+
+class Base64Payload:
+    # The JSON request body, base64 encoding the FASTA chunk by chunk while
+    # it is sent instead of building the whole body in memory. Iterating
+    # again starts over from the file, so a retried request resends it.
+
+    PREFIX = b'{"base64":true,"details":true,"sequence":"'
+    SUFFIX = b'"}'
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def __len__(self):
+        return len(self.PREFIX) + 4 * ((self.size + 2) // 3) + len(self.SUFFIX)
+
+    def __iter__(self):
+        yield self.PREFIX
+        carry = b""
+        with open_fasta(self.path) as fasta:
+            while True:
+                data = fasta.read(PAYLOAD_CHUNK)
+                if not data:
+                    break
+                data = carry + data
+                cut = len(data) - len(data) % 3
+                carry = data[cut:]
+                yield base64.b64encode(data[:cut])
+        if carry:
+            yield base64.b64encode(carry)
+        yield self.SUFFIX
+
+
+class RmlstCache:
+    # One JSON file per assembly holding the parsed taxon_prediction (None
+    # for no match). Entries expire after ttl_days; a hit refreshes the
+    # file's mtime so eviction drops the least recently used entries first.
+
+    def __init__(self, cache_dir, ttl_days, max_mb):
+        self.cache_dir = cache_dir
+        self.ttl = ttl_days * 86400
+        self.max_bytes = max_mb * 1024 * 1024
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, key):
+        # returns (hit, predictions)
+        path = self.path(key)
+        try:
+            with open(path) as cache_read:
+                entry = json.load(cache_read)
+        except (OSError, ValueError):
+            return False, None
+        if self.ttl > 0 and time.time() - entry.get("created", 0) > self.ttl:
+            return False, None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True, entry.get("taxon_prediction")
+
+    def put(self, key, predictions):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp, "w") as cache_write:
+            json.dump({"created": time.time(), "taxon_prediction": predictions}, cache_write)
+        os.replace(tmp, path)
+
+    def evict(self):
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.cache_dir):
+            for f in files:
+                full = os.path.join(root, f)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, full))
+                total += st.st_size
+        for mtime, size, full in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(full)
+            except OSError:
+                continue
+            total -= size
+
+
+def make_session(jobs, retries):
+    # one connection pool shared by all requests; POST is not retried by
+    # default, the query is read-only so it is safe to resend
+    retry = Retry(
+        total = retries,
+        backoff_factor = 2,
+        status_forcelist = (429, 500, 502, 503, 504),
+        allowed_methods = frozenset(["POST"]),
+        raise_on_status = False,
+    )
+    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = max(1, jobs), max_retries = retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def sample_name(fasta):
+    # the file name up to the first dot; the workflow's assemblies are all
+    # called consensus.fasta, so a generic name is replaced by the sample
+    # folder it sits in (flye/<sample>/medaka/consensus.fasta)
+    path = os.path.abspath(fasta)
+    name = os.path.basename(path).split(".")[0]
+    if name in GENERIC_NAMES:
+      folder = os.path.dirname(path)
+      if os.path.basename(folder) in TOOL_FOLDERS:
+        folder = os.path.dirname(folder)
+      name = os.path.basename(folder)
+    return name
+
+
+def check_unique(samples):
+    # two samples writing the same file would silently overwrite each other
+    seen = {}
+    for name, fasta, output, species_file in samples:
+      for path in (output, species_file):
+        if path is None:
+          continue
+        path = os.path.abspath(path)
+        if path in seen:
+          parser.error(f"{fasta} and {seen[path]} would both write {path}")
+        seen[path] = fasta
+    return samples
+
+
+def samples_from_args():
+    # (name, fasta, output tsv, species file) of every sample
+    if args.manifest is not None:
+      samples = []
+      with open(args.manifest, "r") as manifest_read:
+        for line in manifest_read:
+          fields = line.rstrip("\n").split("\t")
+          if not fields[0] or fields[0].startswith("#"):
+            continue
+          species_file = fields[2] if len(fields) > 2 and fields[2] else None
+          samples.append((sample_name(fields[0]), fields[0], fields[1], species_file))
+      return check_unique(samples)
+
+    if len(args.file) == 1 and args.output_dir is None:
+      return [(sample_name(args.file[0]), args.file[0], args.output, args.species_file)]
+
+    if args.output_dir is None:
+      parser.error("--output_dir is required with several --file")
+    samples = []
+    for fasta in args.file:
+      name = sample_name(fasta)
+      samples.append((name, fasta, os.path.join(args.output_dir, f"{name}_rmlst.tsv"),
+                      os.path.join(args.output_dir, f"{name}.species")))
+    return check_unique(samples)
+
+
+def query(session, sample, assembly_file, size):
+    # the taxon_prediction list of the assembly, None when there is no match;
+    # raises when the query itself failed
+    log(sample, "Sending fasta")
+    payload = Base64Payload(assembly_file, size)
+    response = session.post(args.uri, data=payload, timeout=args.timeout)
+    if response.status_code != requests.codes.ok:
+        raise RuntimeError(f"rMLST query failed with HTTP {response.status_code}: {response.text[:500]}")
+
+    data = response.json()
+    return data.get('taxon_prediction')
+
+
+def sketch_predictions(index, sample, assembly_file):
+    # a taxon_prediction like list from the sketch index, None without a
+    # confident match
+    match, results = index.identify(assembly_file, args.sketch_min_ani)
+    if match is None:
+        if results:
+            ani, _, best = results[0]
+            log(sample, f"No confident sketch match (best {best['taxon']}, ANI ~{ani:.3f}), asking rMLST")
+        return None
+    taxon, ani, genome = match
+    log(sample, f"Sketch match {taxon} (ANI ~{ani:.3f} to {genome})")
+    return [{"rank": "SPECIES", "taxon": taxon, "support": round(100 * ani, 1), "taxonomy": f"sketch:{genome}"}]
+
+
+def main(session, cache, index, sample, assembly_file):
+    # returns the matches as a list of rows, None when there is no match and
+    # raises when the query itself failed
+    predictions = sketch_predictions(index, sample, assembly_file) if index is not None else None
+    if predictions is None:
+        key, size = sequence_key(assembly_file, args.uri)
+        hit, predictions = cache.get(key) if cache is not None else (False, None)
+        if hit:
+            log(sample, f"Cached result ({key[:12]})")
+        elif args.offline:
+            raise RuntimeError("no sketch match, no cached result and --offline is set")
+        else:
+            predictions = query(session, sample, assembly_file, size)
+            if cache is not None:
+                cache.put(key, predictions)
+
+    if predictions is None:
+        log(sample, "No match")
+        return None
+
+    log(sample, "Collecting results")
+    match = []
+
+    for result in predictions:
+            Rank = result['rank']
+            Taxon = result['taxon']
+            Genus = Taxon.split()[0]
+            Species = Taxon.split()[1]
+            Support = result['support']
+            Taxonomy = result['taxonomy']
+            Abbreviated = f"{Genus[0]}. {Species}"
+
+            match.append(dict(zip(RMLST_COLUMNS, [Genus, Species, Taxon, Abbreviated, Rank, Support])))
 
     return match
 
+
+def write_results(rmlst, output, species_file, amfinder_organisms):
+    output_dir = os.path.dirname(output)
+    if output_dir and not os.path.isdir(output_dir) :
+      print(f"Creating directory: {output_dir}")
+      os.makedirs(output_dir, exist_ok=True)
+
+    if amfinder_organisms is not None and species_file is not None and rmlst:
+      species = check_supported(supported_organisms=amfinder_organisms, rmlst=rmlst)
+
+      if species is not None:
+        os.makedirs(os.path.dirname(species_file) or ".", exist_ok=True)
+        with open(species_file, "w") as species_write:
+          species_write.write(species)
+
+    with open(output, "w", newline = "") as output_write:
+      writer = csv.DictWriter(output_write, fieldnames = RMLST_COLUMNS, delimiter = "\t", lineterminator = "\n")
+      writer.writeheader()
+      writer.writerows(rmlst)
+
+
+def run_sample(session, cache, index, sample, amfinder_organisms):
+    name, fasta, output, species_file = sample
+    try:
+      rmlst = main(session, cache, index, name, fasta)
+      if rmlst is not None:
+        write_results(rmlst, output, species_file, amfinder_organisms)
+    except (OSError, ValueError, RuntimeError, requests.RequestException) as e:
+      log(name, f"failed: {e}")
+      return False
+    return True
+
+
 if __name__ == "__main__":
-    rmlst = main(args.file)
-    
+    samples = samples_from_args()
+    if not samples:
+      parser.error("no assemblies given, use --file or --manifest")
+
+    amfinder_organisms = None
     if args.organism_file is not None :
       with open(args.organism_file, "r") as organism_read:
         supported_organisms = yaml.safe_load(organism_read)
-      
       amfinder_organisms = supported_organisms.get("amrfinder")
-      species = check_supported(supported_organisms=amfinder_organisms, rmlst=rmlst)
-      
-      if species is not None:
-        with open(args.species_file, "w") as species_write:
-          species_write.write(species)
-    
-    output = args.output
-    
-    output_dir = os.path.dirname(output)
-    if not os.path.isdir(output_dir) :
-      print(f"Creating directory: {output_dir}")
-      os.makedirs(output_dir, exist_ok=True)
 
-    rmlst.to_csv(output, sep = "\t", index = False)
+    index = None
+    if args.sketch_index and os.path.isfile(args.sketch_index):
+      index = SketchIndex(args.sketch_index)
+
+    cache = None if args.no_cache else RmlstCache(args.cache_dir, args.cache_ttl, args.cache_max_mb)
+    session = make_session(args.jobs, args.retries)
+    with ThreadPoolExecutor(max_workers = max(1, min(args.jobs, len(samples)))) as executor:
+      ok = list(executor.map(lambda sample: run_sample(session, cache, index, sample, amfinder_organisms), samples))
+    if cache is not None:
+      cache.evict()
+    if index is not None:
+      index.close()
+
+    failed = [sample[0] for sample, success in zip(samples, ok) if not success]
+    if failed:
+      print("rMLST failed for: " + ", ".join(failed))
+      sys.exit(1)
@@ -3,5 +3,26 @@ rmlst=$2
 organism_file=$3
 species_file=$4
 scripts_dir=$5
-    
-micromamba run -n rmlst python "$scripts_dir"/rmlst.py --file $consensus --output $rmlst --organism_file $organism_file --species_file $species_file
+# optional species sketch index, confident matches skip the PubMLST query
+sketch_index=$6
+
+. "$(dirname "$0")/mamba_env.sh"
+
+# batch mode: run_rmlst.sh --manifest <manifest.tsv> <organism_file> <scripts_dir> [jobs] [sketch_index]
+if [ "$1" = "--manifest" ]; then
+  manifest=$2
+  organism_file=$3
+  scripts_dir=$4
+  if [ -n "$sketch_index" ]; then
+    env_run rmlst python "$scripts_dir"/rmlst.py --manifest "$manifest" --organism_file "$organism_file" --jobs "${5:-4}" --sketch_index "$sketch_index"
+  else
+    env_run rmlst python "$scripts_dir"/rmlst.py --manifest "$manifest" --organism_file "$organism_file" --jobs "${5:-4}"
+  fi
+  exit
+fi
+
+if [ -n "$sketch_index" ]; then
+  env_run rmlst python "$scripts_dir"/rmlst.py --file $consensus --output $rmlst --organism_file $organism_file --species_file $species_file --sketch_index "$sketch_index"
+else
+  env_run rmlst python "$scripts_dir"/rmlst.py --file $consensus --output $rmlst --organism_file $organism_file --species_file $species_file
+fi
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+# Resource-aware job scheduler shared by the workflow scripts.
+# Every job declares how many threads and how much memory it needs, and the
+# scheduler starts as many ready jobs as fit into a global CPU and RAM budget.
+# Jobs form a DAG: dependencies are either named explicitly or derived from
+# the files a job reads (inputs) and the files another job writes (outputs).
+# New jobs can be fed in while the others run, for inputs that only appear
+# during the run (watch mode). Finished jobs can be handed to a telemetry
+# log (see telemetry.py).
+
+import heapq
+import os
+import queue
+import resource
+import subprocess
+import threading
+import time
+
+
+class Job:
+    def __init__(self, name, cmd=None, func=None, threads=1, mem_gb=0, deps=(),
+                 inputs=(), outputs=(), log=None, skip=None, before=None, after=None,
+                 priority=0, label=None):
+        self.name = name
+        self.cmd = cmd            # command to run (list, or str for the shell)
+        self.func = func          # python callable run instead of cmd, returns an exit code
+        self.threads = threads
+        self.mem_gb = mem_gb
+        self.deps = list(deps)    # names of jobs that must finish first
+        self.inputs = list(inputs)    # files or directories the job reads
+        self.outputs = list(outputs)  # files or directories the job writes
+        self.log = log            # file receiving stdout and stderr
+        self.skip = skip          # callable returning a message when the job can be skipped
+        self.before = before      # callable run right before the job starts
+        self.after = after        # callable run once the job succeeded, raises on failure
+        self.priority = priority  # lower values are started first
+        self.label = label
+        self.status = None        # done, skipped, failed or cancelled
+        self.returncode = None
+        self.started = None       # wall clock start and end of the run
+        self.finished = None
+        self.usage = None         # CPU time, peak RSS and I/O of a finished job
+
+
+def link_dependencies(jobs):
+    # a job depends on every job producing one of its inputs, where an input
+    # may also be a file inside a directory that another job outputs. A job
+    # that has ended hands its outputs on to a later one redoing them (watch
+    # mode re-admits a sample whose reads were published again).
+    producers = {}
+    for job in jobs:
+        for output in job.outputs:
+            path = os.path.normpath(output)
+            if path in producers:
+                if producers[path].status is None and job.status is None:
+                    raise ValueError(f"{path} is written by both {producers[path].name} and {job.name}")
+                if job.status is not None:
+                    continue
+            producers[path] = job
+
+    for job in jobs:
+        for path in map(os.path.normpath, job.inputs):
+            while path not in producers:
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+            producer = producers.get(path)
+            if producer is not None and producer is not job and producer.name not in job.deps:
+                job.deps.append(producer.name)
+
+
+def read_io(pid="self"):
+    # bytes read and written through system calls, cache hits and pipes
+    # included; a process also accounts its reaped children. None when the
+    # kernel does not expose it.
+    try:
+        with open(f"/proc/{pid}/io") as io:
+            fields = dict(line.split(":", 1) for line in io)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def available_memory_gb():
+    # MemAvailable is what the kernel can hand out without swapping
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024 / 1024
+    except OSError:
+        pass
+    return 0
+
+
+class Scheduler:
+    def __init__(self, cpus, mem_gb=0, max_jobs=None, telemetry=None):
+        self.cpus = max(1, int(cpus))
+        # a memory budget of 0 means "whatever the machine has available"
+        self.mem_gb = mem_gb or available_memory_gb() or float("inf")
+        self.max_jobs = max_jobs
+        self.telemetry = telemetry  # receives every finished job, see telemetry.py
+        self.lock = threading.Lock()
+
+    def _need(self, job):
+        # a job larger than the whole budget still runs, but on its own
+        return min(job.threads, self.cpus), min(job.mem_gb, self.mem_gb)
+
+    def _execute(self, job):
+        if job.skip is not None:
+            job.started = time.time()
+            message = job.skip()
+            job.finished = time.time()
+            if message:
+                with self.lock:
+                    print(f"{job.name}: {message}", flush=True)
+                return "skipped", 0
+
+        with self.lock:
+            print(f"{job.name}: {job.label or 'started'} "
+                  f"(threads={job.threads}, mem={job.mem_gb}G)", flush=True)
+
+        if job.before is not None:
+            job.before()
+
+        job.started = time.time()
+        job.finished = None
+        if job.func is not None:
+            # the function runs in this worker thread, so the thread's own
+            # usage is the job's; its peak RSS is the whole process', not kept
+            thread_io = f"self/task/{threading.get_native_id()}"
+            io_before = read_io(thread_io)
+            ru_before = resource.getrusage(resource.RUSAGE_THREAD)
+            returncode = job.func()
+            job.finished = time.time()
+            ru_after = resource.getrusage(resource.RUSAGE_THREAD)
+            io_after = read_io(thread_io)
+            job.usage = {
+                "user_s": ru_after.ru_utime - ru_before.ru_utime,
+                "sys_s": ru_after.ru_stime - ru_before.ru_stime,
+                "max_rss_mb": None,
+                "read_mb": (io_after[0] - io_before[0]) / 1e6 if io_before and io_after else None,
+                "write_mb": (io_after[1] - io_before[1]) / 1e6 if io_before and io_after else None,
+            }
+        else:
+            if job.log:
+                os.makedirs(os.path.dirname(job.log) or ".", exist_ok=True)
+            # output goes straight to the log file, nothing is buffered here
+            with open(job.log or os.devnull, "w") as out:
+                proc = subprocess.Popen(job.cmd, stdout=out, stderr=subprocess.STDOUT,
+                                        shell=isinstance(job.cmd, str))
+                # the I/O counters are read while the exited child is still a
+                # zombie, then wait4 instead of wait gets its resource usage
+                os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+                io = read_io(proc.pid)
+                _, wait_status, rusage = os.wait4(proc.pid, 0)
+                proc.returncode = returncode = os.waitstatus_to_exitcode(wait_status)
+            job.finished = time.time()
+            job.usage = {
+                "user_s": rusage.ru_utime,
+                "sys_s": rusage.ru_stime,
+                "max_rss_mb": rusage.ru_maxrss / 1024,  # ru_maxrss is in KB on Linux
+                # storage blocks of 512 bytes when /proc has no I/O counters
+                "read_mb": (io[0] if io else rusage.ru_inblock * 512) / 1e6,
+                "write_mb": (io[1] if io else rusage.ru_oublock * 512) / 1e6,
+            }
+
+        if returncode == 0 and job.after is not None:
+            job.after()
+
+        return ("done" if returncode == 0 else "failed"), returncode
+
+    def _worker(self, job, finished):
+        status, returncode = "failed", None
+        try:
+            status, returncode = self._execute(job)
+        except Exception as e:
+            with self.lock:
+                print(f"{job.name}: {e}", flush=True)
+        finally:
+            # always report back, otherwise the scheduler waits forever
+            finished.put((job, status, returncode))
+
+    def _select(self, pending, by_name, free_cpus, free_mem, running):
+        # pick the pending jobs to start now and the ones to cancel
+        start, cancel = [], []
+        # the first job that does not fit reserves its share, so a stream of
+        # small jobs can never starve a big one (e.g. Flye) indefinitely
+        reserved_cpus, reserved_mem = 0, 0
+        for job in pending:
+            dep_status = [by_name[dep].status for dep in job.deps]
+            if any(s in ("failed", "cancelled") for s in dep_status):
+                cancel.append(job)
+                continue
+            if not all(s in ("done", "skipped") for s in dep_status):
+                continue
+            if self.max_jobs is not None and len(running) + len(start) >= self.max_jobs:
+                break
+
+            cpus, mem = self._need(job)
+            if cpus <= free_cpus - reserved_cpus and mem <= free_mem - reserved_mem:
+                free_cpus -= cpus
+                free_mem -= mem
+                start.append(job)
+            elif reserved_cpus == 0 and reserved_mem == 0:
+                reserved_cpus, reserved_mem = cpus, mem
+        return start, cancel
+
+    def _loop(self, initial, launch, wait_one, feed=None):
+        # feed, when given, is polled for jobs that became known while the
+        # others run (watch mode); it returns a list of new jobs, possibly
+        # empty, or None once no more jobs will come
+        jobs = []
+        by_name = {}
+        pending = []
+        running = set()
+        free_cpus, free_mem = self.cpus, self.mem_gb
+
+        def add(new_jobs):
+            jobs.extend(new_jobs)
+            link_dependencies(jobs)
+            by_name.update((job.name, job) for job in new_jobs)
+            for job in new_jobs:
+                for dep in job.deps:
+                    if dep not in by_name:
+                        raise ValueError(f"{job.name} depends on unknown job {dep}")
+            pending.extend(new_jobs)
+            pending.sort(key=lambda job: job.priority)
+
+        add(initial)
+
+        while pending or running or feed is not None:
+            if feed is not None:
+                new_jobs = feed()
+                if new_jobs is None:
+                    feed = None
+                elif new_jobs:
+                    add(new_jobs)
+
+            start, cancel = self._select(pending, by_name, free_cpus, free_mem, running)
+            for job in cancel:
+                job.status = "cancelled"
+                job.started = job.finished = time.time()
+                pending.remove(job)
+                print(f"{job.name}: cancelled, a dependency failed", flush=True)
+                if self.telemetry is not None:
+                    self.telemetry.record(job)
+            for job in start:
+                pending.remove(job)
+                running.add(job)
+                cpus, mem = self._need(job)
+                free_cpus -= cpus
+                free_mem -= mem
+                launch(job)
+
+            if not running and feed is None:
+                if pending and not start and not cancel:
+                    names = ", ".join(job.name for job in pending)
+                    raise ValueError(f"dependency cycle between: {names}")
+                continue
+
+            # returns None when it timed out waiting, to poll the feed again
+            job = wait_one()
+            if job is None:
+                continue
+            running.discard(job)
+            cpus, mem = self._need(job)
+            free_cpus += cpus
+            free_mem += mem
+            if job.status == "failed":
+                where = f", see {job.log}" if job.log else ""
+                print(f"{job.name}: failed (exit {job.returncode}){where}", flush=True)
+
+        return jobs
+
+    def run(self, jobs, feed=None, interval=5):
+        finished = queue.Queue()
+
+        def launch(job):
+            threading.Thread(target=self._worker, args=(job, finished), daemon=True).start()
+
+        def wait_one():
+            try:
+                job, job.status, job.returncode = finished.get(timeout=interval if feed is not None else None)
+            except queue.Empty:
+                return None
+            if job.status == "done" and job.started is not None:
+                print(f"{job.name}: finished in {job.finished - job.started:.1f}s", flush=True)
+            if self.telemetry is not None:
+                self.telemetry.record(job)
+            return job
+
+        return self._loop(jobs, launch, wait_one, feed)
+
+    def simulate(self, jobs, duration):
+        # Dry run of the same scheduling policy on a virtual clock.
+        # duration(job) gives the predicted run time of a job in seconds;
+        # returns [(job, start, end)] and the predicted makespan.
+        clock = [0.0]
+        events = []
+        plan = []
+
+        def launch(job):
+            end = clock[0] + duration(job)
+            plan.append((job, clock[0], end))
+            heapq.heappush(events, (end, len(plan), job))
+
+        def wait_one():
+            clock[0], _, job = heapq.heappop(events)
+            job.status = "done"
+            return job
+
+        self._loop(jobs, launch, wait_one)
+        for job in jobs:
+            job.status = None
+        return plan, clock[0]
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# Offline species identification of assemblies against reference genomes.
+# A genome is reduced to a sketch: the hashes of the k-mers that start with a
+# fixed anchor, on both strands, so the sketch does not depend on the contig
+# orientation and finding the anchors is a plain bytes.find. The sketches of
+# all references are stored in one file as a sorted array of 64-bit hashes
+# with a parallel array of reference ids; queries memory-map the file and
+# look every hash up by bisection, so nothing is loaded up front.
+#
+# The share of k-mers an assembly has in common with a reference is turned
+# into an ANI estimate (containment ** (1 / k)). A match is confident when
+# the best reference reaches --min_ani and no reference of another taxon
+# does; rmlst.py then skips the PubMLST query (see identify).
+#
+# Usage: sketch.py build --references refs.tsv --output species.sketch
+#        sketch.py query --index species.sketch assembly.fasta [...]
+# refs.tsv lists "<Genus species><TAB><genome FASTA>", one genome per line.
+
+import argparse
+import bisect
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b"NNSKETCH"
+VERSION = 1
+K = 21
+# one k-mer in about 4 ** len(ANCHOR) per strand ends up in the sketch
+ANCHOR = b"ACGGT"
+MIN_ANI = 0.95
+COMPLEMENT = bytes.maketrans(b"ACGT", b"TGCA")
+
+
+def read_contigs(path):
+    # uppercase sequences of a plain or gzipped FASTA file
+    with open(path, "rb") as probe:
+        gzipped = probe.read(2) == b"\x1f\x8b"
+    with (gzip.open(path, "rb") if gzipped else open(path, "rb")) as fasta:
+        lines = []
+        for line in fasta:
+            if line.startswith(b">"):
+                if lines:
+                    yield b"".join(lines).upper()
+                lines = []
+            else:
+                lines.append(line.strip())
+        if lines:
+            yield b"".join(lines).upper()
+
+
+def sketch(path, k=K, anchor=ANCHOR):
+    hashes = set()
+    for seq in read_contigs(path):
+        for strand in (seq, seq.translate(COMPLEMENT)[::-1]):
+            i = strand.find(anchor)
+            while i != -1:
+                kmer = strand[i:i + k]
+                # skip the contig ends and ambiguous bases
+                if len(kmer) == k and not kmer.translate(None, b"ACGT"):
+                    hashes.add(int.from_bytes(hashlib.blake2b(kmer, digest_size=8).digest(), "little"))
+                i = strand.find(anchor, i + 1)
+    return hashes
+
+
+def build(references, output):
+    # references: [(taxon, fasta)]
+    entries, names = [], []
+    for ref_id, (taxon, fasta) in enumerate(references):
+        hashes = sketch(fasta)
+        names.append({"taxon": taxon, "genome": os.path.basename(fasta), "size": len(hashes)})
+        entries.extend((h, ref_id) for h in hashes)
+        print(f"{taxon}: {os.path.basename(fasta)}, {len(hashes)} hashes", flush=True)
+    entries.sort()
+
+    header = json.dumps({"k": K, "anchor": ANCHOR.decode(), "count": len(entries),
+                         "references": names}).encode()
+    # the arrays start at a multiple of 8 bytes
+    offset = len(MAGIC) + 8 + len(header)
+    header += b" " * (-offset % 8)
+    tmp = output + ".tmp"
+    with open(tmp, "wb") as out:
+        out.write(MAGIC + struct.pack("<II", VERSION, len(header)) + header)
+        array("Q", (h for h, _ in entries)).tofile(out)
+        array("H", (ref_id for _, ref_id in entries)).tofile(out)
+    os.replace(tmp, output)
+    return len(entries)
+
+
+class SketchIndex:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a sketch index")
+        version, header_len = struct.unpack_from("<II", self.map, len(MAGIC))
+        if version != VERSION:
+            raise ValueError(f"{path} is a version {version} sketch index, rebuild it")
+        start = len(MAGIC) + 8
+        self.header = json.loads(self.map[start:start + header_len])
+        self.references = self.header["references"]
+        count = self.header["count"]
+        at = start + header_len
+        view = memoryview(self.map)
+        self.hashes = view[at:at + 8 * count].cast("Q")
+        self.ids = view[at + 8 * count:at + 10 * count].cast("H")
+
+    def close(self):
+        self.hashes.release()
+        self.ids.release()
+        self.map.close()
+        self.file.close()
+
+    def search(self, path):
+        # [(ani, containment, reference)] best first
+        query = sketch(path, self.header["k"], self.header["anchor"].encode())
+        shared = [0] * len(self.references)
+        hashes, ids, n = self.hashes, self.ids, len(self.hashes)
+        for h in query:
+            i = bisect.bisect_left(hashes, h)
+            while i < n and hashes[i] == h:
+                shared[ids[i]] += 1
+                i += 1
+
+        results = []
+        for ref, common in zip(self.references, shared):
+            smaller = min(len(query), ref["size"])
+            containment = common / smaller if smaller else 0.0
+            results.append((containment ** (1 / self.header["k"]), containment, ref))
+        results.sort(key=lambda r: r[0], reverse=True)
+        return results
+
+    def identify(self, path, min_ani=MIN_ANI):
+        # (taxon, ani, reference genome) of a confident match or None, and
+        # the search results for the log
+        results = self.search(path)
+        if not results or results[0][0] < min_ani:
+            return None, results
+        ani, _, best = results[0]
+        if any(r[0] >= min_ani and r[2]["taxon"] != best["taxon"] for r in results[1:]):
+            return None, results
+        return (best["taxon"], ani, best["genome"]), results
+
+
+def read_references(path):
+    references = []
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as refs:
+        for line in refs:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 2 or not fields[0] or fields[0].startswith("#"):
+                continue
+            if len(fields[0].split()) < 2:
+                raise ValueError(f"{path}: taxon '{fields[0]}' is not 'Genus species'")
+            references.append((fields[0], os.path.join(base, fields[1])))
+    return references
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="sketch reference genomes into an index")
+    build_parser.add_argument("--references", "-r", required=True,
+                              help="TSV of taxon and genome FASTA (relative to the TSV), one genome per line")
+    build_parser.add_argument("--output", "-o", required=True, help="index file to write")
+    query_parser = commands.add_parser("query", help="identify assemblies")
+    query_parser.add_argument("--index", "-i", required=True, help="index written by build")
+    query_parser.add_argument("--min_ani", type=float, default=MIN_ANI, help="ANI estimate of a confident match")
+    query_parser.add_argument("--top", type=int, default=3, help="number of best references to list")
+    query_parser.add_argument("fasta", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        references = read_references(args.references)
+        if not references:
+            parser.error(f"no references listed in {args.references}")
+        count = build(references, args.output)
+        print(f"{len(references)} genomes, {count} hashes written to {args.output}")
+        return 0
+
+    index = SketchIndex(args.index)
+    try:
+        for fasta in args.fasta:
+            match, results = index.identify(fasta, args.min_ani)
+            print(f"{fasta}: " + (f"{match[0]} (ANI ~{match[1]:.3f}, {match[2]})" if match else "no confident match"))
+            for ani, containment, ref in results[:args.top]:
+                print(f"  {ref['taxon']}\t{ref['genome']}\tANI ~{ani:.3f}\tcontainment {containment:.3f}")
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,33 @@
+db_root=$1
+# optional TSV of "<Genus species><TAB><genome FASTA>" to sketch instead of
+# the NCBI reference genomes of the supported organisms
+references=$2
+db_path=$db_root/sketch
+scripts_dir=$(dirname "$0")
+
+. "$scripts_dir/mamba_env.sh"
+
+mkdir -p $db_path
+
+if [ -z "$references" ]; then
+    # one reference genome per species of every organism AMRFinderPlus supports
+    references=$db_path/references.tsv
+    : > $references
+    for organism in $(sed -n 's/^ *- *//p' $scripts_dir/config/supported_organisms.yaml); do
+        taxon=$(echo $organism | tr '_' ' ')
+        download=$db_path/download/$organism
+        mkdir -p $download
+        env_run rmlst datasets download genome taxon "$taxon" --reference --include genome --filename $download/genomes.zip || continue
+        env_run rmlst unzip -oq $download/genomes.zip -d $download
+        # accession and organism name; the name is cut to "Genus species"
+        env_run rmlst dataformat tsv genome --package $download/genomes.zip --fields accession,organism-name --elide-header \
+        | while IFS="$(printf '\t')" read accession name; do
+            for fasta in $download/ncbi_dataset/data/$accession/*.fna; do
+                [ -f "$fasta" ] && printf '%s\t%s\n' "$(echo $name | cut -d' ' -f1,2)" "${fasta#$db_path/}" >> $references
+            done
+        done
+    done
+fi
+
+env_run rmlst python $scripts_dir/sketch.py build --references $references --output $db_path/species.sketch
+rm -rf $db_path/download
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+# Content-addressed cache for the workflow stages.
+# A stage is keyed on the content of its input files, its command line, the
+# conda environment spec it runs in and a fingerprint of the databases it
+# reads. The stage runs in a staging directory and its outputs are moved into
+# place only once it succeeded, after which a manifest records the key. A
+# rerun skips the stage only when the manifest key matches and the outputs
+# are still there, so a half-written directory is never mistaken for a result.
+# A resumable stage keeps the staging directory of an interrupted run with the
+# same key, so the tool can pick up from its own checkpoints.
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+CHUNK_SIZE = 1 << 20
+THREADS = "{threads}"  # placeholder for the thread count in a command template
+FICLONE = 0x40049409  # linux/fs.h, reflink the whole file
+
+
+def write_json(path, data):
+    # write next to the target and rename, so readers never see half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp, "w") as out:
+        json.dump(data, out, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def promote(src, dst):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        # a directory cannot be replaced in one rename, move the old one aside first
+        old = f"{dst}.old-{os.getpid()}"
+        os.rename(dst, old)
+        os.rename(src, dst)
+        shutil.rmtree(old)
+    else:
+        os.replace(src, dst)
+
+
+def publish(src, dst):
+    # makes src available as dst without copying the data where the
+    # filesystem allows: a hardlink, else a reflink (copy-on-write clone),
+    # else a copy. Outputs are only ever replaced by rename, never rewritten
+    # in place, so a linked copy keeps the content it was published with.
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        if os.path.samefile(src, dst):
+            return "linked"
+    except OSError:
+        pass
+    tmp = f"{dst}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        os.link(src, tmp)
+        method = "linked"
+    except OSError:
+        method = "copied"
+        with open(src, "rb") as src_read, open(tmp, "wb") as dst_write:
+            try:
+                fcntl.ioctl(dst_write.fileno(), FICLONE, src_read.fileno())
+                method = "cloned"
+            except OSError:
+                shutil.copyfileobj(src_read, dst_write, CHUNK_SIZE)
+        shutil.copystat(src, tmp)
+    os.replace(tmp, dst)
+    return method
+
+
+class DigestMemo:
+    # Content digests of files, remembered by path, size, mtime and inode so
+    # that large read files are only hashed once across runs.
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.env_digests = {}
+        # digests known up front, e.g. of the databases from their manifests
+        self.pinned = {}
+        try:
+            with open(path) as memo_read:
+                self.entries = json.load(memo_read)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def pin(self, path, digest):
+        self.pinned[os.path.abspath(path)] = digest
+
+    def digest(self, path):
+        if os.path.abspath(path) in self.pinned:
+            return self.pinned[os.path.abspath(path)]
+        if not os.path.exists(path):
+            return "absent"
+        if os.path.isdir(path):
+            return self.tree_fingerprint(path)
+
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns, st.st_ino]
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry and entry[:3] == stamp:
+            return entry[3]
+
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self.lock:
+            self.entries[path] = stamp + [digest]
+        return digest
+
+    def tree_fingerprint(self, path):
+        # databases are far too big to hash on every run; a fingerprint of
+        # the file listing (name, size, mtime) changes with every update
+        h = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d != ".git")
+            for f in sorted(files):
+                full = os.path.join(root, f)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                h.update(f"{os.path.relpath(full, path)}\t{st.st_size}\t{st.st_mtime_ns}\n".encode())
+        return "tree:" + h.hexdigest()
+
+    def env_digest(self, env_file):
+        if env_file not in self.env_digests:
+            self.env_digests[env_file] = self.digest(env_file)
+        return self.env_digests[env_file]
+
+    def save(self):
+        with self.lock:
+            entries = dict(self.entries)
+        write_json(self.path, entries)
+
+
+class CachedStage:
+    # One stage of one sample. The command template writes into the staging
+    # directory; outputs are (final path, path inside staging, optional)
+    # tuples. Whatever else the tool leaves in the staging directory is kept
+    # as the stage's work directory.
+
+    def __init__(self, name, cmd, threads, inputs, outputs, env_file, sample_dir,
+                 memo, dbs=(), aliases=None, resumable=False):
+        self.name = name
+        self.template = list(cmd)
+        self.cmd = [str(threads) if arg == THREADS else arg for arg in cmd]
+        self.inputs = list(inputs)
+        self.dbs = list(dbs)
+        self.outputs = list(outputs)
+        self.env_file = env_file
+        self.memo = memo
+        self.aliases = dict(aliases or {})
+        self.sample_dir = sample_dir
+        self.staging = os.path.join(sample_dir, ".staging", name)
+        self.work = os.path.join(sample_dir, "work", name)
+        self.manifest = os.path.join(sample_dir, ".cache", f"{name}.json")
+        self.resumable = resumable
+        self.key = None
+
+    def staged(self, rel):
+        return os.path.join(self.staging, rel)
+
+    def _normalize(self, arg):
+        # absolute paths would tie the key to where the run lives; inputs are
+        # already covered by their content digests
+        if arg in self.inputs or arg in self.dbs:
+            return "<input>"
+        if arg.startswith(self.staging):
+            return "<staging>" + arg[len(self.staging):]
+        for prefix, alias in self.aliases.items():
+            if arg.startswith(prefix):
+                return alias + arg[len(prefix):]
+        return arg
+
+    def compute_key(self):
+        record = {
+            "stage": self.name,
+            "cmd": [self._normalize(arg) for arg in self.template],
+            "inputs": [self.memo.digest(path) for path in self.inputs],
+            "env": self.memo.env_digest(self.env_file) if self.env_file else None,
+            "dbs": [self.memo.digest(path) for path in self.dbs],
+        }
+        return hashlib.sha256(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+    def lookup(self):
+        self.key = self.compute_key()
+        try:
+            with open(self.manifest) as manifest_read:
+                manifest = json.load(manifest_read)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("key") != self.key:
+            return None
+
+        for rel, info in manifest.get("outputs", {}).items():
+            path = os.path.join(self.sample_dir, rel)
+            if info.get("absent"):
+                continue
+            if info.get("dir"):
+                if not os.path.isdir(path):
+                    return None
+            elif not os.path.isfile(path) or os.path.getsize(path) != info.get("size"):
+                return None
+        return f"cached ({self.key[:12]}), skipping"
+
+    def prepare(self):
+        # a staging directory left by an interrupted run is never trusted,
+        # unless the stage resumes and the run had the same key
+        stamp = os.path.join(self.staging, ".key")
+        if self.resumable:
+            try:
+                with open(stamp) as stamp_read:
+                    if stamp_read.read().strip() == self.key:
+                        return
+            except OSError:
+                pass
+        remove(self.staging)
+        os.makedirs(self.staging)
+        if self.resumable:
+            with open(stamp, "w") as stamp_write:
+                stamp_write.write(self.key + "\n")
+
+    def commit(self):
+        for final, rel, optional in self.outputs:
+            if not os.path.lexists(self.staged(rel)) and not optional:
+                raise RuntimeError(f"{self.name} did not produce {rel}")
+
+        # the manifest lists outputs relative to the sample directory, so a
+        # run directory can be moved without losing its cache
+        outputs = {}
+        for final, rel, optional in self.outputs:
+            src = self.staged(rel)
+            name = os.path.relpath(final, self.sample_dir)
+            if not os.path.lexists(src):
+                remove(final)
+                outputs[name] = {"absent": True}
+                continue
+            promote(src, final)
+            if os.path.isdir(final):
+                outputs[name] = {"dir": True}
+            else:
+                outputs[name] = {"size": os.path.getsize(final), "digest": self.memo.digest(final)}
+
+        if os.path.isdir(self.staging) and os.listdir(self.staging):
+            remove(self.work)
+            promote(self.staging, self.work)
+        else:
+            remove(self.staging)
+
+        write_json(self.manifest, {"key": self.key, "stage": self.name,
+                                   "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "outputs": outputs})
+        self.memo.save()
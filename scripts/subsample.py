@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# Coverage-capped read subsampling before assembly.
+# Flye's run time and memory grow with coverage while the assembly stops
+# improving well below the 500x some barcodes arrive with. The reads are
+# streamed once and a weighted reservoir (A-Res: key = log(u) / weight,
+# weight = read length x mean read quality) keeps the best-keyed reads
+# whose total length just reaches target depth x genome size. Long,
+# accurate reads are therefore preferred without discarding the rest
+# outright. When the input is already below the cap it is published as is
+# (hardlinked where the filesystem allows, see stage_cache.publish).
+
+import argparse
+import heapq
+import math
+import os
+import random
+import sys
+
+import yaml
+
+from fastq_io import create_fastq, format_record, mean_quality, open_fastq, read_fastq
+from stage_cache import publish
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", "-i", required=True, help="reads (FASTQ, optionally gzipped)")
+    parser.add_argument("--output", "-o", required=True, help="subsampled reads (.fastq.gz)")
+    parser.add_argument("--config", default=os.path.join(script_dir, "config", "subsample.yaml"),
+                        help="YAML file with the target depth and the genome sizes")
+    parser.add_argument("--depth", type=float, default=None, help="target depth (default: from the config)")
+    parser.add_argument("--genome_size", type=float, default=None,
+                        help="genome size in bases (default: from --species or the config)")
+    parser.add_argument("--species", default=None,
+                        help="genus or species, e.g. Klebsiella_pneumoniae, looked up in the config")
+    parser.add_argument("--species_file", default=None,
+                        help="file holding the species, e.g. written by rMLST; used when it exists")
+    parser.add_argument("--threads", "-t", type=int, default=2, help="threads for pigz")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def genome_size(config, args):
+    if args.genome_size:
+        return args.genome_size, "given"
+    species = (args.species or "").replace(" ", "_")
+    if args.species_file and os.path.isfile(args.species_file):
+        with open(args.species_file) as species_read:
+            species = species_read.read().strip() or species
+    sizes = config.get("genome_sizes", {})
+    if species:
+        # species first, then its genus
+        for name in (species, species.split("_")[0]):
+            if name in sizes:
+                return float(sizes[name]), name
+    return float(config.get("genome_size", 5e6)), "default"
+
+
+def subsample(path, target_bases, threads, seed):
+    # returns (reads, bases, kept records as [(index, record)], kept bases)
+    rng = random.Random(seed)
+    reservoir = []  # min-heap of (key, index, length, record)
+    kept_bases = 0
+    reads = bases = 0
+    with open_fastq(path, threads) as stream:
+        for index, (header, seq, qual) in enumerate(read_fastq(stream)):
+            reads += 1
+            length = len(seq)
+            bases += length
+            weight = length * mean_quality(qual)
+            if weight <= 0:
+                continue
+            # log(u) / w orders like u ** (1 / w) without underflowing to 1
+            key = math.log(1.0 - rng.random()) / weight
+            if reservoir and kept_bases >= target_bases and key <= reservoir[0][0]:
+                continue
+            heapq.heappush(reservoir, (key, index, length, format_record(header, seq, qual)))
+            kept_bases += length
+            # drop the lowest keys as long as the rest still reaches the target
+            while kept_bases - reservoir[0][2] >= target_bases:
+                kept_bases -= heapq.heappop(reservoir)[2]
+    return reads, bases, [(index, record) for _, index, _, record in reservoir], kept_bases
+
+
+def main():
+    args = parse_args()
+    with open(args.config) as config_read:
+        config = yaml.safe_load(config_read) or {}
+    depth = args.depth or float(config.get("target_depth", 100))
+    size, source = genome_size(config, args)
+    target = depth * size
+    print(f"Genome size {size / 1e6:.2f} Mb ({source}), capping at {depth:g}x = {target / 1e6:.1f} Mb", flush=True)
+
+    reads, bases, kept, kept_bases = subsample(args.input, target, args.threads, args.seed)
+    print(f"Input: {reads} reads, {bases / 1e6:.1f} Mb, {bases / size:.0f}x", flush=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    if os.path.lexists(args.output):
+        os.remove(args.output)
+    if bases <= target:
+        method = publish(args.input, args.output)
+        print(f"Below the cap, using all reads ({method})", flush=True)
+        return 0
+
+    kept.sort()
+    with create_fastq(args.output, args.threads) as out:
+        for _, record in kept:
+            out.write(record)
+    print(f"Kept: {len(kept)} reads, {kept_bases / 1e6:.1f} Mb, {kept_bases / size:.0f}x", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
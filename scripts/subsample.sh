@@ -0,0 +1,11 @@
+reads=$1
+output=$2
+threads=$3
+species=$4
+genome_size=$5
+
+. "$(dirname "$0")/mamba_env.sh"
+
+# Cap the reads handed to Flye at the target depth of config/subsample.yaml
+env_run workflow python "$(dirname "$0")/subsample.py" --input $reads --output $output --threads $threads \
+  ${species:+--species "$species"} ${genome_size:+--genome_size "$genome_size"}
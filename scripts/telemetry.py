@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+# Per-stage telemetry of the workflow scripts.
+# The scheduler hands every finished or cancelled job to a Telemetry log,
+# which appends one JSON line per job right away (so a crashed run keeps what
+# it had): start and end time, CPU time, peak RSS, bytes read and written,
+# exit status and whether the stage cache was hit. The logs of one or more tools
+# (fastplong, the per-sample workflow) are turned into a Chrome trace that
+# chrome://tracing and ui.perfetto.dev open, and a table of the slowest
+# stages.
+#
+# Usage: telemetry.py <log.jsonl>... [--trace trace.json] [--top 15]
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+
+def run_stamp():
+    return time.strftime("%Y%m%d-%H%M%S")
+
+
+def job_record(job, tool):
+    # jobs are named sample:stage by the workflow, parallel.py names them
+    # after the input file and the tool is the stage
+    sample, _, stage = job.name.partition(":")
+    record = {
+        "tool": tool,
+        "sample": sample,
+        "stage": stage or tool,
+        "status": job.status,
+        "exit_status": job.returncode,
+        # the skip callback of a stage is its cache lookup; a cancelled job
+        # never got to it and is recorded with a zero duration
+        "cache": None if job.skip is None or job.status == "cancelled" else (
+            "hit" if job.status == "skipped" else "miss"),
+        "threads": job.threads,
+        "mem_gb": job.mem_gb,
+        "start": job.started,
+        "end": job.finished,
+        "wall_s": None,
+        "user_s": None,
+        "sys_s": None,
+        "max_rss_mb": None,
+        "read_mb": None,
+        "write_mb": None,
+        "log": job.log,
+    }
+    if job.started is not None and job.finished is not None:
+        record["wall_s"] = round(job.finished - job.started, 3)
+    if job.usage:
+        record.update({k: None if v is None else round(v, 3) for k, v in job.usage.items()})
+    return record
+
+
+class Telemetry:
+    def __init__(self, path, tool):
+        self.path = path
+        self.tool = tool
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def record(self, job):
+        line = json.dumps(job_record(job, self.tool)) + "\n"
+        with self.lock, open(self.path, "a") as log:
+            log.write(line)
+
+    def finish(self, top=10):
+        # trace and summary next to the log, the summary is also printed
+        records = load([self.path])
+        if not records:
+            return
+        base = self.path[:-len(".jsonl")] if self.path.endswith(".jsonl") else self.path
+        write_trace(records, base + ".trace.json")
+        text = summary(records, top)
+        with open(base + ".summary.txt", "w") as out:
+            out.write(text)
+        print(text, end="", flush=True)
+        print(f"Telemetry: {self.path}, timeline: {base}.trace.json", flush=True)
+
+
+def load(paths):
+    records = []
+    for path in paths:
+        try:
+            with open(path) as log:
+                for line in log:
+                    line = line.strip()
+                    if line:
+                        records.append(json.loads(line))
+        except OSError:
+            print(f"Cannot read {path}", file=sys.stderr)
+    return records
+
+
+def write_trace(records, path):
+    # Chrome trace event format: one process per tool, one thread per sample,
+    # complete ("X") events for the stages and a counter of the threads in use
+    timed = [r for r in records if r.get("start") is not None and r.get("end") is not None]
+    if not timed:
+        return
+    t0 = min(r["start"] for r in timed)
+    pids, tids, events = {}, {}, []
+    for r in sorted(timed, key=lambda r: r["start"]):
+        pid = pids.setdefault(r["tool"], len(pids) + 1)
+        tid = tids.setdefault((r["tool"], r["sample"]), len(tids) + 1)
+        args = {k: r[k] for k in ("status", "exit_status", "cache", "threads", "mem_gb", "user_s", "sys_s",
+                                  "max_rss_mb", "read_mb", "write_mb")}
+        events.append({"name": r["stage"], "cat": r["tool"], "ph": "X", "pid": pid, "tid": tid,
+                       "ts": round((r["start"] - t0) * 1e6), "dur": round((r["end"] - r["start"]) * 1e6),
+                       "args": args})
+
+    for tool, pid in pids.items():
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": tool}})
+        changes = []
+        for r in timed:
+            if r["tool"] == tool and r.get("cache") != "hit" and r.get("status") != "cancelled":
+                changes += [(r["start"], r["threads"]), (r["end"], -r["threads"])]
+        in_use = 0
+        for at, delta in sorted(changes):
+            in_use += delta
+            events.append({"name": "threads in use", "ph": "C", "pid": pid,
+                           "ts": round((at - t0) * 1e6), "args": {"threads": in_use}})
+    for (tool, sample), tid in tids.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pids[tool], "tid": tid, "args": {"name": sample}})
+
+    tmp = path + ".tmp"
+    with open(tmp, "w") as out:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, out)
+    os.replace(tmp, path)
+
+
+def summary(records, top=10):
+    # per stage totals, slowest first, then the slowest single jobs; the CPU
+    # column is CPU time over wall time x threads, so a stage waiting on the
+    # network or the disk shows up with a low value
+    def fmt_table(header, rows):
+        widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+        return "".join("  ".join(str(v).ljust(w) for v, w in zip(row, widths)).rstrip() + "\n"
+                       for row in [header] + rows)
+
+    def mb(value):
+        return "-" if value is None else f"{value:.0f}"
+
+    ran = [r for r in records if r.get("wall_s") is not None and r.get("cache") != "hit"
+           and r.get("status") != "cancelled"]
+    stages = {}
+    for r in records:
+        key = (r["tool"], r["stage"])
+        s = stages.setdefault(key, {"jobs": 0, "hits": 0, "failed": 0, "cancelled": 0, "wall": 0.0, "max": 0.0, "cpu": 0.0,
+                                    "slots": 0.0, "rss": None, "read": 0.0, "write": 0.0})
+        s["jobs"] += 1
+        s["hits"] += r.get("cache") == "hit"
+        s["failed"] += r.get("status") == "failed"
+        s["cancelled"] += r.get("status") == "cancelled"
+        if r.get("wall_s") is None or r.get("cache") == "hit" or r.get("status") == "cancelled":
+            continue
+        s["wall"] += r["wall_s"]
+        s["max"] = max(s["max"], r["wall_s"])
+        s["cpu"] += (r.get("user_s") or 0) + (r.get("sys_s") or 0)
+        s["slots"] += r["wall_s"] * (r.get("threads") or 1)
+        if r.get("max_rss_mb") is not None:
+            s["rss"] = max(s["rss"] or 0, r["max_rss_mb"])
+        s["read"] += r.get("read_mb") or 0
+        s["write"] += r.get("write_mb") or 0
+
+    rows = []
+    for (tool, stage), s in sorted(stages.items(), key=lambda item: -item[1]["wall"]):
+        rows.append([stage, tool, s["jobs"], s["hits"], s["failed"], s["cancelled"], f"{s['wall']:.1f}", f"{s['max']:.1f}",
+                     f"{100 * s['cpu'] / s['slots']:.0f}%" if s["slots"] else "-",
+                     mb(s["rss"]), mb(s["read"]), mb(s["write"])])
+    text = "Stages by total wall time:\n" + fmt_table(
+        ["stage", "tool", "jobs", "cached", "failed", "cancelled", "wall_s", "max_s", "cpu", "peak_rss_mb", "read_mb", "write_mb"],
+        rows)
+
+    rows = [[f"{r['sample']}:{r['stage']}", r["tool"], f"{r['wall_s']:.1f}", r["threads"],
+             f"{(r.get('user_s') or 0) + (r.get('sys_s') or 0):.1f}", mb(r.get("max_rss_mb")), r["status"]]
+            for r in sorted(ran, key=lambda r: -r["wall_s"])[:top]]
+    if rows:
+        text += f"\nSlowest {len(rows)} jobs:\n" + fmt_table(
+            ["job", "tool", "wall_s", "threads", "cpu_s", "peak_rss_mb", "status"], rows)
+
+    timed = [r for r in records if r.get("start") is not None and r.get("end") is not None]
+    if timed:
+        text += f"\nSpan: {max(r['end'] for r in timed) - min(r['start'] for r in timed):.1f}s\n"
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", nargs="+", help="telemetry JSONL logs, e.g. of fastplong and the workflow of one run")
+    parser.add_argument("--trace", default=None, help="Chrome trace / Perfetto timeline to write")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest jobs to list")
+    args = parser.parse_args()
+
+    records = load(args.logs)
+    if not records:
+        print("No telemetry records found")
+        return 1
+    if args.trace:
+        write_trace(records, args.trace)
+        print(f"Timeline written to {args.trace}")
+    print(summary(records, args.top), end="")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# Read-yield triage of the filtered barcodes before assembly.
+# Every read file is scanned once for its read count, total bases, N50 and
+# a read length histogram; files are scanned in parallel processes. The
+# yields are written to a per-run table and compared with the thresholds of
+# config/triage.yaml: barcodes below the skip thresholds are not assembled
+# at all, barcodes below the low thresholds are scheduled after the others.
+# Scans are remembered by file size and mtime, so a rerun only scans new or
+# changed files.
+#
+# Usage: triage.py --reads_dir <filtered reads> --output yield.tsv
+
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import yaml
+
+from fastq_io import find_samples, open_fastq
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# upper bounds of the read length histogram bins, the last bin is open
+HISTOGRAM_BINS = [1000, 2000, 5000, 10000, 20000, 50000, 100000]
+TRIAGE_INDEX = ".triage_index.json"
+
+
+def histogram_labels():
+    labels, low = [], 0
+    for high in HISTOGRAM_BINS:
+        labels.append(f"len_{low // 1000}k_{high // 1000}k")
+        low = high
+    return labels + [f"len_{low // 1000}k_plus"]
+
+
+def scan(path):
+    # only the sequence lines are needed; counting their lengths with
+    # islice and Counter keeps the whole loop in C. The line ends are
+    # stripped, the last line of a file may have none.
+    with open_fastq(path) as stream:
+        lengths = Counter(map(len, map(bytes.rstrip, islice(stream, 1, None, 4))))
+
+    reads = bases = 0
+    histogram = [0] * (len(HISTOGRAM_BINS) + 1)
+    sizes = []
+    for length, n in lengths.items():
+        reads += n
+        bases += length * n
+        sizes.append((length, n))
+        b = 0
+        while b < len(HISTOGRAM_BINS) and length >= HISTOGRAM_BINS[b]:
+            b += 1
+        histogram[b] += n
+
+    # N50: length of the read at which half of the bases are reached,
+    # going from the longest read down
+    n50, covered = 0, 0
+    for length, n in sorted(sizes, reverse=True):
+        covered += length * n
+        if covered * 2 >= bases:
+            n50 = length
+            break
+
+    return {
+        "reads": reads,
+        "bases": bases,
+        "n50": n50,
+        "mean_length": round(bases / reads) if reads else 0,
+        "max_length": max((length for length, _ in sizes), default=0),
+        "histogram": histogram,
+    }
+
+
+def decide(stats, thresholds):
+    # run, low (scheduled last) or skip
+    def below(limits):
+        return any(stats[key] < float(limit) for key, limit in (limits or {}).items() if key in stats)
+
+    if below(thresholds.get("skip")):
+        return "skip"
+    if below(thresholds.get("low")):
+        return "low"
+    return "run"
+
+
+def triage(samples, output, thresholds, workers=None):
+    # samples are (name, path); returns {name: stats with "decision"} and
+    # writes the yield table to output
+    index_path = os.path.join(os.path.dirname(os.path.abspath(output)), TRIAGE_INDEX)
+    try:
+        with open(index_path) as index_read:
+            index = json.load(index_read)
+    except (OSError, ValueError):
+        index = {}
+
+    results, stale = {}, []
+    for name, path in samples:
+        st = os.stat(path)
+        stamp = [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+        cached = index.get(name)
+        if cached and cached["stamp"] == stamp:
+            results[name] = cached["stats"]
+        else:
+            stale.append((name, path, stamp))
+
+    if stale:
+        # scanning is CPU bound, use processes rather than threads
+        workers = max(1, min(len(stale), workers or os.cpu_count()))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for (name, _, stamp), stats in zip(stale, executor.map(scan, [path for _, path, _ in stale])):
+                results[name] = stats
+                index[name] = {"stamp": stamp, "stats": stats}
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        tmp = index_path + ".tmp"
+        with open(tmp, "w") as index_write:
+            json.dump(index, index_write)
+        os.replace(tmp, index_path)
+
+    for name, _ in samples:
+        results[name] = dict(results[name], decision=decide(results[name], thresholds))
+
+    tmp = output + ".tmp"
+    with open(tmp, "w") as table:
+        table.write("\t".join(["sample", "decision", "reads", "bases", "n50", "mean_length", "max_length"]
+                              + histogram_labels()) + "\n")
+        for name, path in samples:
+            stats = results[name]
+            table.write("\t".join(str(value) for value in [name, stats["decision"], stats["reads"], stats["bases"],
+                                                           stats["n50"], stats["mean_length"], stats["max_length"]]
+                                  + stats["histogram"]) + "\n")
+    os.replace(tmp, output)
+    return results
+
+
+def load_thresholds(path):
+    with open(path) as config_read:
+        return yaml.safe_load(config_read) or {}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reads_dir", "-i", required=True, help="folder with the filtered *.fastq.gz files")
+    parser.add_argument("--output", "-o", required=True, help="yield table to write")
+    parser.add_argument("--config", default=os.path.join(script_dir, "config", "triage.yaml"),
+                        help="YAML file with the yield thresholds")
+    parser.add_argument("--threads", "-t", type=int, default=None, help="number of files scanned at once")
+    args = parser.parse_args()
+
+    samples = find_samples(args.reads_dir)
+    results = triage(samples, args.output, load_thresholds(args.config), args.threads)
+    for name, _ in samples:
+        stats = results[name]
+        print(f"{name}: {stats['decision']} ({stats['reads']} reads, {stats['bases'] / 1e6:.1f} Mb, N50 {stats['n50']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+
+# Runs the per-sample stages of wf_Nanopore.sh (Flye, Medaka, Bakta, QUAST,
+# rMLST, MLST, PlasmidFinder, AMRFinderPlus) for every filtered read file.
+# Samples are processed concurrently; each stage requests the threads and
+# memory declared in config/resources.yaml and the scheduler packs them into
+# the CPU (-t) and memory (-M) budget of the run. Within a sample the stages
+# form a DAG, so everything that only needs the polished consensus runs side
+# by side. Stages are skipped through a content-addressed cache (see
+# stage_cache.py) rather than by checking whether their outputs exist.
+# Barcodes are triaged on their read yield first (see triage.py), so empty
+# or very low-yield barcodes never reach the assembler. Once a sample's
+# results are in, they are ingested into the cross-run results database
+# given with --results_db (see results_db.py). With --watch, samples are
+# also picked up while the reads of a sequencing run are still being
+# filtered (see SampleFeed).
+# With --db_local the databases are verified against their checksum
+# manifests and copied to node-local storage before the first stage (see
+# db_stage.py); the stages read them from there. Results are published
+# into Results/ as hardlinks or reflinks where the filesystem allows, and the
+# intermediates of a finished sample are compressed at a low priority
+# according to config/retention.yaml (see retention.py).
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import yaml
+
+import db_stage
+import results_db
+from fastq_io import find_samples
+from scheduler import Job, Scheduler
+from stage_cache import THREADS, CachedStage, DigestMemo, publish
+from telemetry import Telemetry, run_stamp
+from triage import load_thresholds, triage
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+env_dir = os.path.join(os.path.dirname(script_dir), "envs")
+
+# written into the reads folder by parallel.py --watch once all reads are filtered
+RUN_FINISHED = "RUN_FINISHED"
+
+# micromamba env of every stage, see envs/*.yaml
+STAGE_ENVS = {
+    "subsample": "workflow",
+    "flye": "flye",
+    "medaka": "medaka",
+    "bakta": "bakta",
+    "rmlst": "rmlst",
+    "amrfinder": "amrfinderplus",
+    "quast": "quast",
+    "mlst": "mlst",
+    "plasmidfinder": "gep-finders",
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reads_dir", "-i", required=True,
+                        help="folder with the filtered *.hq.fastq.gz files")
+    parser.add_argument("--output_dir", "-o", required=True,
+                        help="workflow output directory")
+    parser.add_argument("--db_root", "-d", required=True,
+                        help="database root directory")
+    parser.add_argument("--db_local", default=None,
+                        help="node-local folder the databases are copied to before the run "
+                             "(default: none, they are read from --db_root)")
+    parser.add_argument("--db_verify", action="store_true",
+                        help="with --db_local, check the content of existing local database copies, "
+                             "not only the file sizes and mtimes")
+    parser.add_argument("--db_prefetch", default=",".join(db_stage.HOT_DATABASES),
+                        help="with --db_local, comma separated databases whose local copies are read ahead "
+                             "into the page cache ('' for none)")
+    parser.add_argument("--threads", "-t", type=int, default=4,
+                        help="total number of CPU cores the run may use")
+    parser.add_argument("--mem", "-M", type=float, default=0,
+                        help="total memory in GB the run may use (default: available memory)")
+    parser.add_argument("--basecaller", "-m", default="",
+                        help="basecaller model passed to Medaka")
+    parser.add_argument("--organism_file", default=os.path.join(script_dir, "config", "supported_organisms.yaml"),
+                        help="YAML file containing supported organisms")
+    parser.add_argument("--resources", default=os.path.join(script_dir, "config", "resources.yaml"),
+                        help="YAML file with the per-stage thread and memory requests")
+    parser.add_argument("--triage", default=os.path.join(script_dir, "config", "triage.yaml"),
+                        help="YAML file with the read-yield thresholds for skipping or deferring barcodes")
+    parser.add_argument("--retention", default=os.path.join(script_dir, "config", "retention.yaml"),
+                        help="YAML file with the rules for compressing the intermediates of finished samples "
+                             "('' keeps them as they are)")
+    parser.add_argument("--species", default="",
+                        help="expected genus or species, sets the genome size used to cap the read depth before assembly")
+    parser.add_argument("--genome_size", type=float, default=0,
+                        help="expected genome size in bases, overrides the one of --species")
+    parser.add_argument("--watch", action="store_true",
+                        help=f"keep picking up new read files until {RUN_FINISHED} appears in the reads folder")
+    parser.add_argument("--poll", type=float, default=60,
+                        help="seconds between two scans of the reads folder with --watch")
+    parser.add_argument("--telemetry", default=None,
+                        help="per-stage telemetry log (default: <output_dir>/telemetry/<date>.workflow.jsonl), "
+                             "a timeline and a summary of the slowest stages are written next to it")
+    parser.add_argument("--results_db", default=None,
+                        help="cross-run results database the results of every sample are ingested into "
+                             "(default: none)")
+    parser.add_argument("--run_id", default=None,
+                        help="name of the run in the results database (default: the output directory)")
+    return parser.parse_args()
+
+
+def load_resources(path, threads):
+    with open(path) as resources_read:
+        stages = yaml.safe_load(resources_read).get("stages", {})
+
+    resources = {}
+    for stage, request in stages.items():
+        resources[stage] = {
+            "threads": max(1, min(int(request.get("threads", 1)), threads)),
+            "mem_gb": float(request.get("mem_gb", 0)),
+        }
+    return resources
+
+
+def result_copies(sample, flye_dir, results_dir):
+    return [
+        (os.path.join(flye_dir, "medaka", "consensus.fasta"), os.path.join(results_dir, "Fasta", f"{sample}_ONT.fasta")),
+        (os.path.join(flye_dir, "mlst.tsv"), os.path.join(results_dir, "MLST", f"{sample}_ONT.tsv")),
+        (os.path.join(flye_dir, "plasmidfinder", "results_tab.tsv"), os.path.join(results_dir, "PlasmidFinder", f"{sample}_ONT.tsv")),
+        (os.path.join(flye_dir, f"{sample}_ONT_amrf.txt"), os.path.join(results_dir, "AMRFinderPlus", f"{sample}_ONT.txt")),
+        (os.path.join(flye_dir, "bakta", f"{sample}.tsv"), os.path.join(results_dir, "Bakta", f"{sample}_ONT.tsv")),
+    ]
+
+
+def collect_results(sample, copies):
+    def collect():
+        missing = 0
+        methods = {}
+        for src, dst in copies:
+            if os.path.isfile(src):
+                method = publish(src, dst)
+                methods[method] = methods.get(method, 0) + 1
+            else:
+                print(f"{sample}: missing result {src}", flush=True)
+                missing += 1
+        print(f"{sample}: results " + ", ".join(f"{method} {count}" for method, count in sorted(methods.items())),
+              flush=True)
+        return 1 if missing else 0
+
+    return collect
+
+
+def ingest_results(db_path, run, sample, files, species_file):
+    def ingest():
+        count = results_db.ingest(db_path, run, sample, files, species_file)
+        if count is not None:
+            print(f"{sample}: {count} rows ingested into {db_path}", flush=True)
+        return 0
+
+    return ingest
+
+
+def sample_jobs(index, sample, reads, args, resources, memo, databases):
+    out = args.output_dir
+    flye_dir = os.path.join(out, "flye", sample)
+    log_dir = os.path.join(out, "logs", sample)
+
+    def database(name):
+        # the staged copy if there is one
+        return databases[name]["path"] if name in databases else os.path.join(args.db_root, name)
+
+    db_plasm = database("plasmidfinder")
+    db_bakta = database("bakta")
+    db_amr = database("amrfinder")
+    db_sketch = os.path.join(database("sketch"), "species.sketch")
+
+    subsampled = os.path.join(flye_dir, "subsampled.fastq.gz")
+    flye_assembly = os.path.join(flye_dir, "assembly.fasta")
+    flye_medaka = os.path.join(flye_dir, "medaka")
+    flye_consensus = os.path.join(flye_medaka, "consensus.fasta")
+    flye_bakta_dir = os.path.join(flye_dir, "bakta")
+    flye_quast_dir = os.path.join(flye_dir, "quast")
+    species_ONT_file = os.path.join(flye_dir, f"{sample}.species")
+    flye_rmlst = os.path.join(flye_dir, f"{sample}_ONT_rmlst.tsv")
+    flye_mlst = os.path.join(flye_dir, "mlst.tsv")
+    flye_plasfinder = os.path.join(flye_dir, "plasmidfinder")
+    flye_amrfinder = os.path.join(flye_dir, f"{sample}_ONT_amrf.txt")
+    os.makedirs(flye_dir, exist_ok=True)
+
+    def script(name):
+        return os.path.join(script_dir, name)
+
+    def staging(stage, rel):
+        return os.path.join(flye_dir, ".staging", stage, rel)
+
+    # stages of one sample; the order of the list is the start priority, the
+    # dependencies follow from the declared inputs and outputs. Commands write
+    # into the stage's staging directory, outputs are (final path, staged path,
+    # optional) and are moved into place when the stage succeeds.
+    stages = [
+        # Flye gets the reads capped at the target depth, Medaka all of them.
+        # The species detected by rMLST is not used here: it comes from the
+        # assembly, so only the configured one (--species or --genome_size,
+        # wf_Nanopore.sh -g) sets the genome size.
+        dict(name="subsample", label="Subsampling reads...",
+             inputs=[reads, script("subsample.py"), script("fastq_io.py"), os.path.join(script_dir, "config", "subsample.yaml")],
+             outputs=[(subsampled, "reads.fastq.gz", False)],
+             cmd=["sh", script("subsample.sh"), reads, staging("subsample", "reads.fastq.gz"), THREADS, args.species,
+                  f"{args.genome_size:g}" if args.genome_size else ""]),
+        dict(name="flye", label="Assemblying with Flye...",
+             inputs=[subsampled], outputs=[(flye_assembly, "out/assembly.fasta", False)],
+             cmd=["sh", script("flye.sh"), subsampled, staging("flye", "out"), THREADS]),
+        # resumable: the shards polished before an interruption are kept
+        dict(name="medaka", label="Polishing assemblies...",
+             inputs=[reads, flye_assembly, script("medaka_sharded.py")], outputs=[(flye_medaka, "out", False)],
+             resumable=True,
+             cmd=["sh", script("medaka.sh"), reads, staging("medaka", "out"), flye_assembly, THREADS, args.basecaller]),
+        # Bakta is the longest branch after polishing, start it first
+        dict(name="bakta", label="Annotating consensus with Bakta...",
+             inputs=[flye_consensus], dbs=[db_bakta], outputs=[(flye_bakta_dir, "out", False)],
+             cmd=["sh", script("bakta.sh"), flye_consensus, staging("bakta", "out"), sample, THREADS, db_bakta]),
+        # rMLST writes nothing when there is no match and no species file for
+        # organisms AMRFinderPlus does not support; the species sketch (if
+        # sketch_setup.sh built one) answers confident matches offline
+        dict(name="rmlst", label="Performing rMLST on consensus...",
+             inputs=[flye_consensus, args.organism_file, script("rmlst.py"), script("sketch.py")], dbs=[db_sketch],
+             outputs=[(flye_rmlst, "rmlst.tsv", True), (species_ONT_file, "species", True)],
+             cmd=["sh", script("run_rmlst.sh"), flye_consensus, staging("rmlst", "rmlst.tsv"), args.organism_file,
+                  staging("rmlst", "species"), script_dir, db_sketch]),
+        dict(name="amrfinder", label="AMRFinderPlus on consensus...",
+             inputs=[flye_consensus, species_ONT_file], dbs=[db_amr], outputs=[(flye_amrfinder, "amrf.txt", False)],
+             cmd=["sh", script("amrfinderplus.sh"), flye_consensus, staging("amrfinder", "amrf.txt"), species_ONT_file, THREADS,
+                  db_amr]),
+        dict(name="quast", label="QUAST creating report...",
+             inputs=[flye_consensus, reads], outputs=[(flye_quast_dir, "out", False)],
+             cmd=["sh", script("quast.sh"), flye_consensus, staging("quast", "out"), reads, THREADS]),
+        dict(name="mlst", label="Performing MLST on consensus...",
+             inputs=[flye_consensus], outputs=[(flye_mlst, "mlst.tsv", False)],
+             cmd=["sh", script("mlst.sh"), flye_consensus, staging("mlst", "mlst.tsv"), sample]),
+        dict(name="plasmidfinder", label="PlasmidFinder on consensus...",
+             inputs=[flye_consensus], dbs=[db_plasm], outputs=[(flye_plasfinder, "out", False)],
+             cmd=["sh", script("plasmidfinder.sh"), flye_consensus, staging("plasmidfinder", "out"), db_plasm]),
+    ]
+
+    jobs = []
+    for order, stage in enumerate(stages):
+        name = stage["name"]
+        # the wrapper script is part of the command line, so it is hashed as an input
+        cached = CachedStage(
+            name, stage["cmd"], resources[name]["threads"],
+            inputs=stage["inputs"] + [stage["cmd"][1]], dbs=stage.get("dbs", []),
+            outputs=stage["outputs"], env_file=os.path.join(env_dir, f"{STAGE_ENVS[name]}.yaml"),
+            sample_dir=flye_dir, memo=memo, aliases={script_dir: "<scripts>"},
+            resumable=stage.get("resumable", False),
+        )
+        jobs.append(Job(
+            f"{sample}:{name}", cmd=cached.cmd, label=stage["label"],
+            skip=cached.lookup, before=cached.prepare, after=cached.commit,
+            inputs=stage["inputs"] + stage.get("dbs", []), outputs=[final for final, _, _ in stage["outputs"]],
+            threads=resources[name]["threads"], mem_gb=resources[name]["mem_gb"],
+            log=os.path.join(log_dir, f"{name}.log"),
+            priority=(index, order),
+        ))
+
+    copies = result_copies(sample, flye_dir, os.path.join(out, "Results"))
+    jobs.append(Job(
+        f"{sample}:collect", func=collect_results(sample, copies), label="Collecting results...",
+        inputs=[src for src, _ in copies], outputs=[dst for _, dst in copies],
+        threads=1, mem_gb=0, priority=(index, len(stages)),
+    ))
+
+    ingest_files = {
+        "mlst": flye_mlst,
+        "rmlst": flye_rmlst,
+        "plasmids": os.path.join(flye_plasfinder, "results_tab.tsv"),
+        "amr": flye_amrfinder,
+        "bakta": os.path.join(flye_bakta_dir, f"{sample}.tsv"),
+    }
+    if args.results_db:
+        run = args.run_id or os.path.abspath(out)
+        jobs.append(Job(
+            f"{sample}:ingest", func=ingest_results(args.results_db, run, sample, ingest_files, species_ONT_file),
+            label="Ingesting results...", inputs=list(ingest_files.values()) + [species_ONT_file],
+            threads=1, mem_gb=0, priority=(index, len(stages) + 1),
+        ))
+
+    if args.retention:
+        # after the stages and the collection; what any of them reads stays as it is
+        protect = sorted({path for stage in stages for path in stage["inputs"] if path.startswith(flye_dir)}
+                         | {src for src, _ in copies} | set(ingest_files.values()) | {species_ONT_file})
+        jobs.append(Job(
+            f"{sample}:retention", label="Compressing intermediates...",
+            cmd=[sys.executable, script("retention.py"), "--sample_dir", flye_dir, "--config", args.retention,
+                 "--protect"] + protect,
+            inputs=[final for stage in stages for final, _, _ in stage["outputs"]] + [dst for _, dst in copies],
+            threads=1, mem_gb=0, log=os.path.join(log_dir, "retention.log"),
+            priority=(index + 1_000_000, 0),
+        ))
+    return jobs
+
+
+def admit_samples(samples, known, args):
+    # triages the new samples (the yield table lists every sample seen so
+    # far) and returns the ones to run, low-yield ones last
+    yield_table = os.path.join(args.output_dir, "yield.tsv")
+    yields = triage(known + samples, yield_table, load_thresholds(args.triage), args.threads)
+    skipped = [sample for sample, _ in samples if yields[sample]["decision"] == "skip"]
+    deferred = [sample for sample, _ in samples if yields[sample]["decision"] == "low"]
+    print(f"Read yields written to {yield_table}", flush=True)
+    if skipped:
+        print("Skipping low-yield barcodes: " + ", ".join(skipped), flush=True)
+    if deferred:
+        print("Scheduling low-yield barcodes last: " + ", ".join(deferred), flush=True)
+    # the sample order is the start priority
+    return sorted((s for s in samples if s[0] not in skipped), key=lambda s: s[0] in deferred)
+
+
+def reads_stamp(reads):
+    try:
+        st = os.stat(reads)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+class SampleFeed:
+    # Watch mode: hands the scheduler the jobs of samples that appear in the
+    # reads folder while the others run. parallel.py --watch publishes reads
+    # there by rename, so a listed file is complete. A sample whose reads are
+    # published again (filtered once more) is admitted again once its earlier
+    # jobs have ended; its stages are keyed on the reads' content, so they
+    # rerun. Returns None once RUN_FINISHED is there and every sample has
+    # been handed out.
+
+    def __init__(self, args, resources, memo, databases, known, admitted, jobs):
+        self.args = args
+        self.resources = resources
+        self.memo = memo
+        self.databases = databases
+        self.known = list(known)
+        self.admitted = admitted
+        self.jobs = jobs  # sample: its jobs of the latest admission
+        self.stamps = {sample: reads_stamp(reads) for sample, reads in known}
+        self.last_poll = time.time()
+
+    def __call__(self):
+        now = time.time()
+        if now - self.last_poll < self.args.poll:
+            return []
+        self.last_poll = now
+
+        # checked before listing, so every file published before the marker is seen
+        finished = os.path.exists(os.path.join(self.args.reads_dir, RUN_FINISHED))
+        names = {sample for sample, _ in self.known}
+        new, again, busy = [], [], 0
+        for sample, reads in find_samples(self.args.reads_dir):
+            if sample not in names:
+                new.append((sample, reads))
+            elif reads_stamp(reads) != self.stamps.get(sample):
+                if any(job.status is None for job in self.jobs.get(sample, [])):
+                    busy += 1
+                else:
+                    again.append((sample, reads))
+        if not new and not again:
+            return None if finished and not busy else []
+
+        run = []
+        if new:
+            print("New samples: " + ", ".join(sample for sample, _ in new), flush=True)
+            run += admit_samples(new, self.known, self.args)
+            self.known.extend(new)
+        if again:
+            print("Reads published again: " + ", ".join(sample for sample, _ in again), flush=True)
+            others = [s for s in self.known if s[0] not in {sample for sample, _ in again}]
+            run += admit_samples(again, others, self.args)
+        for sample, reads in new + again:
+            self.stamps[sample] = reads_stamp(reads)
+        jobs = []
+        for sample, reads in run:
+            self.jobs[sample] = sample_jobs(self.admitted, sample, reads, self.args, self.resources, self.memo,
+                                            self.databases)
+            jobs.extend(self.jobs[sample])
+            self.admitted += 1
+        return jobs
+
+
+def main():
+    args = parse_args()
+    resources = load_resources(args.resources, args.threads)
+
+    samples = find_samples(args.reads_dir)
+    if not samples and not args.watch:
+        print(f"No filtered reads found in {args.reads_dir}")
+        return 0
+
+    run = admit_samples(samples, [], args) if samples else []
+    if not run and not args.watch:
+        return 0
+
+    # resolve the activation of every env once, up front, instead of letting
+    # the first stages of concurrent samples race to do it
+    envs = sorted(set(STAGE_ENVS.values()))
+    subprocess.run(["sh", os.path.join(script_dir, "mamba_env.sh"), "--resolve"] + envs)
+
+    telemetry_log = args.telemetry or os.path.join(args.output_dir, "telemetry", f"{run_stamp()}.workflow.jsonl")
+    # the versions and digests of the databases go next to the run's telemetry
+    databases = db_stage.stage(
+        args.db_root, args.db_local, verify=args.db_verify,
+        prefetch_names=[name for name in args.db_prefetch.split(",") if name],
+        record=os.path.join(os.path.dirname(telemetry_log), os.path.basename(telemetry_log).split(".")[0] + ".databases.json"),
+        threads=max(1, min(args.threads, 8)),
+    )
+    memo = DigestMemo(os.path.join(args.output_dir, ".cache", "digests.json"))
+    # the stage cache keys on the database content, wherever the copy lives;
+    # without --db_local the databases keep the fingerprint of their file listing
+    for db in databases.values():
+        if "digest" in db:
+            memo.pin(db["path"], "manifest:" + db["digest"])
+
+    jobs, by_sample = [], {}
+    for index, (sample, reads) in enumerate(run):
+        by_sample[sample] = sample_jobs(index, sample, reads, args, resources, memo, databases)
+        jobs.extend(by_sample[sample])
+
+    telemetry = Telemetry(telemetry_log, "workflow")
+    scheduler = Scheduler(args.threads, args.mem, telemetry=telemetry)
+    print(f"Scheduling {len(run)} samples on {scheduler.cpus} cores and {scheduler.mem_gb:.1f}G of memory", flush=True)
+    feed = None
+    if args.watch:
+        print(f"Watching {args.reads_dir} for new samples until {RUN_FINISHED} appears", flush=True)
+        feed = SampleFeed(args, resources, memo, databases, samples, len(run), by_sample)
+    jobs = scheduler.run(jobs, feed=feed, interval=min(5, args.poll))
+    memo.save()
+    telemetry.finish()
+
+    failed = [job.name for job in jobs if job.status == "failed"]
+    if failed:
+        print("Failed stages: " + ", ".join(failed))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,40 +2,64 @@
 
 # Set default values for optional arguments
 threads=4  # Default number of threads if not provided
+memory=0   # Default memory budget in GB (0 = use the available memory)
+watch=0    # Process the reads while the sequencing run is still writing them
 
 # Initialize variables for required arguments (these must be passed by the user)
 input_dir=""
 output_dir=""
 basecaller=""
 db_root=""
+db_local=""  # Node-local folder the databases are staged into (optional)
+genome=""    # Expected species or genome size, sets the read depth cap before assembly (optional)
+results_db="" # Cross-run results database the samples are ingested into (optional)
 
 # Parse arguments passed to the script
 # -d: Path to the database root (optional)
+# -l: Node-local folder to copy the databases into before the run (optional)
 # -i: Path to the input directory (required)
 # -o: Path to the output directory (required)
 # -t: Number of threads to use (optional)
+# -M: Memory budget in GB (optional)
 # -m: Basecaller model (optional)
-while getopts ":d:i:o:t:m:" option; do
+# -g: Expected species or genome size in bases (optional)
+# -r: Cross-run results database (optional)
+# -w: Watch the input directory during the run (optional)
+while getopts ":d:l:i:o:t:M:m:g:r:w" option; do
     case $option in
         d) db_root=$OPTARG;;          # Set database directory
+        l) db_local=$OPTARG;;         # Set local database staging directory
         i) input_dir=$OPTARG;;        # Set input directory
         o) output_dir=$OPTARG;;       # Set output directory
         t) threads=$OPTARG;;          # Override default threads if provided
+        M) memory=$OPTARG;;           # Override default memory budget if provided
         m) basecaller=$OPTARG;;       # Set basecaller model
+        g) genome=$OPTARG;;           # Set expected species or genome size
+        r) results_db=$OPTARG;;       # Set results database
+        w) watch=1;;                  # Watch the input directory
         \?) echo "Invalid option: -$OPTARG" >&2; exit 1;;
         :)  echo "Option -$OPTARG requires an argument." >&2; exit 1;;
     esac
 done
 
 # Ensure required arguments are provided
-# (basecaller is OPTIONAL; threads has a default)
+# (basecaller is OPTIONAL; threads and memory have a default)
 if [ -z "$db_root" ] || [ -z "$input_dir" ] || [ -z "$output_dir" ]; then
-    echo "Usage: $0 -d <db_root> -i <input_dir> -o <output_dir> [-t <threads>] [-m <basecaller_model>]"
+    echo "Usage: $0 -d <db_root> -i <input_dir> -o <output_dir> [-t <threads>] [-M <memory_gb>] [-m <basecaller_model>] [-g <species|genome_size>] [-r <results_db>] [-l <local_db_dir>] [-w]"
     echo "  -d: Path to the database root (required)"
-    echo "  -i: Path to the input directory (required)"
+    echo "  -l: Node-local folder the databases are copied to and read from, e.g. /tmp (optional)"
+    echo "  -i: Path to the input directory with FASTQ files or barcode folders of FASTQ chunks, e.g. fastq_pass (required)"
     echo "  -o: Path to the output directory (required)"
-    echo "  -t: Number of threads to use (optional, default: $threads)"
+    echo "  -t: Number of threads to use across all samples (optional, default: $threads)"
+    echo "  -M: Memory budget in GB across all samples (optional, default: available memory)"
     echo "  -m: Basecaller model (optional)"
+    echo "  -g: Expected species (e.g. Klebsiella_pneumoniae) or genus, or the genome size in bases;"
+    echo "      reads are capped at the target depth of scripts/config/subsample.yaml for this genome size"
+    echo "      before assembly (optional, default: $(sed -n 's/^genome_size: *//p' scripts/config/subsample.yaml) bases)"
+    echo "  -r: SQLite database the results of every sample are ingested into, shared across runs,"
+    echo "      e.g. on the storage the runs are written to (optional, default: no database)"
+    echo "  -w: Watch the input directory and process barcodes while the run is going on;"
+    echo "      ends once MinKNOW writes final_summary*.txt or RUN_FINISHED is created (optional)"
     exit 1
 fi
 
@@ -43,16 +67,17 @@ fi
 echo "=============================="
 echo "Configuration:"
 echo "Database Root:      $db_root"
+echo "Local Databases:    ${db_local:-none}"
 echo "Input Directory:    $input_dir"
 echo "Output Directory:   $output_dir"
 echo "Threads:            $threads"
+echo "Memory (GB):        $memory"
 echo "Basecaller Model:   $basecaller"
+echo "Species/Genome:     ${genome:-default genome size}"
+echo "Results Database:   ${results_db:-none}"
+echo "Watch Mode:         $watch"
 echo "=============================="
 
-# Define paths for the databases
-db_plasm="$db_root/plasmidfinder"
-db_bakta="$db_root/bakta"
-
 # Path to the file that contains supported organism information
 organism_file="scripts/config/supported_organisms.yaml"
 
@@ -65,121 +90,69 @@ amrfinder_dir="$results_dir/AMRFinderPlus"
 fastplong_dir="$output_dir/fastplong"
 filtered_outdir="$fastplong_dir/filtered_reads"
 bakta_dir="$results_dir/Bakta"
+# per-stage timing and resource logs of this run, merged into one timeline at the end
+telemetry_dir="$output_dir/telemetry"
+run_stamp=$(date +%Y%m%d-%H%M%S)
+
+# -g is a genome size when it is a number, a species or genus otherwise
+if [[ $genome =~ ^[0-9]+(\.[0-9]+)?([eE][0-9]+)?$ ]]; then
+  genome_args=(--genome_size "$genome")
+else
+  genome_args=(${genome:+--species "$genome"})
+fi
 
 # Create result directories
 mkdir -p "$consensus_dir" "$mlst_dir" "$plasmidfinder_dir" "$amrfinder_dir" "$filtered_outdir" "$bakta_dir"
 
-# Skip fastplong if filtered reads already exist
-if find "$filtered_outdir" -maxdepth 1 -iname "*.fastq.gz" | read -r _; then
-  echo "Filtered reads detected in $filtered_outdir — skipping fastplong."
+if [ "$watch" -eq 1 ]; then
+  # fastplong filters every read file once it has settled and publishes it
+  # into filtered_outdir, where the workflow picks the sample up; both run
+  # until the sequencing run has finished. A quarter of the threads go to
+  # fastplong, the rest to the per-sample stages.
+  fastplong_threads=$(( threads / 4 > 0 ? threads / 4 : 1 ))
+  workflow_threads=$(( threads - fastplong_threads > 0 ? threads - fastplong_threads : 1 ))
+  bash scripts/fastplong.sh $input_dir $fastplong_dir $fastplong_threads \
+    --watch --publish_dir "$filtered_outdir" --telemetry "$telemetry_dir/$run_stamp.fastplong.jsonl" \
+    > "$fastplong_dir/fastplong.log" 2>&1 &
+  fastplong_pid=$!
+
+  sh scripts/mamba_env.sh workflow python scripts/workflow.py \
+    --reads_dir "$filtered_outdir" --output_dir "$output_dir" --db_root "$db_root" \
+    --threads "$workflow_threads" --mem "$memory" --basecaller "$basecaller" --organism_file "$organism_file" \
+    "${genome_args[@]}" ${db_local:+--db_local "$db_local"} ${results_db:+--results_db "$results_db"} --watch --telemetry "$telemetry_dir/$run_stamp.workflow.jsonl"
+
+  wait "$fastplong_pid" || echo "fastplong exited with an error, see $fastplong_dir/fastplong.log" >&2
 else
-  # Run fastplong
-  bash scripts/fastplong.sh $input_dir $fastplong_dir $threads > "$fastplong_dir/fastplong.log" 2>&1
-fi
-
-# Move any produced fastqs into filtered_outdir (dest must be a directory)
-if compgen -G "$fastplong_dir/*.fastq.gz" > /dev/null; then
-  mv "$fastplong_dir"/*.fastq.gz "$filtered_outdir"/
+  # Skip fastplong if filtered reads already exist
+  if find "$filtered_outdir" -maxdepth 1 -iname "*.fastq.gz" | read -r _; then
+    echo "Filtered reads detected in $filtered_outdir — skipping fastplong."
+  else
+    # Run fastplong
+    bash scripts/fastplong.sh $input_dir $fastplong_dir $threads \
+      --telemetry "$telemetry_dir/$run_stamp.fastplong.jsonl" > "$fastplong_dir/fastplong.log" 2>&1
+  fi
+
+  # Move any produced fastqs into filtered_outdir (dest must be a directory)
+  if compgen -G "$fastplong_dir/*.fastq.gz" > /dev/null; then
+    mv "$fastplong_dir"/*.fastq.gz "$filtered_outdir"/
+  fi
+
+  # Run the per-sample stages; samples run concurrently within the CPU and memory budget
+  sh scripts/mamba_env.sh workflow python scripts/workflow.py \
+    --reads_dir "$filtered_outdir" --output_dir "$output_dir" --db_root "$db_root" \
+    --threads "$threads" --mem "$memory" --basecaller "$basecaller" --organism_file "$organism_file" \
+    "${genome_args[@]}" ${db_local:+--db_local "$db_local"} ${results_db:+--results_db "$results_db"} --telemetry "$telemetry_dir/$run_stamp.workflow.jsonl"
 fi
 
-# Loop through all .fastq.gz files in filtered reads directory
-for np_raw_file in $(find "$filtered_outdir" -maxdepth 1 -iname "*.fastq.gz"); do
-    # Extract the sample name (your fastplong outputs use .hq.fastq.gz)
-    sample=$(basename "$np_raw_file" .hq.fastq.gz)
-    echo "$sample"
-
-    # Create log directory for each sample
-    log_dir="$output_dir/logs/$sample"
-    mkdir -p "$log_dir"
-
-    # Assembly with Flye
-    echo "Assemblying with Flye..."
-    flye_dir="$output_dir/flye/$sample"
-    flye_assembly="$flye_dir/assembly.fasta"
-    if [ ! -f "$flye_assembly" ]; then
-      mkdir -p "$flye_dir"
-      sh scripts/flye.sh "$np_raw_file" "$flye_dir" "$threads" > "$log_dir/flye.log" 2>&1
-    else
-      echo "Assembly file detected, skipping assembly: $flye_assembly"
-    fi
-
-    # Polishing assemblies
-    echo "Polishing assemblies..."
-    flye_medaka="$flye_dir/medaka"
-    flye_consensus="$flye_medaka/consensus.fasta"
-    if [ ! -f "$flye_consensus" ]; then
-      mkdir -p "$flye_medaka"
-      sh scripts/medaka.sh "$np_raw_file" "$flye_medaka" "$flye_assembly" "$threads" > "$log_dir/medaka.log" 2>&1
-    else
-      echo "Consensus file detected, skipping polishing: $flye_consensus"
-    fi
-
-    # Annotation with Bakta
-    echo "Annotating consensus with Bakta..."
-    flye_bakta_dir="$flye_dir/bakta"
-    if [ -d "$flye_bakta_dir" ] && [ -n "$(ls -A "$flye_bakta_dir" 2>/dev/null)" ]; then
-      echo "Bakta output detected, skipping: $flye_bakta_dir"
-    else
-      sh scripts/bakta.sh "$flye_consensus" "$flye_bakta_dir" "$sample" "$threads" "$db_bakta" > "$log_dir/bakta.log" 2>&1
-    fi
-
-    # QUAST
-    echo "QUAST creating report..."
-    flye_quast_dir="$flye_dir/quast"
-    if [ -d "$flye_quast_dir" ] && [ -n "$(ls -A "$flye_quast_dir" 2>/dev/null)" ]; then
-      echo "QUAST output detected, skipping: $flye_quast_dir"
-    else
-      sh scripts/quast.sh "$flye_consensus" "$flye_quast_dir" "$np_raw_file" "$threads" > "$log_dir/quast.log" 2>&1
-    fi
-
-    # rMLST
-    echo "Performing rMLST on consensus..."
-    species_ONT_file="$flye_dir/$sample.species"
-    flye_rmlst="$flye_dir/${sample}_ONT_rmlst.tsv"
-    if [ -s "$flye_rmlst" ] && [ -s "$species_ONT_file" ]; then
-      echo "rMLST outputs detected, skipping: $flye_rmlst and $species_ONT_file"
-    else
-      sh scripts/run_rmlst.sh "$flye_consensus" "$flye_rmlst" "$organism_file" "$species_ONT_file" scripts > "$log_dir/rmlst.log" 2>&1
-    fi
-
-    # MLST
-    echo "Performing MLST on consensus..."
-    flye_mlst="$flye_dir/mlst.tsv"
-    if [ -s "$flye_mlst" ]; then
-      echo "MLST output detected, skipping: $flye_mlst"
-    else
-      sh scripts/mlst.sh "$flye_consensus" "$flye_mlst" "$sample" > "$log_dir/mlst.log" 2>&1
-    fi
-
-    # PlasmidFinder
-    echo "PlasmidFinder on consensus..."
-    flye_plasfinder="$flye_dir/plasmidfinder"
-    if [ -d "$flye_plasfinder" ] && [ -n "$(ls -A "$flye_plasfinder" 2>/dev/null)" ]; then
-      echo "PlasmidFinder output detected, skipping: $flye_plasfinder"
-    else
-      sh scripts/plasmidfinder.sh "$flye_consensus" "$flye_plasfinder" "$db_plasm" > "$log_dir/plasmidfinder.log" 2>&1
-    fi
-
-    # AMRFinderPlus
-    echo "AMRFinderPlus on consensus..."
-    flye_amrfinder="$flye_dir/${sample}_ONT_amrf.txt"
-    if [ -s "$flye_amrfinder" ]; then
-      echo "AMRFinderPlus output detected, skipping: $flye_amrfinder"
-    else
-      sh scripts/amrfinderplus.sh "$flye_consensus" "$flye_amrfinder" "$species_ONT_file" "$threads" > "$log_dir/amrfinder.log" 2>&1
-    fi
-
-    # Collect results
-    cp "$flye_consensus" "$consensus_dir/${sample}_ONT.fasta"
-    cp "$flye_mlst" "$mlst_dir/${sample}_ONT.tsv"
-    cp -r "$flye_plasfinder/results_tab.tsv" "$plasmidfinder_dir/${sample}_ONT.tsv"
-    cp "$flye_amrfinder" "$amrfinder_dir/${sample}_ONT.txt"
-    cp -r "$flye_bakta_dir/${sample}.tsv" "$bakta_dir/${sample}_ONT.tsv"
-done
-
 # Skip report generation if an AMRFinderPlus HTML already exists
 if ls "$results_dir/AMRFinderPlus"/*.html >/dev/null 2>&1; then
   echo "AMRFinderPlus HTML report already present — skipping report generation."
 else
   bash scripts/generate_html.sh "$results_dir/AMRFinderPlus"
-fi
\ No newline at end of file
+fi
+
+# Timeline of fastplong and the per-sample stages (open in ui.perfetto.dev) and the slowest stages
+if ls "$telemetry_dir/$run_stamp".*.jsonl >/dev/null 2>&1; then
+  sh scripts/mamba_env.sh workflow python scripts/telemetry.py "$telemetry_dir/$run_stamp".*.jsonl \
+    --trace "$telemetry_dir/$run_stamp.trace.json" | tee "$telemetry_dir/$run_stamp.summary.txt"
+fi